@@ -0,0 +1,190 @@
+"""
+Output helpers shared by the dashboard builders.
+
+atomic_write() writes to a temp file in the same folder and renames it over the
+target, so the CMS (or a deploy hook) never serves a half-written file.
+
+Fingerprints let a builder skip work when nothing it reads has changed:
+  1. stat key   — size + mtime of the DB and its -wal file, plus the "static"
+                  inputs (template, vendor JS, code, date). If these match the
+                  last build, nothing can have changed: skip without a query.
+  2. content    — when the stat key moved (any write to the DB, including ones
+                  to tables the page never reads), hash the rows the page is
+                  built from. Same hash -> still skip, just remember the new stat.
+The last fingerprint lives in a hidden sidecar next to the output
+(.<name>.fingerprint). PRAGMA data_version isn't used here: it only tracks
+changes relative to one open connection, so it means nothing to a fresh process.
+
+publish() is atomic_write() plus pre-compressed siblings (<name>.gz, and
+<name>.br when the optional `brotli` package is installed) for web servers that
+serve them directly (nginx gzip_static / brotli_static, Caddy precompressed).
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+
+from db import reading
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESSED_SUFFIXES = (".gz", ".br")
+
+
+def atomic_write(path, data):
+    """Write str/bytes to `path` via temp file + rename (atomic on POSIX)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix="." + os.path.basename(path) + ".",
+                               suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)  # mkstemp is 0600; the web server must be able to read it
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return path
+
+
+def publish(path, data):
+    """atomic_write() + .gz/.br siblings. Siblings go first so they are never
+    older than the file they shadow; a stale .br is removed if brotli is gone."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    atomic_write(path + ".gz", gzip.compress(data, 9, mtime=0))
+    if brotli is not None:
+        atomic_write(path + ".br", brotli.compress(data, quality=11))
+    elif os.path.exists(path + ".br"):
+        os.remove(path + ".br")
+    return atomic_write(path, data)
+
+
+def remove(path):
+    """Delete a published file and its compressed siblings."""
+    for p in (path,) + tuple(path + s for s in COMPRESSED_SUFFIXES):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def digest(*parts):
+    """sha256 hex over str/bytes parts."""
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p.encode("utf-8") if isinstance(p, str) else p)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return digest(f.read())
+
+
+def db_stat_key(db_path):
+    out = []
+    for suffix in ("", "-wal"):
+        try:
+            st = os.stat(db_path + suffix)
+            out.append(f"{st.st_size}:{st.st_mtime_ns}")
+        except FileNotFoundError:
+            out.append("-")
+    return "|".join(out)
+
+
+def db_content_hash(db_path, queries):
+    """sha256 over every row returned by `queries` (list of SQL strings). A query
+    against a missing table counts as empty rather than failing the build."""
+    h = hashlib.sha256()
+    with reading(db_path) as conn:
+        for sql in queries:
+            h.update(sql.encode("utf-8"))
+            try:
+                cur = conn.execute(sql)
+            except sqlite3.OperationalError:
+                continue
+            while True:
+                rows = cur.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    h.update(repr(row).encode("utf-8"))
+    return h.hexdigest()
+
+
+def state_path(out_path, name=None):
+    folder = os.path.dirname(os.path.abspath(out_path))
+    return os.path.join(folder, f".{name or os.path.basename(out_path)}.fingerprint")
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class Fingerprint:
+    """Decide whether a build can be skipped, and record it once it's done.
+
+        fp = Fingerprint(state_file, db_path, queries, static=[...], outputs=[...])
+        if fp.unchanged(): return            # nothing to do
+        ...render + atomic_write...
+        fp.save()                            # after the outputs are in place
+    """
+
+    def __init__(self, state_file, db_path, queries, static=(), outputs=()):
+        self.state_file = state_file
+        self.db_path = db_path
+        self.queries = list(queries)
+        self.static = digest(*static)
+        self.outputs = list(outputs)
+        self.last = _load(state_file)
+        self.stat = None
+        self.content = None
+
+    def _measure(self):
+        # stat BEFORE hashing: a write landing in between moves the stat again, so
+        # the next run re-hashes instead of trusting a stale content hash
+        self.stat = db_stat_key(self.db_path)
+        self.content = db_content_hash(self.db_path, self.queries)
+
+    def unchanged(self):
+        if not all(os.path.exists(p) for p in self.outputs):
+            return False
+        if self.last.get("static") != self.static:
+            return False
+        if self.last.get("stat") == db_stat_key(self.db_path):
+            return True
+        self._measure()
+        if self.last.get("content") != self.content:
+            return False
+        self.save()  # same rows, new stat: remember it so the next check is free
+        return True
+
+    def measure(self):
+        """Stat + hash the DB now unless unchanged() already has. A build calls it
+        before opening the snapshot it reads from (db.snapshot), so the recorded
+        hash is never newer than the rows the outputs were rendered from."""
+        if self.content is None:
+            self._measure()
+
+    def save(self):
+        self.measure()
+        atomic_write(self.state_file, json.dumps({
+            "static": self.static,
+            "stat": self.stat,
+            "content": self.content,
+        }))
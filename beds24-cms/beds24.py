@@ -0,0 +1,284 @@
+"""
+One entry point for the whole folder: `python beds24.py <command> [options]`.
+
+Commands are steps, and steps chain with "+" into a single process:
+
+    python beds24.py fetch + build --reports       # what run.sh does nightly
+    python beds24.py messages + build --inbox      # what run_messages.sh does
+
+Within one run the Beds24 client (and its access token), the DB connection and
+the dashboard summary are made once and shared by every step, and each command
+imports only the modules it uses, so `check` never loads the dashboard code and
+a chain pays interpreter start-up once instead of once per script. The
+standalone scripts (fetch.py, messages_fetch.py, build_dashboard.py ...) still
+work; these commands call the same functions.
+
+Run:  python beds24.py [--db PATH] fetch [--days-back 365] [--days-fwd 365] [--skip-availability]
+      python beds24.py messages [--max-age 120] [--full] [--force] [--deep] [--deep-credits 25]
+      python beds24.py messages --pull-all [--cycles 10] [--sweep] [--restart]
+      python beds24.py messages --daemon [--no-build]
+      python beds24.py build [--reports] [--inbox] [--split [DIR]] [--force]
+      python beds24.py check
+      python beds24.py diagnose [--targeted | --safe | --booking ID]
+      python beds24.py <command> -h
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from common import DB_PATH
+
+STEP_SEPARATOR = "+"
+
+
+class Context:
+    """State shared by the steps of one run. Nothing is opened until a step asks
+    for it: `check` never touches the DB, `build` never makes a client."""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.summary = None  # build_summary() result, reused by later build steps
+        self._client = None
+        self._conn = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from beds24_client import Beds24Client
+            self._client = Beds24Client()
+        return self._client
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            from db import connect
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = connect(self.db_path)
+        return self._conn
+
+    def require_db(self):
+        if self._conn is None and not os.path.exists(self.db_path):
+            raise SystemExit(f"{self.db_path} not found — run `beds24.py fetch` first "
+                             "to load bookings.")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+
+# --- fetch ------------------------------------------------------------------
+
+def fetch_arguments(ap):
+    from fetch import add_arguments
+    add_arguments(ap)
+
+
+def cmd_fetch(ctx, args):
+    from fetch import run
+    run(ctx.client, ctx.conn, args.days_back, args.days_fwd, args.skip_availability)
+    ctx.summary = None  # bookings changed under it
+
+
+# --- messages ---------------------------------------------------------------
+
+def messages_arguments(ap):
+    from messages_fetch import add_arguments
+    add_arguments(ap)
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--pull-all", action="store_true",
+                      help="Pull everything: bulk attempt, then the resumable sweep")
+    mode.add_argument("--daemon", action="store_true",
+                      help="Keep polling with an adaptive interval (messages_daemon.py)")
+    ap.add_argument("--no-build", action="store_true",
+                    help="--daemon: don't rebuild messages-dashboard.html")
+    from pull_all_messages import add_arguments as pull_all_arguments
+    pull_all_arguments(ap.add_argument_group("--pull-all"))
+
+
+def cmd_messages(ctx, args):
+    ctx.require_db()
+    if args.daemon:
+        from messages_daemon import MessagesDaemon, _log
+        daemon = MessagesDaemon(ctx.client, ctx.db_path, args.max_age,
+                                build=not args.no_build,
+                                deploy_cmd=os.environ.get("MESSAGES_DEPLOY_CMD") or None)
+        _log(f"messages poller started (pid {os.getpid()})")
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.close()
+        _log("messages poller stopped")
+    elif args.pull_all:
+        from pull_all_messages import pull_all
+        pull_all(ctx.client, ctx.conn, args.cycles, args.sweep, args.restart)
+    else:
+        from messages_fetch import poll
+        poll(ctx.client, ctx.conn, args.max_age, args.full, args.force, args.deep,
+             args.deep_credits)
+
+
+# --- build ------------------------------------------------------------------
+
+def build_arguments(ap):
+    ap.add_argument("--reports", action="store_true",
+                    help="Every dashboard in build_dashboard.OUTPUTS, from one summary")
+    ap.add_argument("--inbox", action="store_true", help="messages-dashboard.html + threads/")
+    ap.add_argument("--split", nargs="?", const=True, default=None, metavar="DIR",
+                    help="Split-mode dashboard (shell + hashed summary + manifest) in DIR "
+                         "(default ./site)")
+    ap.add_argument("--force", action="store_true",
+                    help="Rebuild even if the inputs match the last build")
+
+
+def cmd_build(ctx, args):
+    if not (args.reports or args.inbox or args.split):
+        args.reports = args.inbox = True
+    if args.reports or args.split:
+        _build_reports(ctx, args)
+    if args.inbox:
+        from build_messages_dashboard import build
+        path, inbox = build(ctx.db_path, force=args.force)
+        if inbox is None:
+            print(f"Inbox unchanged: {path}")
+        else:
+            s = inbox["summary"]
+            print(f"Inbox written to {path}")
+            print(f"  threads={s['total_threads']} unanswered={s['unanswered']} "
+                  f"channels={list(s['by_channel'])}")
+
+
+def _build_reports(ctx, args):
+    import build_dashboard as B
+    # an already computed summary is reused (and renders without the fingerprint
+    # check); otherwise each artifact set checks its own fingerprint
+    if args.reports:
+        paths, summary = B.build_all(ctx.db_path, summary=ctx.summary, force=args.force)
+        names = ", ".join(os.path.basename(p) for p in paths)
+        print(("Dashboards written: " if summary else "Dashboards unchanged: ") + names)
+        ctx.summary = summary or ctx.summary
+    if args.split:
+        out_dir = B.SPLIT_DIR if args.split is True else args.split
+        manifest, summary = B.build_split(ctx.db_path, out_dir, summary=ctx.summary,
+                                          force=args.force)
+        print(("Split dashboard written to " if summary else "Split dashboard unchanged: ")
+              + f"{out_dir} (summary {manifest['summary']})")
+        ctx.summary = summary or ctx.summary
+    if ctx.summary is not None:
+        s = ctx.summary
+        print(f"  properties={s['counts']['properties']} bookings={s['counts']['bookings']} "
+              f"this-month occ={s['kpi_this_month']['occupancy']:.1%}")
+
+
+# --- check / diagnose -------------------------------------------------------
+
+def cmd_check(ctx, args):
+    from check_messages import main
+    main(ctx.client)
+
+
+def diagnose_arguments(ap):
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--targeted", action="store_true",
+                      help="Current and recent guests only, stops on 429 (diagnose_messages2.py)")
+    mode.add_argument("--safe", action="store_true",
+                      help="At most 2 requests (probe_messages_once.py)")
+    mode.add_argument("--booking", metavar="ID",
+                      help="Dump what the API returns for one booking (probe_one_booking.py)")
+
+
+def cmd_diagnose(ctx, args):
+    if args.booking:
+        from probe_one_booking import probe
+        probe(ctx.client, args.booking.strip())
+        return
+    if args.targeted:
+        from diagnose_messages2 import main
+    elif args.safe:
+        from probe_messages_once import main
+    else:
+        from diagnose_messages import main
+    main(ctx.client)
+
+
+# name -> (help, add-arguments function or None, handler)
+COMMANDS = {
+    "fetch": ("Pull properties, rooms, bookings and availability into the DB",
+              fetch_arguments, cmd_fetch),
+    "messages": ("Poll guest messages (incremental), pull them all, or keep polling",
+                 messages_arguments, cmd_messages),
+    "build": ("Render the dashboards and/or the inbox (default: both)",
+              build_arguments, cmd_build),
+    "check": ("One API call: how many messages Beds24 holds, and credit usage",
+              None, cmd_check),
+    "diagnose": ("Probe the messages API and save what comes back under raw/",
+                 diagnose_arguments, cmd_diagnose),
+}
+
+
+def split_steps(argv):
+    """['fetch', '+', 'build', '--reports'] -> [['fetch'], ['build', '--reports']]."""
+    steps = [[]]
+    for arg in argv:
+        if arg == STEP_SEPARATOR:
+            steps.append([])
+        else:
+            steps[-1].append(arg)
+    return steps
+
+
+def main_parser():
+    ap = argparse.ArgumentParser(
+        prog="beds24.py", formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Steps chain with '+' and run in one process, e.g.\n"
+                    "  beds24.py fetch + build --reports",
+        epilog="commands:\n" + "\n".join(f"  {name:<10}{help_}"
+                                         for name, (help_, _, _) in COMMANDS.items()))
+    ap.add_argument("--db", default=DB_PATH, help="SQLite DB (default data/beds24.db)")
+    ap.add_argument("command", choices=COMMANDS, metavar="command")
+    return ap
+
+
+def parse(argv):
+    """argv -> (global options, [(name, options), ...]). Every step is parsed
+    before any runs, so a typo in the last one doesn't cost a fetch."""
+    ap = main_parser()
+    first, *rest = split_steps(argv)
+    # global options go before the first command; the rest is that command's
+    i = next((i for i, a in enumerate(first) if a in COMMANDS), len(first))
+    opts = ap.parse_args(first[:i + 1])
+    steps = []
+    for name, step_argv in [(opts.command, first[i + 1:])] + [(s[0] if s else "", s[1:])
+                                                              for s in rest]:
+        if name not in COMMANDS:
+            ap.error(f"expected a command after '{STEP_SEPARATOR}', one of: "
+                     + ", ".join(COMMANDS))
+        help_, add_arguments, _ = COMMANDS[name]
+        sub = argparse.ArgumentParser(prog=f"beds24.py {name}", description=help_)
+        if add_arguments:
+            add_arguments(sub)
+        steps.append((name, sub.parse_args(step_argv)))
+    return opts, steps
+
+
+def main(argv=None):
+    opts, steps = parse(sys.argv[1:] if argv is None else argv)
+    ctx = Context(opts.db)
+    try:
+        for name, args in steps:
+            t0 = time.perf_counter()
+            COMMANDS[name][2](ctx, args)
+            if len(steps) > 1:
+                print(f"[{name}: {time.perf_counter() - t0:.1f}s]")
+    finally:
+        ctx.close()
+    return ctx
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Paged bookings query over data/beds24.db — the bookings feed without loading or
+sorting the whole table.
+
+Keyset pagination on (arrival, id): each page ends with a cursor encoding the last
+row's (arrival, id), and the next page is `WHERE (arrival, id) > (?, ?) ORDER BY
+arrival, id LIMIT n` — an index range scan, so page 1000 costs the same as page 1
+however many bookings there are. Filters (property, channel, status, arrival
+range) each have an index that keeps the same (arrival, id) order:
+
+    idx_bookings_arrival    (arrival, id)
+    idx_bookings_property   (property_id, arrival, id)
+    idx_bookings_status     (status, arrival, id)
+    idx_bookings_channel    (<channel label>, arrival, id)   -- expression index
+
+The channel label is CHANNEL_SQL, the SQL twin of metrics._channel() (referer,
+else channel, else "Direct/Other"), so the filter matches what the dashboard shows.
+
+Rows come back in the same shape as metrics.feed_row() / the summary's "feed".
+
+Run:  python bookings_query.py [--property 101] [--channel Airbnb] [--status confirmed]
+                               [--from 2026-01-01] [--to 2026-02-01] [--limit 20] [--cursor X]
+"""
+
+import argparse
+import base64
+import datetime as dt
+import json
+
+from common import DB_PATH
+from db import connect, reading
+from metrics import BOOKING_COLUMNS, feed_row
+
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+CHANNEL_SQL = ("COALESCE(NULLIF(TRIM(COALESCE(NULLIF(referer, ''), NULLIF(channel, ''))), ''), "
+               "'Direct/Other')")
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_bookings_arrival ON bookings(arrival, id)",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_property ON bookings(property_id, arrival, id)",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status, arrival, id)",
+    f"CREATE INDEX IF NOT EXISTS idx_bookings_channel ON bookings({CHANNEL_SQL}, arrival, id)",
+]
+
+
+def ensure_indexes(conn):
+    for sql in INDEXES:
+        conn.execute(sql)
+    conn.commit()
+
+
+def encode_cursor(arrival, booking_id):
+    raw = json.dumps([arrival, booking_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """(arrival, id) from a cursor token; ValueError if it isn't one of ours."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        arrival, booking_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"bad cursor: {token!r}") from e
+    if not isinstance(arrival, str) or not isinstance(booking_id, int):
+        raise ValueError(f"bad cursor: {token!r}")
+    return arrival, booking_id
+
+
+def _as_list(v):
+    if v is None or v == "":
+        return []
+    if isinstance(v, (list, tuple)):
+        return [x for x in v if x not in (None, "")]
+    return [x.strip() for x in str(v).split(",") if x.strip()]
+
+
+def query_bookings(conn, property_id=None, channel=None, status=None,
+                   arrival_from=None, arrival_to=None, cursor=None, limit=PAGE_SIZE,
+                   today=None):
+    """One page of bookings ordered by (arrival, id).
+
+    property_id / channel / status take a single value, a list, or a comma-separated
+    string. arrival_from is inclusive, arrival_to exclusive (ISO dates). Returns
+    {"rows": [...], "next": cursor or None}."""
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    where, params = ["arrival IS NOT NULL"], []
+    for col, values in (("property_id", [int(p) for p in _as_list(property_id)]),
+                        (CHANNEL_SQL, _as_list(channel)),
+                        ("status", _as_list(status))):
+        if values:
+            where.append(f"{col} IN ({','.join('?' * len(values))})")
+            params += values
+    if arrival_from:
+        where.append("arrival >= ?")
+        params.append(str(arrival_from))
+    if arrival_to:
+        where.append("arrival < ?")
+        params.append(str(arrival_to))
+    if cursor:
+        where.append("(arrival, id) > (?, ?)")
+        params += list(decode_cursor(cursor))
+    sql = (f"SELECT {', '.join(BOOKING_COLUMNS)} FROM bookings WHERE {' AND '.join(where)} "
+           f"ORDER BY arrival, id LIMIT ?")
+    cur = conn.execute(sql, params + [limit + 1])
+    cols = [d[0] for d in cur.description]
+    found = [dict(zip(cols, r)) for r in cur.fetchall()]
+    today = today or dt.date.today()
+    rows = [feed_row(b, today) for b in found[:limit]]
+    nxt = None
+    if len(found) > limit:
+        last = found[limit - 1]
+        nxt = encode_cursor(last["arrival"], last["id"])
+    return {"rows": rows, "next": nxt}
+
+
+def feed_page(db_path, limit=PAGE_SIZE, today=None, **filters):
+    """First page of the dashboard feed: arrivals from 14 days ago onward,
+    with property names filled in."""
+    today = today or dt.date.today()
+    filters.setdefault("arrival_from", (today - dt.timedelta(days=14)).isoformat())
+    conn = connect(db_path)
+    try:
+        ensure_indexes(conn)  # a write (and a commit): not on a snapshot's connection
+    finally:
+        conn.close()
+    with reading(db_path) as conn:
+        page = query_bookings(conn, limit=limit, today=today, **filters)
+        names = dict(conn.execute("SELECT id, name FROM properties").fetchall())
+    for r in page["rows"]:
+        r["property"] = names.get(r["property_id"], r["property_id"])
+    return page
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--property", default=None, help="Property id(s), comma-separated")
+    ap.add_argument("--channel", default=None)
+    ap.add_argument("--status", default=None)
+    ap.add_argument("--from", dest="arrival_from", default=None, help="Arrival on/after (ISO)")
+    ap.add_argument("--to", dest="arrival_to", default=None, help="Arrival before (ISO)")
+    ap.add_argument("--limit", type=int, default=20)
+    ap.add_argument("--cursor", default=None)
+    args = ap.parse_args()
+    filters = {"property_id": args.property, "channel": args.channel, "status": args.status,
+               "arrival_to": args.arrival_to, "cursor": args.cursor}
+    if args.arrival_from:
+        filters["arrival_from"] = args.arrival_from
+    page = feed_page(args.db, limit=args.limit, **filters)
+    print(json.dumps(page, indent=2))
@@ -2,20 +2,60 @@
 Dashboard generator — reads the SQLite data via metrics.build_summary() and writes
 a single self-contained dashboard.html (data embedded, Chart.js from CDN).
 
-Run:  python build_dashboard.py
-Output: ./dashboard.html
+Run:  python build_dashboard.py                 # ./dashboard.html
+      python build_dashboard.py --all           # every artifact in OUTPUTS, one summary
+      python build_dashboard.py --all --force   # rebuild even if nothing changed
+      python build_dashboard.py --split [DIR]   # shell + versioned data, default ./site
+      python build_dashboard.py --serve [PORT]  # live local server (dashboard_server.py)
+
+Split mode writes the page without its data, for a CMS that caches aggressively:
+  chart.<hash>.js       vendored Chart.js          } content-hashed names: cache
+  dashboard.<hash>.html the page shell (no data)   } these forever (immutable)
+  summary.<hash>.json   the numbers, one per build }
+  manifest.json         names of the current three — serve with no-cache
+  dashboard.html        stable copy of the shell, for iframes that need a fixed URL
+The shell fetches manifest.json, then the summary it names, so a rebuild only
+transfers the small manifest and the new summary.
+
+Builds are skipped when the bookings/rooms/properties rows, the template, the
+vendored Chart.js, the metrics code and today's date all match the last build
+(see artifacts.py). Outputs are written atomically.
 """
 
 import argparse
+import datetime as dt
 import json
 import os
 
-from metrics import build_summary
+from artifacts import Fingerprint, digest, file_digest, publish, remove, state_path
+from columnar import encode
+from common import DB_PATH, HERE
+from db import snapshot
+from metrics import BOOKING_COLUMNS, build_summary
 
-HERE = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(HERE, "data", "beds24.db")
 OUT_PATH = os.path.join(HERE, "dashboard.html")
 VENDOR_JS = os.path.join(HERE, "vendor", "chart.umd.js")
+SPLIT_DIR = os.path.join(HERE, "site")
+SPLIT_KEEP = 3  # older summaries kept so pages loaded mid-deploy still resolve
+
+# Every artifact the daily run publishes, rendered from ONE build_summary() call:
+# (output file relative to this folder, inline Chart.js?). Add variants here.
+OUTPUTS = [
+    ("dashboard.html", False),
+    ("dashboard-embed.html", True),
+]
+
+# Everything build_summary() reads from the DB (metrics_cache is derived, so it's
+# left out: writing it must not count as a change).
+SOURCE_QUERIES = [
+    f"SELECT {', '.join(BOOKING_COLUMNS)}, room_id FROM bookings ORDER BY id",
+    "SELECT id, property_id, name, qty FROM rooms ORDER BY id",
+    "SELECT room_id, date, num_available FROM availability ORDER BY room_id, date",
+    "SELECT id, name, currency FROM properties ORDER BY id",
+    "SELECT value FROM meta WHERE key='last_fetch'",
+]
+CODE_FILES = ["metrics.py", "pickup.py", "sketches.py", "artifacts.py", "columnar.py",
+              "bookings_query.py", "roomgrid.py"]
 
 TEMPLATE = r"""<!DOCTYPE html>
 <html lang="en">
@@ -66,6 +106,12 @@ TEMPLATE = r"""<!DOCTYPE html>
   .pill.new{background:rgba(79,156,249,.15);color:var(--accent)}
   .pill.request{background:rgba(210,153,34,.15);color:var(--amber)}
   .pill.cancelled,.pill.black{background:rgba(248,81,73,.12);color:var(--red)}
+  .controls{display:flex;gap:8px;flex-wrap:wrap;align-items:center;margin-bottom:12px}
+  select,input,button{background:var(--panel2);color:var(--text);border:1px solid var(--line);
+    border-radius:8px;padding:6px 10px;font:inherit;font-size:13px}
+  button{cursor:pointer} button:disabled{opacity:.5;cursor:default}
+  #gridCanvas{max-height:none;display:block}
+  .swatch{display:inline-block;width:12px;height:12px;border-radius:3px;vertical-align:-2px;margin-right:4px}
 </style>
 </head>
 <body>
@@ -80,6 +126,9 @@ TEMPLATE = r"""<!DOCTYPE html>
   <div class="tab" data-view="revenue">Revenue &amp; RevPAR</div>
   <div class="tab" data-view="feed">Bookings Feed</div>
   <div class="tab" data-view="pace">Pace &amp; Pickup</div>
+  <div class="tab" data-view="dist">Distributions</div>
+  <div class="tab" data-view="explore">Explorer</div>
+  <div class="tab" data-view="grid">Room Calendar</div>
 </div>
 <main>
   <!-- OCCUPANCY -->
@@ -103,9 +152,17 @@ TEMPLATE = r"""<!DOCTYPE html>
   <!-- FEED -->
   <section class="view" id="view-feed">
     <div class="panel"><h2>Upcoming &amp; recent bookings</h2>
+      <div class="controls">
+        <select id="feedProp"><option value="">All properties</option></select>
+        <select id="feedChan"><option value="">All channels</option></select>
+        <select id="feedStatus"><option value="">Any status</option></select>
+        <input id="feedFrom" type="date" title="Arrival on or after"/>
+        <span class="muted" id="feedNote"></span>
+      </div>
       <table id="feedTable"><thead><tr><th>Arrival</th><th>Guest</th><th>Property</th>
       <th>Nights</th><th>Channel</th><th class="num">Value</th><th>Status</th></tr></thead>
       <tbody></tbody></table>
+      <div class="controls" style="margin:12px 0 0"><button id="feedMore">Load more</button></div>
     </div>
   </section>
   <!-- PACE -->
@@ -115,10 +172,76 @@ TEMPLATE = r"""<!DOCTYPE html>
       <div class="panel"><h2>On-the-books: next 90 days vs last year</h2><canvas id="paceChart"></canvas></div>
       <div class="panel"><h2>Booking lead time</h2><canvas id="leadChart"></canvas></div>
     </div>
+    <div class="panel"><h2>Pace curve: revenue on the books for the next 90 days, by days before</h2>
+      <canvas id="pickupChart"></canvas></div>
+  </section>
+  <!-- DISTRIBUTIONS -->
+  <section class="view" id="view-dist">
+    <div class="cards" id="distCards"></div>
+    <div class="grid2">
+      <div class="panel"><h2>Lead time (days)</h2><canvas id="distLeadChart"></canvas></div>
+      <div class="panel"><h2>Length of stay (nights)</h2><canvas id="distLosChart"></canvas></div>
+    </div>
+    <div class="panel"><h2>By channel (active bookings)</h2>
+      <table id="distChanTable"><thead><tr><th>Channel</th><th class="num">Bookings</th>
+      <th class="num">Lead p50</th><th class="num">Lead p90</th><th class="num">Stay p50</th>
+      <th class="num">Stay p90</th><th class="num">Rate p50</th><th class="num">Rate p90</th></tr></thead>
+      <tbody></tbody></table>
+    </div>
+    <div class="panel"><h2>By property (active bookings)</h2>
+      <table id="distPropTable"><thead><tr><th>Property</th><th class="num">Bookings</th>
+      <th class="num">Lead p50</th><th class="num">Lead p90</th><th class="num">Stay p50</th>
+      <th class="num">Stay p90</th><th class="num">Rate p50</th><th class="num">Rate p90</th></tr></thead>
+      <tbody></tbody></table>
+    </div>
+  </section>
+  <!-- EXPLORER -->
+  <section class="view" id="view-explore">
+    <div class="panel">
+      <div class="controls">
+        <input id="exFrom" type="date" title="First night"/> to
+        <input id="exTo" type="date" title="Last night"/>
+        <select id="exGran"><option value="day">Daily</option><option value="week">Weekly</option>
+          <option value="month">Monthly</option></select>
+        <select id="exProp"><option value="">All properties</option></select>
+        <select id="exCmp"><option value="year">vs same dates last year</option>
+          <option value="prev">vs previous period</option><option value="">no comparison</option></select>
+        <span class="muted" id="exNote"></span>
+      </div>
+    </div>
+    <div class="cards" id="exCards"></div>
+    <div class="panel"><h2>Revenue and occupancy</h2><canvas id="exChart"></canvas></div>
+  </section>
+  <!-- ROOM CALENDAR -->
+  <section class="view" id="view-grid">
+    <div class="cards" id="gridCards"></div>
+    <div class="panel"><h2>Rooms × nights</h2>
+      <div class="controls" id="gridLegend"></div>
+      <div style="overflow-x:auto"><canvas id="gridCanvas"></canvas></div>
+      <div class="muted" id="gridTip" style="min-height:18px;margin-top:8px"></div>
+    </div>
   </section>
 </main>
 <script>
-const DATA = __DATA__;
+// draw() renders one summary: called with the embedded data, or (split mode)
+// with summary.<hash>.json once manifest.json says which one is current.
+// decode() undoes columnar.encode(): per-field arrays back into row objects.
+function decode(D){
+  if(D._enc!==1) return D;
+  const out=Object.assign({},D), dict=D._dict||{};
+  delete out._enc; delete out._dict;
+  for(const name of ["monthly","feed","channel_mix"]){
+    const t=D[name]; if(!t||!t.cols) continue;
+    const fields=Object.keys(t.cols).map(f=>[f,t.cols[f],dict[f]]);
+    out[name]=Array.from({length:t.n},(_,i)=>{
+      const row={};
+      for(const [f,col,d] of fields) row[f]=d?d[col[i]]:col[i];
+      return row;
+    });
+  }
+  return out;
+}
+function draw(DATA){
 const CUR = DATA.currency || "";
 const money = v => CUR + (v==null?0:v).toLocaleString(undefined,{maximumFractionDigits:0});
 const pct = v => (v*100).toFixed(1) + "%";
@@ -192,14 +315,47 @@ document.querySelector("#chanTable tbody").innerHTML = chan.map(c=>
   || `<tr><td colspan="5" class="muted">No channel data yet</td></tr>`;
 
 // ---- Feed ----
-document.querySelector("#feedTable tbody").innerHTML = DATA.feed.map(b=>{
+// First page is embedded; more pages (and filters) come from dashboard_server.py's
+// /api/bookings by keyset cursor. As a static file, only the embedded page shows.
+const feedBody = document.querySelector("#feedTable tbody");
+function feedRow(b){
   const st=(b.status||"").toLowerCase();
-  const when = b.days_until===0?"today":(b.days_until>0?`in ${b.days_until}d`:`${-b.days_until}d ago`);
+  const when = b.days_until==null?"":(b.days_until===0?"today":(b.days_until>0?`in ${b.days_until}d`:`${-b.days_until}d ago`));
   return `<tr><td>${b.arrival||"—"}<div class="muted" style="font-size:11px">${when}</div></td>
     <td>${b.guest}</td><td>${b.property??"—"}</td><td>${b.nights??"—"}</td>
     <td><span class="chip">${b.channel}</span></td><td class="num">${money(b.price)}</td>
     <td><span class="pill ${st}">${b.status||"—"}</span></td></tr>`;
-}).join("") || `<tr><td colspan="7" class="muted">No bookings in range</td></tr>`;
+}
+const propName = Object.fromEntries(DATA.properties.map(p=>[p.id,p.name]));
+const opts = (id,pairs)=>document.getElementById(id).innerHTML += pairs.map(([v,l])=>`<option value="${v}">${l}</option>`).join("");
+opts("feedProp", DATA.properties.map(p=>[p.id,p.name]));
+opts("feedChan", DATA.channel_mix.map(c=>[c.channel,c.channel]));
+opts("feedStatus", ["confirmed","new","request","cancelled"].map(s=>[s,s]));
+document.getElementById("feedFrom").value = new Date(Date.now()-14*864e5).toISOString().slice(0,10);
+let feedNext = DATA.feed_next, feedRows = DATA.feed.slice();
+function feedShow(){
+  feedBody.innerHTML = feedRows.map(feedRow).join("") || `<tr><td colspan="7" class="muted">No bookings in range</td></tr>`;
+  document.getElementById("feedMore").disabled = !feedNext;
+}
+function feedFetch(reset){
+  const q = new URLSearchParams();
+  for(const [k,id] of [["property","feedProp"],["channel","feedChan"],["status","feedStatus"],["from","feedFrom"]]){
+    const v=document.getElementById(id).value; if(v) q.set(k,v);
+  }
+  if(!reset && feedNext) q.set("cursor",feedNext);
+  return fetch("api/bookings?"+q).then(r=>{if(!r.ok) throw new Error(r.status); return r.json();})
+    .then(page=>{
+      page.rows.forEach(r=>r.property=propName[r.property_id]??r.property_id);
+      feedRows = reset ? page.rows : feedRows.concat(page.rows);
+      feedNext = page.next; feedShow();
+      document.getElementById("feedNote").textContent="";
+    })
+    .catch(()=>{document.getElementById("feedNote").textContent=
+      "More rows and filters need the live server (python dashboard_server.py).";});
+}
+["feedProp","feedChan","feedStatus","feedFrom"].forEach(id=>document.getElementById(id).onchange=()=>feedFetch(true));
+document.getElementById("feedMore").onclick=()=>feedFetch(false);
+feedShow();
 
 // ---- Pace ----
 const p=DATA.pace, ty=p.this_year, ly=p.last_year;
@@ -212,6 +368,13 @@ document.getElementById("paceCards").innerHTML =
        p.revenue_delta_pct==null?"":`${deltaSign}${p.revenue_delta_pct}%`)
 + card("Bookings next 90d", ty.bookings, `vs ${ly.bookings} last year`);
 
+const pk=DATA.pickup, fc=pk.forecast;
+document.getElementById("paceCards").innerHTML +=
+  card("Forecast revenue next 90d", money(fc.forecast.revenue),
+       `${money(fc.on_the_books.revenue)} on books + ${money(fc.pickup.revenue)} pickup (LY)`)
++ card("Forecast nights next 90d", Math.round(fc.forecast.nights),
+       `${Math.round(fc.on_the_books.nights)} on books + ${Math.round(fc.pickup.nights)} pickup`);
+
 new Chart(document.getElementById("paceChart"),{
   type:"bar",
   data:{labels:["Revenue","Nights sold","Bookings"],
@@ -223,6 +386,19 @@ new Chart(document.getElementById("paceChart"),{
     scales:{y:{ticks:{color:"#8b98a5"},grid:{color:"#2c3744"}},x:{ticks:{color:"#8b98a5"},grid:{display:false}}}}
 });
 
+const tyByK = Object.fromEntries(pk.this_year.map(p=>[p.days_before,p.revenue]));
+new Chart(document.getElementById("pickupChart"),{
+  type:"line",
+  data:{labels:pk.last_year.map(p=>p.days_before),
+    datasets:[
+      {label:"This year",data:pk.last_year.map(p=>tyByK[p.days_before]??null),borderColor:"#4f9cf9",backgroundColor:"#4f9cf9",tension:.3},
+      {label:"Last year",data:pk.last_year.map(p=>p.revenue),borderColor:"#6e7681",backgroundColor:"#6e7681",tension:.3}
+    ]},
+  options:{plugins:{legend:{labels:{color:"#8b98a5"}}},
+    scales:{y:{ticks:{color:"#8b98a5"},grid:{color:"#2c3744"}},
+      x:{title:{display:true,text:"days before window start",color:"#8b98a5"},ticks:{color:"#8b98a5"},grid:{display:false}}}}
+});
+
 const lt=DATA.lead_time;
 new Chart(document.getElementById("leadChart"),{
   type:"bar",
@@ -231,43 +407,321 @@ new Chart(document.getElementById("leadChart"),{
   options:{plugins:{legend:{display:false}},
     scales:{y:{ticks:{color:"#8b98a5"},grid:{color:"#2c3744"}},x:{ticks:{color:"#8b98a5"},grid:{display:false}}}}
 });
+
+// ---- Distributions ----
+const ds=DATA.distributions, dov=ds.overall;
+const q = v => v==null?"—":(+v).toFixed(0);
+document.getElementById("distCards").innerHTML =
+  card("Lead time p50 / p90", `${q(dov.lead_time.p50)}d / ${q(dov.lead_time.p90)}d`, `${dov.lead_time.n} bookings`)
++ card("Length of stay p50 / p90", `${q(dov.los.p50)} / ${q(dov.los.p90)}`, "nights")
++ card("Nightly rate p50 / p90", `${money(dov.nightly_rate.p50)} / ${money(dov.nightly_rate.p90)}`, "per night");
+function histChart(id,h,color){
+  new Chart(document.getElementById(id),{
+    type:"bar",
+    data:{labels:h.labels,datasets:[{label:"Bookings",data:h.counts,backgroundColor:color}]},
+    options:{plugins:{legend:{display:false}},
+      scales:{y:{ticks:{color:"#8b98a5"},grid:{color:"#2c3744"}},x:{ticks:{color:"#8b98a5"},grid:{display:false}}}}
+  });
+}
+histChart("distLeadChart",ds.histograms.lead_time,"#3fb950");
+histChart("distLosChart",ds.histograms.los,"#4f9cf9");
+function distRows(rows,key){
+  return rows.map(r=>`<tr><td>${r[key]??"—"}</td><td class="num">${r.los.n}</td>
+    <td class="num">${q(r.lead_time.p50)}d</td><td class="num">${q(r.lead_time.p90)}d</td>
+    <td class="num">${q(r.los.p50)}</td><td class="num">${q(r.los.p90)}</td>
+    <td class="num">${money(r.nightly_rate.p50)}</td><td class="num">${money(r.nightly_rate.p90)}</td></tr>`).join("")
+    || `<tr><td colspan="8" class="muted">No bookings yet</td></tr>`;
+}
+document.querySelector("#distChanTable tbody").innerHTML = distRows(ds.by_channel,"channel");
+document.querySelector("#distPropTable tbody").innerHTML = distRows(ds.by_property,"property");
+
+// ---- Explorer: any range / granularity / comparison from the daily cube ----
+// One prefix-sum array per selection, so every range is two lookups.
+const cube=DATA.cube, DAY=864e5, c0=Date.parse(cube.start+"T00:00:00Z");
+const iso = t => new Date(t).toISOString().slice(0,10);
+const dayIdx = d => Math.round((Date.parse(d+"T00:00:00Z")-c0)/DAY);
+const exSel = {};
+function selection(pid){
+  if(exSel[pid]) return exSel[pid];
+  const js = cube.properties.map((p,j)=>j).filter(j=>pid===""||String(cube.properties[j])===pid);
+  const sold=new Float64Array(cube.days+1), rev=new Float64Array(cube.days+1);
+  for(let i=0;i<cube.days;i++){
+    let s=0,r=0; for(const j of js){s+=cube.sold[j][i]; r+=cube.revenue_p[j][i];}
+    sold[i+1]=sold[i]+s; rev[i+1]=rev[i]+r;
+  }
+  return exSel[pid]={sold,rev,cap:js.reduce((c,j)=>c+cube.capacity[j],0)};
+}
+function kpi(sel,i0,i1){
+  i0=Math.min(Math.max(i0,0),cube.days); i1=Math.min(Math.max(i1,i0),cube.days);
+  const sold=sel.sold[i1]-sel.sold[i0], revenue=(sel.rev[i1]-sel.rev[i0])/100, avail=sel.cap*(i1-i0);
+  return {sold,revenue,avail,occ:avail?sold/avail:0,adr:sold?revenue/sold:0,revpar:avail?revenue/avail:0};
+}
+function lastYear(d){const t=new Date(d+"T00:00:00Z"); t.setUTCFullYear(t.getUTCFullYear()-1); return iso(t);}
+function buckets(from,to,gran){  // [{label,a,b}] with b exclusive, ISO dates
+  const out=[]; let a=from;
+  while(a<to){
+    const t=new Date(a+"T00:00:00Z");
+    if(gran==="day") t.setUTCDate(t.getUTCDate()+1);
+    else if(gran==="week") t.setUTCDate(t.getUTCDate()+7);
+    else {t.setUTCDate(1); t.setUTCMonth(t.getUTCMonth()+1);}
+    const b=iso(Math.min(t.getTime(),Date.parse(to+"T00:00:00Z")));
+    out.push({label:gran==="month"?a.slice(0,7):a,a,b}); a=b;
+  }
+  return out;
+}
+const delta=(v,w)=>!w?"":`<span class="${v>=w?"pos":"neg"}">${v>=w?"+":""}${((v/w-1)*100).toFixed(1)}%</span> vs ${money(w)}`;
+let exChart=null;
+function explore(){
+  const from=document.getElementById("exFrom").value, toIncl=document.getElementById("exTo").value;
+  if(!from||!toIncl||toIncl<from) return;
+  const to=iso(Date.parse(toIncl+"T00:00:00Z")+DAY), gran=document.getElementById("exGran").value;
+  const cmp=document.getElementById("exCmp").value, sel=selection(document.getElementById("exProp").value);
+  const len=dayIdx(to)-dayIdx(from);
+  const shift = d => cmp==="year" ? lastYear(d) : iso(Date.parse(d+"T00:00:00Z")-len*DAY);
+  const range = (a,b) => kpi(sel,dayIdx(a),dayIdx(b));
+  const cur=range(from,to), ref=cmp?range(shift(from),shift(to)):null;
+  const outside = dayIdx(from)<0 || dayIdx(to)>cube.days || (cmp && dayIdx(shift(from))<0);
+  document.getElementById("exNote").textContent = outside
+    ? `Data covers ${cube.start} to ${iso(c0+cube.days*DAY-DAY)}; nights outside count as empty.` : "";
+  const dp=(v,w)=>!w&&w!==0?"":`<span class="${v>=w?"pos":"neg"}">${v>=w?"+":""}${((v-w)*100).toFixed(1)} pts</span>`;
+  document.getElementById("exCards").innerHTML =
+    card("Occupancy", pct(cur.occ), (ref?dp(cur.occ,ref.occ):"")+` ${cur.sold}/${cur.avail} nights`)
+  + card("Revenue", money(cur.revenue), ref?delta(cur.revenue,ref.revenue):"")
+  + card("ADR", money(cur.adr), ref?delta(cur.adr,ref.adr):"")
+  + card("RevPAR", money(cur.revpar), ref?delta(cur.revpar,ref.revpar):"");
+  const bs=buckets(from,to,gran), rows=bs.map(x=>range(x.a,x.b));
+  const sets=[
+    {type:"bar",label:"Revenue",data:rows.map(r=>+r.revenue.toFixed(2)),backgroundColor:"#3a5573",yAxisID:"y"},
+    {type:"line",label:"Occupancy %",data:rows.map(r=>+(r.occ*100).toFixed(1)),borderColor:"#4f9cf9",backgroundColor:"#4f9cf9",yAxisID:"y1",tension:.3}];
+  if(cmp) sets.push({type:"line",label:"Occupancy % ("+(cmp==="year"?"last year":"previous")+")",
+    data:bs.map(x=>+(range(shift(x.a),shift(x.b)).occ*100).toFixed(1)),
+    borderColor:"#8b98a5",borderDash:[5,4],pointRadius:0,yAxisID:"y1",tension:.3});
+  if(exChart) exChart.destroy();
+  exChart=new Chart(document.getElementById("exChart"),{data:{labels:bs.map(x=>x.label),datasets:sets},
+    options:{plugins:{legend:{labels:{color:"#e6edf3"}}},
+      scales:{y:{position:"left",ticks:{color:"#8b98a5"},grid:{color:"#2c3744"}},
+              y1:{position:"right",min:0,max:100,ticks:{color:"#8b98a5"},grid:{display:false}},
+              x:{ticks:{color:"#8b98a5"},grid:{display:false}}}}});
+}
+opts("exProp", DATA.properties.map(p=>[p.id,p.name]));
+document.getElementById("exFrom").value = n30.period_start;
+document.getElementById("exTo").value = iso(Date.parse(n30.period_end+"T00:00:00Z")-DAY);
+["exFrom","exTo","exGran","exProp","exCmp"].forEach(id=>document.getElementById(id).onchange=explore);
+explore();
+
+// ---- Room calendar: one canvas row per room type, drawn run by run ----
+const grid=DATA.grid, GCOL={open:"#222b36",part:"#3a5573",full:"#4f9cf9",closed:"#6e4a1e",orphan:"#f85149"};
+const GLABEL={open:"Open",part:"Part sold",full:"Sold out",closed:"Closed / blocked",orphan:"Orphan gap"};
+document.getElementById("gridCards").innerHTML = grid.codes.map(c=>card(GLABEL[c],grid.totals[c],"room-nights")).join("");
+document.getElementById("gridLegend").innerHTML = grid.codes.map(c=>
+  `<span><span class="swatch" style="background:${GCOL[c]}"></span>${GLABEL[c]}</span>`).join("");
+(function(){
+  const cv=document.getElementById("gridCanvas"), LW=180, TOP=18, RH=14, CW=Math.max(2,Math.min(6,Math.floor(900/grid.days)));
+  const g0=Date.parse(grid.start+"T00:00:00Z");
+  cv.width=LW+grid.days*CW; cv.height=TOP+grid.rooms.length*RH;
+  const ctx=cv.getContext("2d");
+  ctx.font="11px sans-serif"; ctx.fillStyle="#8b98a5";
+  for(let d=0; d<grid.days; d++){
+    const t=new Date(g0+d*DAY);
+    if(t.getUTCDate()===1){ctx.fillText(t.toISOString().slice(0,7),LW+d*CW,12); ctx.fillRect(LW+d*CW,TOP-3,1,3);}
+  }
+  grid.rooms.forEach((r,y)=>{
+    ctx.fillStyle="#8b98a5";
+    ctx.fillText(String(r.property+" · "+r.name).slice(0,28),4,TOP+y*RH+10);
+    let x=0;
+    for(let i=0;i<r.runs.length;i+=2){
+      ctx.fillStyle=GCOL[grid.codes[r.runs[i]]];
+      ctx.fillRect(LW+x*CW,TOP+y*RH+1,r.runs[i+1]*CW,RH-2);
+      x+=r.runs[i+1];
+    }
+  });
+  cv.addEventListener("mousemove",e=>{
+    const b=cv.getBoundingClientRect(), d=Math.floor((e.clientX-b.left-LW)/CW), y=Math.floor((e.clientY-b.top-TOP)/RH);
+    const r=grid.rooms[y]; if(!r||d<0||d>=grid.days){document.getElementById("gridTip").textContent="";return;}
+    let x=0,code=0; for(let i=0;i<r.runs.length;i+=2){ if(d<x+r.runs[i+1]){code=r.runs[i];break;} x+=r.runs[i+1]; }
+    document.getElementById("gridTip").textContent=`${r.property} · ${r.name} · ${iso(g0+d*DAY)}: ${GLABEL[grid.codes[code]]}`;
+  });
+})();
+}
+__BOOT__
 </script>
 </body>
 </html>
 """
 
 
-def build(db_path=DB_PATH, out_path=OUT_PATH, inline=False):
-    """Render the dashboard.
+def render(summary, inline=False, chart_src=None):
+    """Dashboard HTML for an already-computed summary.
 
     inline=False -> references vendor/chart.umd.js (default; two files).
     inline=True  -> embeds Chart.js into the HTML so the file is fully
                     self-contained with ZERO external dependencies. Ideal for
                     dropping into / iframing from a CMS.
     """
-    summary = build_summary(db_path)
-    html = TEMPLATE.replace("__DATA__", json.dumps(summary))
+    payload = json.dumps(encode(summary), separators=(",", ":"))
+    html = TEMPLATE.replace("__BOOT__", "draw(decode(" + payload + "));")
     if inline:
-        with open(VENDOR_JS) as f:
-            chart_src = f.read()
+        if chart_src is None:
+            with open(VENDOR_JS) as f:
+                chart_src = f.read()
         html = html.replace(
             '<script src="vendor/chart.umd.js"></script>',
             "<script>\n" + chart_src + "\n</script>",
         )
-    with open(out_path, "w") as f:
-        f.write(html)
+    return html
+
+
+def fingerprint(db_path, outputs, state_file):
+    """Fingerprint of every input to the given outputs [(path, inline), ...]."""
+    static = [TEMPLATE, dt.date.today().isoformat(), repr([(os.path.basename(p), i)
+                                                           for p, i in outputs])]
+    static += [file_digest(os.path.join(HERE, f)) for f in CODE_FILES]
+    if any(inline for _, inline in outputs):
+        static.append(file_digest(VENDOR_JS))
+    return Fingerprint(state_file, db_path, SOURCE_QUERIES, static,
+                       [p for p, _ in outputs])
+
+
+def _summary(db_path, fp):
+    """build_summary() from one snapshot of the DB, so an ingest committing mid-build
+    can't mix old and new rows; fp is measured first (Fingerprint.measure)."""
+    fp.measure()
+    with snapshot(db_path):
+        return build_summary(db_path)
+
+
+def build(db_path=DB_PATH, out_path=OUT_PATH, inline=False, summary=None, force=False):
+    """Render the dashboard to out_path. Pass `summary` to reuse one already built.
+    Returns (out_path, summary); summary is None when the build was skipped."""
+    fp = fingerprint(db_path, [(out_path, inline)], state_path(out_path))
+    if summary is None and not force and fp.unchanged():
+        return out_path, None
+    if summary is None:
+        summary = _summary(db_path, fp)
+    publish(out_path, render(summary, inline))
+    fp.save()
     return out_path, summary
 
 
+def build_all(db_path=DB_PATH, outputs=OUTPUTS, out_dir=HERE, summary=None, force=False):
+    """Compute the summary once and render every configured output from it (or
+    from `summary`, as in build()). Returns (paths, summary); summary is None
+    when nothing changed."""
+    targets = [(os.path.join(out_dir, name), inline) for name, inline in outputs]
+    fp = fingerprint(db_path, targets, state_path(os.path.join(out_dir, "dashboards")))
+    paths = [p for p, _ in targets]
+    if summary is None and not force and fp.unchanged():
+        return paths, None
+    if summary is None:
+        summary = _summary(db_path, fp)
+    chart_src = None
+    for path, inline in targets:
+        if inline and chart_src is None:
+            with open(VENDOR_JS) as f:
+                chart_src = f.read()
+        publish(path, render(summary, inline, chart_src))
+    fp.save()
+    return paths, summary
+
+
+def _write_hashed(out_dir, stem, ext, data):
+    """Write data to <stem>.<hash>.<ext> unless that file already exists."""
+    name = f"{stem}.{digest(data)[:12]}.{ext}"
+    path = os.path.join(out_dir, name)
+    if os.path.exists(path):
+        os.utime(path)  # in use again: keep it out of _prune's reach
+    else:
+        publish(path, data)
+    return name
+
+
+def _prune(out_dir, stem, ext, keep):
+    """Delete all but the `keep` newest <stem>.<hash>.<ext> files."""
+    old = sorted((f for f in os.listdir(out_dir)
+                  if f.startswith(stem + ".") and f.endswith("." + ext) and f.count(".") == 2),
+                 key=lambda f: os.path.getmtime(os.path.join(out_dir, f)), reverse=True)
+    for f in old[keep:]:
+        remove(os.path.join(out_dir, f))
+
+
+def split_shell(chart_name):
+    """The page without data: loads chart_name, then fetches its summary."""
+    boot = ('fetch("manifest.json",{cache:"no-cache"}).then(r=>r.json())\n'
+            '  .then(m=>fetch(m.summary)).then(r=>r.json()).then(decode).then(draw)\n'
+            '  .catch(e=>{document.getElementById("builtAt").textContent="data failed to load";'
+            'console.error(e);});')
+    return (TEMPLATE.replace("__BOOT__", boot)
+            .replace('<script src="vendor/chart.umd.js"></script>',
+                     f'<script src="{chart_name}"></script>'))
+
+
+def build_split(db_path=DB_PATH, out_dir=SPLIT_DIR, keep=SPLIT_KEEP, summary=None,
+                force=False):
+    """Split-mode build (see module docstring); `summary` as in build(). Returns
+    (manifest, summary); summary is None when nothing changed."""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    fp = fingerprint(db_path, [(manifest_path, True)], state_path(manifest_path))
+    if summary is None and not force and fp.unchanged():
+        with open(manifest_path) as f:
+            return json.load(f), None
+    if summary is None:
+        summary = _summary(db_path, fp)
+    with open(VENDOR_JS, "rb") as f:
+        chart = _write_hashed(out_dir, "chart", "js", f.read())
+    shell_html = split_shell(chart)
+    shell = _write_hashed(out_dir, "dashboard", "html", shell_html)
+    stable = os.path.join(out_dir, "dashboard.html")
+    if not os.path.exists(stable) or file_digest(stable) != digest(shell_html.encode("utf-8")):
+        publish(stable, shell_html)
+    data = _write_hashed(out_dir, "summary", "json",
+                         json.dumps(encode(summary), separators=(",", ":")))
+    manifest = {"shell": shell, "chart": chart, "summary": data,
+                "generated_at": summary["generated_at"]}
+    publish(manifest_path, json.dumps(manifest, indent=2))
+    for stem, ext in (("summary", "json"), ("dashboard", "html"), ("chart", "js")):
+        _prune(out_dir, stem, ext, keep)
+    fp.save()
+    return manifest, summary
+
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--inline", action="store_true",
                     help="Inline Chart.js for a single, dependency-free file (for CMS embedding)")
     ap.add_argument("--out", default=None, help="Output path (default dashboard.html)")
+    ap.add_argument("--all", action="store_true",
+                    help="Render every artifact in OUTPUTS from a single summary")
+    ap.add_argument("--split", nargs="?", const=SPLIT_DIR, default=None, metavar="DIR",
+                    help="Write shell + hashed summary/Chart.js + manifest.json to DIR "
+                         "(default ./site)")
+    ap.add_argument("--force", action="store_true",
+                    help="Rebuild even if the inputs match the last build")
+    ap.add_argument("--serve", nargs="?", type=int, const=8765, default=None, metavar="PORT",
+                    help="Serve the dashboards from memory instead of writing files")
     args = ap.parse_args()
-    out = args.out or OUT_PATH
-    path, summary = build(out_path=out, inline=args.inline)
-    print(f"Dashboard written to {path}{' (inlined, self-contained)' if args.inline else ''}")
+    if args.serve:
+        from dashboard_server import serve  # imports this module; keep it out of the top
+        serve(port=args.serve)
+        raise SystemExit(0)
+    if args.split:
+        manifest, summary = build_split(out_dir=args.split, force=args.force)
+        print(("Split dashboard written to " if summary else "Split dashboard unchanged: ")
+              + f"{args.split} (summary {manifest['summary']})")
+    elif args.all:
+        paths, summary = build_all(force=args.force)
+        names = ", ".join(os.path.basename(p) for p in paths)
+        print(("Dashboards written: " if summary else "Dashboards unchanged: ") + names)
+    else:
+        out = args.out or OUT_PATH
+        path, summary = build(out_path=out, inline=args.inline, force=args.force)
+        if summary is None:
+            print(f"Dashboard unchanged: {path}")
+        else:
+            print(f"Dashboard written to {path}"
+                  f"{' (inlined, self-contained)' if args.inline else ''}")
+    if summary is None:
+        raise SystemExit(0)
     print(f"  properties={summary['counts']['properties']} "
           f"bookings={summary['counts']['bookings']} "
           f"this-month occ={summary['kpi_this_month']['occupancy']:.1%}")
@@ -3,20 +3,47 @@ Inbox dashboard generator — renders a self-contained messages-dashboard.html
 (no external dependencies) from the messages in data/beds24.db.
 
 Unanswered guest threads are surfaced first, with channel filters and a wait-time
-badge. Click a thread to expand the full conversation.
+badge. The page embeds only the thread index (preview, counts, wait); clicking a
+thread fetches its conversation from threads/<booking_id>.json, one small shard per
+thread written next to the page (dashboard_server.py serves the same path live).
+Only shards whose conversation changed are rewritten, and shards of threads that
+are gone are removed. --embed-messages puts every conversation back in the page
+for a single-file copy that works without the shards.
 
-Run:  python build_messages_dashboard.py [--out messages-dashboard.html]
+The search box asks the local server's /api/messages/search (FTS5,
+messages_search.py) for ranked matches; opened as a plain file it falls back to a
+substring search of the previews (and of any conversation already opened).
+
+Run:  python build_messages_dashboard.py [--out messages-dashboard.html] [--force]
+                                         [--embed-messages] [--threads-url threads/]
+
+The poller calls this every few minutes, so the build is skipped when the message
+rows, property names, template and inbox code match the last build (artifacts.py).
+Wait badges age in the browser from generated_at, so a skipped build doesn't show
+stale waits; the "last fetch" stamp is refreshed at most hourly.
 """
 
 import argparse
 import json
 import os
+import sqlite3
 
-from messages_inbox import build_inbox
+from artifacts import Fingerprint, atomic_write, file_digest, publish, state_path
+from common import DB_PATH, HERE
+from db import reading, snapshot
+from messages_inbox import build_inbox, iter_thread_messages
 
-HERE = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(HERE, "data", "beds24.db")
 OUT_PATH = os.path.join(HERE, "messages-dashboard.html")
+THREADS_DIR = "threads"
+THREADS_URL = THREADS_DIR + "/"
+
+SOURCE_QUERIES = [
+    "SELECT id, booking_id, property_id, channel, time, mtype, direction, read, body "
+    "FROM messages ORDER BY id",
+    "SELECT * FROM threads ORDER BY booking_id",
+    "SELECT id, name FROM properties ORDER BY id",
+]
+CODE_FILES = ["messages_inbox.py", "artifacts.py"]
 
 TEMPLATE = r"""<!DOCTYPE html>
 <html lang="en">
@@ -65,6 +92,11 @@ TEMPLATE = r"""<!DOCTYPE html>
   .msg .m-meta{font-size:11px;color:var(--muted);margin-bottom:3px}
   .empty{color:var(--muted);text-align:center;padding:40px}
   .right{text-align:right}
+  .search{display:flex;gap:10px;align-items:center;padding:18px 24px 0}
+  .search input{flex:1;max-width:420px;background:var(--panel);border:1px solid var(--line);color:var(--text);
+                border-radius:8px;padding:7px 12px;font-size:13px}
+  .search .meta{color:var(--muted);font-size:12px}
+  mark{background:rgba(210,153,34,.35);color:inherit;border-radius:3px;padding:0 1px}
 </style>
 </head>
 <body>
@@ -73,6 +105,7 @@ TEMPLATE = r"""<!DOCTYPE html>
   <div class="meta">Messages fetched: <span id="lastFetch"></span> · Built: <span id="builtAt"></span></div>
 </header>
 <div class="cards" id="cards"></div>
+<div class="search"><input id="q" type="search" placeholder='Search messages — parking, "early check-in", towel*'/><span class="meta" id="searchInfo"></span></div>
 <div class="filters" id="filters"></div>
 <main id="list"></main>
 <script>
@@ -98,33 +131,90 @@ function renderFilters(){
 }
 function esc(s){return (s||"").replace(/[&<>]/g,c=>({"&":"&amp;","<":"&lt;",">":"&gt;"}[c]));}
 function fmtTime(s){return s? String(s).replace("T"," ").slice(0,16):"";}
+// wait_hours is as of generated_at; the page may be older than the last poll
+const AGE_H = Math.max(0,(Date.now()-Date.parse(DATA.generated_at))/3.6e6) || 0;
+function waitH(h){return h==null?"":(h+AGE_H).toFixed(1)+"h";}
+
+// search: ranked hits by booking_id (null = no search); snippets carry \x02/\x03 markers
+let hits = null;
+function markSnip(s){return esc(s).replace(/\x02/g,"<mark>").replace(/\x03/g,"</mark>");}
+function localSearch(q){
+  const terms = (q.match(/"[^"]*"|\S+/g)||[]).map(t=>t.replace(/"/g,"").replace(/\*$/,"").toLowerCase()).filter(Boolean);
+  const out = [];
+  DATA.threads.forEach(t=>{
+    // unopened threads only have their preview here; the server search covers all text
+    const ms = (t.messages||[{body:t.preview}]).filter(m=>{const b=(m.body||"").toLowerCase();return terms.every(x=>b.includes(x));});
+    if(!ms.length) return;
+    const b = ms[ms.length-1].body||"", i = b.toLowerCase().indexOf(terms[0]);
+    const lo = Math.max(0,i-60), hit = b.slice(i,i+terms[0].length);
+    out.push({booking_id:t.booking_id, hits:ms.length,
+      snippet:(lo?"…":"")+b.slice(lo,i)+"\x02"+hit+"\x03"+b.slice(i+hit.length,i+hit.length+80)});
+  });
+  return out;
+}
+let searchTimer = null, searchSeq = 0;
+function runSearch(q){
+  const seq = ++searchSeq, info = document.getElementById("searchInfo");
+  if(!q.trim()){hits=null;info.textContent="";renderList();return;}
+  const done = (results, how)=>{
+    if(seq!==searchSeq) return;  // a newer query is in flight
+    hits = new Map(results.map((r,i)=>[r.booking_id,Object.assign({rank:i},r)]));
+    info.textContent = `${results.length} thread${results.length===1?"":"s"} ${how}`;
+    renderList();
+  };
+  fetch("api/messages/search?limit=200&q="+encodeURIComponent(q))
+    .then(r=>{if(!r.ok) throw new Error(r.status); return r.json();})
+    .then(d=>done(d.results,"· ranked"))
+    .catch(()=>done(localSearch(q),"· text match"));
+}
+document.getElementById("q").addEventListener("input",e=>{
+  clearTimeout(searchTimer); searchTimer=setTimeout(()=>runSearch(e.target.value),200);
+});
 
 function renderList(){
   let ts = DATA.threads;
+  if(hits) ts = ts.filter(t=>hits.has(t.booking_id))
+                 .sort((a,b)=>hits.get(a.booking_id).rank-hits.get(b.booking_id).rank);
   if(filter==="unanswered") ts = ts.filter(t=>t.unanswered);
   else if(filter!=="all") ts = ts.filter(t=>t.channel===filter);
   if(!ts.length){document.getElementById("list").innerHTML=`<div class="empty">No messages in this view.</div>`;return;}
   document.getElementById("list").innerHTML = ts.map((t,i)=>{
     const wait = t.unanswered
-      ? `<span class="badge wait">waiting ${t.wait_hours==null?"":t.wait_hours+"h"}</span>`
+      ? `<span class="badge wait">waiting ${waitH(t.wait_hours)}</span>`
       : `<span class="badge ok">replied</span>`;
-    const convo = t.messages.map(m=>{
-      const dir = m.direction==="inbound"?"inbound":(m.direction==="outbound"?"outbound":"note");
-      return `<div class="msg ${dir}"><div class="m-meta">${dir==="inbound"?"Guest":(dir==="outbound"?"You":m.type)} · ${fmtTime(m.time)}</div>${esc(m.body)}</div>`;
-    }).join("");
     return `<div class="thread ${t.unanswered?'unanswered':''}">
-      <div class="thead" onclick="this.nextElementSibling.classList.toggle('open')">
+      <div class="thead" onclick="openThread(this)">
         <div>
           <div class="who">${esc(String(t.property??"Property "+t.property_id))} <span class="chip">${esc(t.channel)}</span></div>
-          <div class="preview">${esc(t.preview)||"<no text>"}</div>
+          <div class="preview">${hits?markSnip(hits.get(t.booking_id).snippet):(esc(t.preview)||"<no text>")}</div>
         </div>
         <div class="spacer"></div>
         <div class="right">${wait}<div class="preview" style="margin-top:4px">${t.message_count} msgs · ${fmtTime(t.last_time)}</div></div>
       </div>
-      <div class="convo">${convo}</div>
+      <div class="convo" data-id="${t.booking_id}">${t.messages?renderConvo(t.messages):""}</div>
     </div>`;
   }).join("");
 }
+function renderConvo(msgs){
+  return msgs.map(m=>{
+    const dir = m.direction==="inbound"?"inbound":(m.direction==="outbound"?"outbound":"note");
+    return `<div class="msg ${dir}"><div class="m-meta">${dir==="inbound"?"Guest":(dir==="outbound"?"You":m.type)} · ${fmtTime(m.time)}</div>${esc(m.body)}</div>`;
+  }).join("") || `<div class="m-meta">No messages.</div>`;
+}
+// conversations aren't in the page (unless built with --embed-messages): fetch a
+// thread's shard the first time it's opened and keep it on the thread
+const byId = new Map(DATA.threads.map(t=>[String(t.booking_id),t]));
+function openThread(head){
+  const box = head.nextElementSibling, t = byId.get(box.dataset.id);
+  if(!box.classList.toggle("open") || box.dataset.loaded) return;
+  if(t.messages){box.innerHTML=renderConvo(t.messages);box.dataset.loaded=1;return;}
+  box.innerHTML = `<div class="m-meta">Loading…</div>`;
+  fetch((DATA.threads_url||"threads/")+encodeURIComponent(box.dataset.id)+".json")
+    .then(r=>{if(!r.ok) throw new Error(r.status); return r.json();})
+    .then(d=>{t.messages=d.messages;box.innerHTML=renderConvo(t.messages);box.dataset.loaded=1;})
+    .catch(()=>{box.innerHTML=`<div class="m-meta">Couldn't load this conversation. Open the inbox through `
+      +`dashboard_server.py, deploy the threads/ folder next to this page, or build it with --embed-messages.</div>`;});
+}
 renderFilters();renderList();
 </script>
 </body>
@@ -132,19 +222,113 @@ renderFilters();renderList();
 """
 
 
-def build(db_path=DB_PATH, out_path=OUT_PATH):
-    inbox = build_inbox(db_path)
-    html = TEMPLATE.replace("__DATA__", json.dumps(inbox))
-    with open(out_path, "w") as f:
-        f.write(html)
+def render(inbox):
+    return TEMPLATE.replace("__DATA__", json.dumps(inbox))
+
+
+def _last_fetch_hour(db_path):
+    try:
+        with reading(db_path) as conn:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key='last_messages_fetch'").fetchone()
+    except sqlite3.Error:
+        return ""
+    return (row[0] or "")[:13] if row else ""
+
+
+def threads_dir(out_path):
+    return os.path.join(os.path.dirname(os.path.abspath(out_path)), THREADS_DIR)
+
+
+def _conversations(db_path):
+    with reading(db_path) as conn:
+        try:
+            yield from iter_thread_messages(conn)
+        except sqlite3.OperationalError:
+            # messages_fetch hasn't migrated this DB yet (no time_epoch): derive in memory
+            for t in build_inbox(db_path, with_messages=True)["threads"]:
+                yield t["booking_id"], t["messages"]
+
+
+def write_thread_shards(db_path, folder):
+    """One <booking_id>.json per conversation in `folder`. A shard is only rewritten
+    when its bytes change, so a deploy hook syncing the folder ships just the
+    threads that moved; shards of threads no longer in the DB are removed.
+    Returns (written, removed)."""
+    os.makedirs(folder, exist_ok=True)
+    keep, written = set(), 0
+    for bid, msgs in _conversations(db_path):
+        name = f"{bid}.json"
+        keep.add(name)
+        path = os.path.join(folder, name)
+        data = json.dumps({"booking_id": bid, "messages": msgs},
+                          separators=(",", ":")).encode("utf-8")
+        try:
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    continue
+        except FileNotFoundError:
+            pass
+        atomic_write(path, data)
+        written += 1
+    removed = 0
+    for name in os.listdir(folder):
+        if name.endswith(".json") and name not in keep:
+            os.remove(os.path.join(folder, name))
+            removed += 1
+    return written, removed
+
+
+def fingerprint(db_path, out_path, embed_messages=False, threads_url=THREADS_URL):
+    static = [TEMPLATE, _last_fetch_hour(db_path), str(embed_messages), threads_url]
+    static += [file_digest(os.path.join(HERE, f)) for f in CODE_FILES]
+    outputs = [out_path] if embed_messages else [out_path, threads_dir(out_path)]
+    return Fingerprint(state_path(out_path), db_path, SOURCE_QUERIES, static, outputs)
+
+
+def build(db_path=DB_PATH, out_path=OUT_PATH, force=False, embed_messages=False,
+          threads_url=THREADS_URL):
+    """Render the inbox to out_path (+ the threads/ shards unless embed_messages).
+    Returns (out_path, inbox); inbox is None when nothing changed since the last
+    build and the files were left alone."""
+    fp = fingerprint(db_path, out_path, embed_messages, threads_url)
+    if not force and fp.unchanged():
+        return out_path, None
+    fp.measure()
+    # page and shards from one snapshot: a poll committing mid-build can't leave
+    # the index listing threads whose shards are older or newer than it
+    with snapshot(db_path):
+        inbox = build_inbox(db_path, with_messages=embed_messages)
+        shards = None
+        if not embed_messages:
+            inbox["threads_url"] = threads_url
+            # shards first: the new page may list threads the old shards don't have
+            shards = write_thread_shards(db_path, threads_dir(out_path))
+    publish(out_path, render(inbox))
+    if shards is not None:
+        inbox["shards"] = shards  # for the caller's report, not the page
+    fp.save()
     return out_path, inbox
 
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--out", default=OUT_PATH)
+    ap.add_argument("--force", action="store_true",
+                    help="Rebuild even if the inputs match the last build")
+    ap.add_argument("--embed-messages", action="store_true",
+                    help="Put every conversation in the page (single file, no threads/)")
+    ap.add_argument("--threads-url", default=THREADS_URL,
+                    help="Where the page fetches <booking_id>.json shards from")
     args = ap.parse_args()
-    path, inbox = build(out_path=args.out)
+    path, inbox = build(out_path=args.out, force=args.force,
+                        embed_messages=args.embed_messages, threads_url=args.threads_url)
+    if inbox is None:
+        print(f"Inbox unchanged: {path}")
+        raise SystemExit(0)
     s = inbox["summary"]
     print(f"Inbox written to {path}")
     print(f"  threads={s['total_threads']} unanswered={s['unanswered']} channels={list(s['by_channel'])}")
+    if "shards" in inbox:
+        print(f"  shards: {inbox['shards'][0]} written, {inbox['shards'][1]} removed "
+              f"({threads_dir(path)})")
@@ -10,8 +10,8 @@ Run:  python check_messages.py
 from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
 
 
-def main():
-    client = Beds24Client()
+def main(client=None):
+    client = client or Beds24Client()
     try:
         data = client.get("/bookings/messages", params={"maxAge": 3650})
     except Beds24RateLimit as e:
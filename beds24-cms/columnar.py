@@ -0,0 +1,57 @@
+"""
+Compact columnar encoding of the dashboard summary.
+
+The row-of-dicts tables (monthly, feed, channel_mix) repeat every key on every
+row, and the feed repeats the same handful of channels, properties (id and
+name) and statuses. encode() stores each table as one array per field and swaps
+those values for indexes into a shared dictionary:
+
+    {"feed": [{"id": 1, "channel": "Airbnb", ...}, ...]}
+ -> {"_enc": 1, "_dict": {"channel": ["Airbnb", ...], ...},
+     "feed": {"n": 50, "cols": {"id": [1, ...], "channel": [0, ...], ...}}}
+
+Everything else passes through untouched. decode() is the exact inverse; the
+dashboard template carries the same decoder in JS (decode() in its script).
+"""
+
+TABLES = ("monthly", "feed", "channel_mix")
+DICT_FIELDS = ("channel", "property", "property_id", "status")
+ENCODING = 1
+
+
+def encode(summary):
+    out = dict(summary)
+    index = {f: {} for f in DICT_FIELDS}
+    for name in TABLES:
+        rows = summary.get(name)
+        if not isinstance(rows, list):
+            continue
+        fields = []
+        for r in rows:
+            fields += [k for k in r if k not in fields]
+        cols = {}
+        for f in fields:
+            col = [r.get(f) for r in rows]
+            if f in index:
+                idx = index[f]
+                col = [idx.setdefault(v, len(idx)) for v in col]
+            cols[f] = col
+        out[name] = {"n": len(rows), "cols": cols}
+    out["_enc"] = ENCODING
+    out["_dict"] = {f: list(idx) for f, idx in index.items() if idx}
+    return out
+
+
+def decode(data):
+    if data.get("_enc") != ENCODING:
+        return data
+    out = {k: v for k, v in data.items() if k not in ("_enc", "_dict")}
+    dicts = data.get("_dict", {})
+    for name in TABLES:
+        table = data.get(name)
+        if not isinstance(table, dict) or "cols" not in table:
+            continue
+        cols = {f: ([dicts[f][i] for i in col] if f in dicts else col)
+                for f, col in table["cols"].items()}
+        out[name] = [{f: col[i] for f, col in cols.items()} for i in range(table["n"])]
+    return out
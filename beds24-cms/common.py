@@ -0,0 +1,19 @@
+"""
+Paths and small helpers shared by every script in this folder (the fetchers,
+builders, probes and the beds24.py CLI). Kept dependency-free so importing it
+costs nothing.
+"""
+
+import json
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(HERE, "data", "beds24.db")
+RAW_DIR = os.path.join(HERE, "raw")
+
+
+def save_raw(name, payload):
+    """Write an API response to raw/<name>.json for shape inspection."""
+    os.makedirs(RAW_DIR, exist_ok=True)
+    with open(os.path.join(RAW_DIR, f"{name}.json"), "w") as f:
+        json.dump(payload, f, indent=2)
@@ -0,0 +1,278 @@
+"""
+Local dashboard server — serves the dashboards and their data straight from
+memory instead of regenerating files on a schedule.
+
+The summary and inbox are computed once and kept in memory. Every request checks
+(under a lock, cheaply) whether the DB changed:
+  - PRAGMA data_version on one long-lived connection: bumps whenever ANY other
+    connection (fetch.py, messages_fetch.py, ...) commits;
+  - size + mtime of the DB/WAL files: catches the file being replaced outright;
+  - today's date: "next 30 days", pace and the feed move at midnight.
+Only then are the rows each page reads hashed, and only a page whose rows moved
+is rebuilt — build_summary() serves closed months from metrics_cache, so even
+that only recomputes the open months.
+
+Responses carry an ETag (hash of the body); a matching If-None-Match gets a 304,
+so the CMS can poll as often as it likes at cache-hit cost.
+
+Endpoints:
+  /                      reports dashboard (same page as dashboard.html)
+  /summary.json          the summary, columnar-encoded (columnar.py)
+  /messages              guest inbox page
+  /inbox.json            the inbox data (thread index, no conversations)
+  /threads/<id>.json     one booking's conversation, read live when a thread is
+                         opened (same shape as build_messages_dashboard's shards)
+  /api/bookings          one page of bookings (bookings_query.py), queried live:
+                         ?property=&channel=&status=&from=&to=&limit=&cursor=
+  /api/messages/search   ranked message threads (messages_search.py, FTS5):
+                         ?q=&channel=&property=&from=&to=&limit=
+  /vendor/chart.umd.js   Chart.js
+  /healthz               "ok" + when the data was last rebuilt
+
+Run:  python dashboard_server.py [--port 8765] [--host 127.0.0.1]
+      python build_dashboard.py --serve
+Binds to localhost by default: put it behind the CMS's auth, never expose it.
+"""
+
+import argparse
+import datetime as dt
+import gzip
+import json
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import build_dashboard
+import build_messages_dashboard
+from artifacts import db_content_hash, db_stat_key, digest
+from bookings_query import ensure_indexes, query_bookings
+from columnar import encode
+from common import DB_PATH
+from db import connect, reading, snapshot
+from messages_inbox import build_inbox, thread_messages
+from messages_search import init_search_index, search
+from metrics import build_summary
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+
+class Response:
+    """A rendered body with its ETag and gzipped form, computed once."""
+
+    def __init__(self, body, content_type):
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.content_type = content_type
+        self.etag = '"' + digest(self.body)[:32] + '"'
+        self.gz = gzip.compress(self.body, 6, mtime=0)
+
+
+class DataCache:
+    """Summary + inbox for one DB, each rebuilt only when its own rows (or the
+    date) change: a message poll doesn't recompute the booking summary."""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = connect(db_path, check_same_thread=False)
+        ensure_indexes(self.conn)
+        init_search_index(self.conn)
+        self.version = None
+        self.keys = {}
+        self.responses = {}
+        self.built_at = None
+        self.rebuilds = 0
+        self.parts = [
+            ("dashboard", build_dashboard.SOURCE_QUERIES, self._build_dashboard),
+            ("inbox", build_messages_dashboard.SOURCE_QUERIES, self._build_inbox),
+        ]
+
+    def _version(self):
+        dv = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        return (dv, db_stat_key(self.db_path), dt.date.today().isoformat())
+
+    def _build_dashboard(self):
+        summary = build_summary(self.db_path)
+        self.responses["/"] = Response(build_dashboard.render(summary),
+                                       "text/html; charset=utf-8")
+        self.responses["/summary.json"] = Response(
+            json.dumps(encode(summary), separators=(",", ":")), "application/json")
+
+    def _build_inbox(self):
+        inbox = build_inbox(self.db_path)
+        inbox["threads_url"] = build_messages_dashboard.THREADS_URL
+        self.responses["/messages"] = Response(build_messages_dashboard.render(inbox),
+                                               "text/html; charset=utf-8")
+        self.responses["/inbox.json"] = Response(
+            json.dumps(inbox, separators=(",", ":")), "application/json")
+
+    def refresh(self):
+        """Rebuild whatever changed since the last check. Returns True if anything did."""
+        with self.lock:
+            # version first, hashes second: a write landing in between bumps the
+            # version again, so the next request re-checks rather than missing it.
+            # (build_summary's own metrics_cache writes bump it too; they hash the same.)
+            version = self._version()
+            if version == self.version:
+                return False
+            changed = False
+            # hash and build from one snapshot: an ingest committing meanwhile
+            # can't leave a page that matches neither the old rows nor the new
+            with snapshot(self.db_path):
+                for name, queries, build in self.parts:
+                    key = (db_content_hash(self.db_path, queries), version[2])
+                    if self.keys.get(name) != key:
+                        build()
+                        self.keys[name] = key
+                        self.rebuilds += 1
+                        changed = True
+            self.version = version
+            if changed:
+                self.built_at = dt.datetime.now().isoformat(timespec="seconds")
+            return changed
+
+    def get(self, path):
+        self.refresh()
+        return self.responses.get(path)
+
+    def bookings(self, query):
+        """/api/bookings: not cached — every page is an index range scan."""
+        q = {k: v[-1] for k, v in parse_qs(query).items()}
+        with reading(self.db_path) as conn:
+            page = query_bookings(conn, property_id=q.get("property"), channel=q.get("channel"),
+                                  status=q.get("status"), arrival_from=q.get("from"),
+                                  arrival_to=q.get("to"), cursor=q.get("cursor"),
+                                  limit=q.get("limit") or None)
+        return Response(json.dumps(page, separators=(",", ":")), "application/json")
+
+    def search(self, query):
+        """/api/messages/search: not cached — an FTS5 lookup is milliseconds."""
+        q = {k: v[-1] for k, v in parse_qs(query).items()}
+        conn = connect(self.db_path)
+        try:
+            if not init_search_index(conn):  # no messages table yet
+                return Response(json.dumps({"query": q.get("q", ""), "results": []}),
+                                "application/json")
+            res = search(conn, q.get("q", ""), channel=q.get("channel"),
+                         property_id=q.get("property"), since=q.get("from"),
+                         until=q.get("to"), limit=q.get("limit") or None)
+        finally:
+            conn.close()
+        return Response(json.dumps(res, separators=(",", ":")), "application/json")
+
+    def thread(self, path):
+        """/threads/<id>.json: not cached — one booking's messages off an index."""
+        try:
+            booking_id = int(path[len("/threads/"):-len(".json")])
+        except ValueError:
+            return None
+        with reading(self.db_path) as conn:
+            try:
+                msgs = thread_messages(conn, booking_id)
+            except sqlite3.OperationalError:  # no messages table yet
+                msgs = []
+        if not msgs:
+            return None
+        return Response(json.dumps({"booking_id": booking_id, "messages": msgs},
+                                   separators=(",", ":")), "application/json")
+
+    def close(self):
+        self.conn.close()
+
+
+def _static(path, content_type):
+    with open(path, "rb") as f:
+        return Response(f.read(), content_type)
+
+
+def make_handler(cache):
+    vendor = {"/vendor/chart.umd.js": _static(build_dashboard.VENDOR_JS,
+                                              "application/javascript")}
+    aliases = {"/index.html": "/", "/dashboard.html": "/",
+               "/messages-dashboard.html": "/messages"}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, resp, head=False):
+            if self.headers.get("If-None-Match") == resp.etag:
+                self.send_response(304)
+                self.send_header("ETag", resp.etag)
+                self.end_headers()
+                return
+            use_gz = "gzip" in (self.headers.get("Accept-Encoding") or "")
+            body = resp.gz if use_gz else resp.body
+            self.send_response(200)
+            self.send_header("Content-Type", resp.content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", resp.etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Vary", "Accept-Encoding")
+            if use_gz:
+                self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+
+        def _route(self, head=False):
+            url = urlsplit(self.path)
+            path = aliases.get(url.path, url.path)
+            if path in ("/api/bookings", "/api/messages/search"):
+                api = cache.bookings if path == "/api/bookings" else cache.search
+                try:
+                    resp = api(url.query)
+                except ValueError as e:  # bad cursor / non-numeric property or limit
+                    self.send_error(400, str(e))
+                    return
+            elif path == "/healthz":
+                cache.refresh()
+                resp = Response(json.dumps({"ok": True, "built_at": cache.built_at,
+                                            "rebuilds": cache.rebuilds}), "application/json")
+            elif path.startswith("/threads/") and path.endswith(".json"):
+                resp = cache.thread(path)
+            else:
+                resp = vendor.get(path) or cache.get(path)
+            if resp is None:
+                self.send_error(404)
+                return
+            self._send(resp, head)
+
+        def do_GET(self):
+            self._route()
+
+        def do_HEAD(self):
+            self._route(head=True)
+
+        def log_message(self, fmt, *args):
+            pass  # quiet: the CMS may poll every few seconds
+
+    return Handler
+
+
+def make_server(db_path=DB_PATH, host=HOST, port=PORT):
+    cache = DataCache(db_path)
+    cache.refresh()
+    server = ThreadingHTTPServer((host, port), make_handler(cache))
+    server.cache = cache
+    return server
+
+
+def serve(db_path=DB_PATH, host=HOST, port=PORT):
+    server = make_server(db_path, host, port)
+    print(f"Serving dashboards on http://{host}:{server.server_address[1]}/ "
+          f"(inbox at /messages) — Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.cache.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args()
+    serve(args.db, args.host, args.port)
@@ -0,0 +1,94 @@
+"""
+SQLite connections for every script in this folder. data/beds24.db is shared by
+jobs that overlap: the daily fetch, the messages poller, the webhook receiver,
+the dashboard builds and the local server. With bare sqlite3.connect() (rollback
+journal, 5 s busy timeout, write lock taken mid-transaction) they fail each
+other with "database is locked". Everything goes through here instead:
+
+  - journal_mode=WAL: readers never block the writer and the writer never blocks
+    readers; each read transaction sees the DB as of its first read
+  - synchronous=NORMAL: commits don't fsync (WAL checkpoints still do), so a
+    crash can lose the last commits but never corrupts the file, and every
+    re-runnable fetch or poll just picks them up again
+  - one writer at a time: write transactions start with BEGIN IMMEDIATE, so a
+    job waits for the write lock up front (up to BUSY_TIMEOUT) instead of failing
+    when a read upgrades to a write after someone else wrote
+  - snapshot(db_path): a build reads every table from one read transaction, so
+    the dashboard never mixes rows from before and after an ingest that commits
+    halfway through the build
+
+Writers should keep transactions short: call the API first, then write and
+commit, so no lock is held across a network round-trip.
+
+    conn = connect(db_path)                 # read/write, the writer's settings
+    with reading(db_path) as conn: ...      # a short read (joins a snapshot)
+    with snapshot(db_path): build(...)      # every reading() inside: one view
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+
+from common import DB_PATH
+
+BUSY_TIMEOUT = 30.0  # seconds a job waits for the write lock before "database is locked"
+
+_local = threading.local()
+
+
+def connect(db_path=DB_PATH, check_same_thread=True):
+    """A connection with the shared settings (module docstring). Switching a DB to
+    WAL is persistent; later connections just confirm it."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level="IMMEDIATE",
+                           check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _snapshots():
+    if not hasattr(_local, "snapshots"):
+        _local.snapshots = {}
+    return _local.snapshots
+
+
+@contextlib.contextmanager
+def snapshot(db_path=DB_PATH):
+    """One read transaction on db_path for this thread: every reading() of it
+    inside the block uses this connection and sees the DB as of the block's
+    start, however many commits land meanwhile. Nests (the outer one wins)."""
+    key = os.path.abspath(db_path)
+    snaps = _snapshots()
+    if key in snaps:
+        yield snaps[key]
+        return
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # pins the snapshot
+        snaps[key] = conn
+        yield conn
+    finally:
+        snaps.pop(key, None)
+        conn.rollback()
+        conn.close()
+
+
+@contextlib.contextmanager
+def reading(db_path=DB_PATH):
+    """A connection for a few reads: the thread's snapshot() of db_path if one is
+    open (row_factory is restored afterwards), otherwise a new one, closed after."""
+    conn = _snapshots().get(os.path.abspath(db_path))
+    if conn is not None:
+        row_factory = conn.row_factory
+        try:
+            yield conn
+        finally:
+            conn.row_factory = row_factory
+        return
+    conn = connect(db_path)
+    try:
+        yield conn
+    finally:
+        conn.close()
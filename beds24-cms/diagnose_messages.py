@@ -8,17 +8,16 @@ Run:  python diagnose_messages.py
 """
 import json
 import os
-import sqlite3
 
 from beds24_client import Beds24Client, Beds24Error
+from common import DB_PATH, HERE
+from db import connect
 
-HERE = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(HERE, "data", "beds24.db")
 RAW = os.path.join(HERE, "raw", "messages_probe.json")
 
 
 def recent_booking_ids(n=6):
-    c = sqlite3.connect(DB_PATH)
+    c = connect(DB_PATH)
     rows = c.execute(
         "SELECT id, referer, arrival FROM bookings ORDER BY arrival DESC LIMIT ?", (n,)
     ).fetchall()
@@ -51,8 +50,8 @@ def try_call(client, label, path, params):
     return rec
 
 
-def main():
-    client = Beds24Client()
+def main(client=None):
+    client = client or Beds24Client()
     bks = recent_booking_ids()
     print("Most recent bookings (id, channel, arrival):")
     for b in bks:
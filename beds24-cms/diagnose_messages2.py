@@ -7,18 +7,17 @@ Run:  python diagnose_messages2.py
 import datetime as dt
 import json
 import os
-import sqlite3
 
 from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
+from common import DB_PATH, HERE
+from db import connect
 
-HERE = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(HERE, "data", "beds24.db")
 RAW = os.path.join(HERE, "raw", "messages_probe2.json")
 
 
 def pick_bookings():
     today = dt.date.today().isoformat()
-    c = sqlite3.connect(DB_PATH)
+    c = connect(DB_PATH)
     q = c.execute(
         """
         SELECT id, referer, arrival, departure,
@@ -60,8 +59,8 @@ def call(client, path, params):
         return {"path": path, "params": params, "ok": False, "error": str(e)}
 
 
-def main():
-    client = Beds24Client()
+def main(client=None):
+    client = client or Beds24Client()
     out = {"results": []}
 
     print("Account-wide messages, widening window:")
@@ -12,13 +12,11 @@ import argparse
 import datetime as dt
 import json
 import os
-import sqlite3
 
 from beds24_client import Beds24Client, Beds24Error
-
-HERE = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(HERE, "data", "beds24.db")
-RAW_DIR = os.path.join(HERE, "raw")
+from common import DB_PATH, save_raw
+from db import connect
+from fieldmap import AVAILABILITY, BOOKING, PROPERTY, ROOM, probe, remember
 
 
 def _today():
@@ -29,14 +27,6 @@ def _iso(d):
     return d.strftime("%Y-%m-%d")
 
 
-def _g(d, *keys, default=None):
-    """Tolerant getter: returns the first present key (handles field-name drift)."""
-    for k in keys:
-        if isinstance(d, dict) and k in d and d[k] not in (None, ""):
-            return d[k]
-    return default
-
-
 def init_db(conn):
     conn.executescript(
         """
@@ -86,12 +76,8 @@ def init_db(conn):
         """
     )
     conn.commit()
-
-
-def save_raw(name, payload):
-    os.makedirs(RAW_DIR, exist_ok=True)
-    with open(os.path.join(RAW_DIR, f"{name}.json"), "w") as f:
-        json.dump(payload, f, indent=2)
+    from bookings_query import ensure_indexes  # imports metrics; only needed here
+    ensure_indexes(conn)
 
 
 def fetch_properties(client, conn):
@@ -99,21 +85,23 @@ def fetch_properties(client, conn):
     save_raw("properties", payload)
     data = payload.get("data", payload if isinstance(payload, list) else [])
     n_props = n_rooms = 0
+    prop_fields, room_fields = PROPERTY.extractor(), ROOM.extractor()
     for p in data:
-        pid = _g(p, "id", "propertyId", "propid")
+        f = prop_fields(p)
+        pid = f["id"]
         conn.execute(
             "INSERT OR REPLACE INTO properties (id,name,currency,raw) VALUES (?,?,?,?)",
-            (pid, _g(p, "name"), _g(p, "currency"), json.dumps(p)),
+            (pid, f["name"], f["currency"], json.dumps(p)),
         )
         n_props += 1
-        rooms = _g(p, "roomTypes", "rooms", default=[]) or []
-        for r in rooms:
-            rid = _g(r, "id", "roomId", "roomTypeId")
+        for r in f["rooms"] or []:
+            rf = room_fields(r)
             conn.execute(
                 "INSERT OR REPLACE INTO rooms (id,property_id,name,qty,raw) VALUES (?,?,?,?,?)",
-                (rid, pid, _g(r, "name"), _g(r, "qty", "units", "roomQty", default=1), json.dumps(r)),
+                (rf["id"], pid, rf["name"], rf["qty"], json.dumps(r)),
             )
             n_rooms += 1
+    remember(conn, prop_fields, room_fields)
     conn.commit()
     return n_props, n_rooms
 
@@ -131,49 +119,69 @@ def fetch_bookings(client, conn, days_back, days_fwd):
     }
     rows = client.get_all_pages("/bookings", params=params)
     save_raw("bookings", {"count": len(rows), "data": rows})
-    n = 0
-    for b in rows:
-        arrival = _g(b, "arrival", "firstNight")
-        departure = _g(b, "departure", "lastNight")
-        nights = None
-        try:
-            if arrival and departure:
-                a = dt.date.fromisoformat(arrival[:10])
-                d = dt.date.fromisoformat(departure[:10])
-                nights = max((d - a).days, 0)
-        except ValueError:
-            pass
-        conn.execute(
-            """INSERT OR REPLACE INTO bookings
-               (id,property_id,room_id,status,arrival,departure,num_nights,
-                num_adult,num_child,price,channel,referer,first_name,last_name,
-                booking_time,modified_time,raw)
-               VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (
-                _g(b, "id", "bookId", "bookingId"),
-                _g(b, "propertyId", "propId"),
-                _g(b, "roomId", "roomTypeId"),
-                str(_g(b, "status", default="")),
-                arrival,
-                departure,
-                nights,
-                _g(b, "numAdult", "adults", default=0),
-                _g(b, "numChild", "children", default=0),
-                float(_g(b, "price", "total", default=0) or 0),
-                str(_g(b, "channel", "apiSource", "apiSourceId", default="")),
-                str(_g(b, "referer", "source", default="")),
-                _g(b, "firstName", "guestFirstName"),
-                _g(b, "lastName", "guestName", "guestLastName"),
-                _g(b, "bookingTime", "bookingDate"),
-                _g(b, "modifiedTime", "modified"),
-                json.dumps(b),
-            ),
-        )
-        n += 1
+    n = upsert_bookings(conn, rows)
     conn.commit()
     return n
 
 
+def fetch_booking(client, conn, booking_id):
+    """Re-read one booking (e.g. on a webhook) and upsert it like fetch_bookings.
+    Returns the number of rows upserted: 0 if Beds24 no longer returns it."""
+    payload = client.get("/bookings", params={"id": booking_id, "includeInvoiceItems": False,
+                                              "includeGuests": True})
+    rows = payload.get("data", payload if isinstance(payload, list) else [])
+    n = upsert_bookings(conn, rows)
+    conn.commit()
+    return n
+
+
+def _booking_row(f, raw):
+    """One bookings row from a booking's BOOKING fields."""
+    arrival, departure = f["arrival"], f["departure"]
+    nights = None
+    try:
+        if arrival and departure:
+            a = dt.date.fromisoformat(arrival[:10])
+            d = dt.date.fromisoformat(departure[:10])
+            nights = max((d - a).days, 0)
+    except ValueError:
+        pass
+    return (
+        f["id"],
+        f["property_id"],
+        f["room_id"],
+        str(f["status"]),
+        arrival,
+        departure,
+        nights,
+        f["num_adult"],
+        f["num_child"],
+        float(f["price"] or 0),
+        str(f["channel"]),
+        str(f["referer"]),
+        f["first_name"],
+        f["last_name"],
+        f["booking_time"],
+        f["modified_time"],
+        json.dumps(raw),
+    )
+
+
+def upsert_bookings(conn, rows):
+    """INSERT OR REPLACE raw /bookings rows into bookings (caller commits)."""
+    fields = BOOKING.extractor()
+    conn.executemany(
+        """INSERT OR REPLACE INTO bookings
+           (id,property_id,room_id,status,arrival,departure,num_nights,
+            num_adult,num_child,price,channel,referer,first_name,last_name,
+            booking_time,modified_time,raw)
+           VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+        [_booking_row(fields(b), b) for b in rows],
+    )
+    remember(conn, fields)
+    return len(rows)
+
+
 def fetch_availability(client, conn, days_fwd):
     """Optional: per-room availability calendar for forward occupancy.
     Field names vary by account; we store best-effort and never hard-fail the run."""
@@ -181,7 +189,10 @@ def fetch_availability(client, conn, days_fwd):
     start = _iso(today)
     end = _iso(today + dt.timedelta(days=days_fwd))
     room_ids = [r[0] for r in conn.execute("SELECT id FROM rooms").fetchall()]
-    n = 0
+    # every call first, then one short write: the write lock is never held
+    # across an API round-trip (the messages poller writes to the same DB)
+    rows = []
+    day_fields = AVAILABILITY.extractor()
     for rid in room_ids:
         try:
             payload = client.get(
@@ -192,49 +203,35 @@ def fetch_availability(client, conn, days_fwd):
             continue
         data = payload.get("data", payload if isinstance(payload, list) else [])
         for entry in data:
-            cal = _g(entry, "calendar", default=[entry]) or [entry]
-            for day in cal:
-                date = _g(day, "date", "from")
-                if not date:
+            for day in probe(entry, ("calendar",), [entry]) or [entry]:
+                f = day_fields(day)
+                if not f["date"]:
                     continue
-                conn.execute(
-                    "INSERT OR REPLACE INTO availability (room_id,date,num_available,price) VALUES (?,?,?,?)",
-                    (
-                        rid,
-                        date[:10],
-                        _g(day, "numAvail", "numAvailable", "inventory", default=None),
-                        _g(day, "price1", "price", default=None),
-                    ),
-                )
-                n += 1
+                rows.append((rid, f["date"][:10], f["num_available"], f["price"]))
+    conn.executemany(
+        "INSERT OR REPLACE INTO availability (room_id,date,num_available,price) VALUES (?,?,?,?)",
+        rows,
+    )
+    remember(conn, day_fields)
     conn.commit()
-    return n
+    return len(rows)
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--days-back", type=int, default=365)
-    ap.add_argument("--days-fwd", type=int, default=365)
-    ap.add_argument("--skip-availability", action="store_true")
-    args = ap.parse_args()
-
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+def run(client, conn, days_back=365, days_fwd=365, skip_availability=False):
+    """The whole fetch on an open client + connection (main(), beds24.py fetch)."""
     init_db(conn)
-    client = Beds24Client()
-
     print("Fetching properties & rooms...")
     np_, nr = fetch_properties(client, conn)
     print(f"  properties={np_} rooms={nr}")
 
     print("Fetching bookings...")
-    nb = fetch_bookings(client, conn, args.days_back, args.days_fwd)
+    nb = fetch_bookings(client, conn, days_back, days_fwd)
     print(f"  bookings={nb}")
 
     na = 0
-    if not args.skip_availability:
+    if not skip_availability:
         print("Fetching availability calendar (best-effort)...")
-        na = fetch_availability(client, conn, args.days_fwd)
+        na = fetch_availability(client, conn, days_fwd)
         print(f"  availability rows={na}")
 
     conn.execute(
@@ -242,6 +239,23 @@ def main():
         (dt.datetime.now().isoformat(timespec="seconds"),),
     )
     conn.commit()
+    return {"properties": np_, "rooms": nr, "bookings": nb, "availability": na}
+
+
+def add_arguments(ap):
+    ap.add_argument("--days-back", type=int, default=365)
+    ap.add_argument("--days-fwd", type=int, default=365)
+    ap.add_argument("--skip-availability", action="store_true")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add_arguments(ap)
+    args = ap.parse_args()
+
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = connect(DB_PATH)
+    run(Beds24Client(), conn, args.days_back, args.days_fwd, args.skip_availability)
     conn.close()
     print("Done. Raw responses in ./raw, parsed data in data/beds24.db")
 
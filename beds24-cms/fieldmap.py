@@ -0,0 +1,202 @@
+"""
+Declarative field mapping for Beds24 payloads. Field names vary by account (and
+have moved between API versions), so each field lists the keys it may arrive
+under, in priority order, next to its column name and default:
+
+    BOOKING = Schema("bookings", [
+        ("id",      ("id", "bookId", "bookingId"), None),
+        ("arrival", ("arrival", "firstNight"),     None), ...])
+
+An Extractor normalises one payload's records. The first record carrying any of
+a field's keys fixes the one this account uses (the first variant present, even
+if empty), and from then on a filled field is a single dict lookup instead of a
+probe of every variant. A value counts only if it isn't None or "" (as before),
+so a field falls back to one pass over its variants when its resolved key is
+empty in a record, is missing from it, or no record has carried the field yet:
+sparse fields (a message's "read", an unpaid booking's "price") cost that pass
+on the records that lack them. When the resolved key is missing from a record
+and another variant is there, the shape has changed: the extractor moves to the
+new key and the switch is counted as drift.
+
+remember() logs that drift and compares each field's key with the one recorded by
+earlier runs (meta 'field_map'), so a renamed field shows up in the fetch log
+instead of as a column that silently went empty.
+
+    ex = BOOKING.extractor()
+    for b in rows:
+        f = ex(b)                        # {"id": ..., "arrival": ..., ...}
+    remember(conn, ex)                   # caller commits
+"""
+
+import json
+import sqlite3
+
+FIELD_MAP_KEY = "field_map"
+
+
+def _has_value(v):
+    return v is not None and v != ""
+
+
+def probe(record, variants, default=None):
+    """First of `variants` in `record` with a value, else default. The uncompiled
+    lookup, for irregular shapes that aren't a stream of like records."""
+    if isinstance(record, dict):
+        for key in variants:
+            v = record.get(key)
+            if _has_value(v):
+                return v
+    return default
+
+
+class Schema:
+    """A record type: (field, variants, default) per field, in output order."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = [(field, tuple(variants), default) for field, variants, default in fields]
+
+    def extractor(self):
+        return Extractor(self)
+
+
+class Extractor:
+    """Normalises the records of one payload (see module docstring). Calling it
+    returns {field: value} for a record; a non-dict record gets the defaults."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.names = [f for f, _, _ in schema.fields]
+        self.variants = [v for _, v, _ in schema.fields]
+        self.defaults = [d for _, _, d in schema.fields]
+        self.keys = [None] * len(self.names)  # resolved key per field
+        self.records = 0
+        self.drift = {}  # (field, old key, new key) -> records
+
+    def __call__(self, record):
+        self.records += 1
+        if not isinstance(record, dict):
+            return dict(zip(self.names, self.defaults))
+        get = record.get
+        out = {}
+        for i, key in enumerate(self.keys):
+            if key is not None:
+                v = get(key)
+                if v is not None and v != "":
+                    out[self.names[i]] = v
+                    continue
+            out[self.names[i]] = self._probe(record, i)
+        return out
+
+    def _probe(self, record, i):
+        # one pass: the first variant present, and the first with a value
+        present, value = None, self.defaults[i]
+        for key in self.variants[i]:
+            if key in record:
+                present = present or key
+                v = record[key]
+                if v is not None and v != "":
+                    value = v
+                    break
+        old = self.keys[i]
+        if present is not None and present != old and (old is None or old not in record):
+            if old is not None:
+                drift = (self.names[i], old, present)
+                self.drift[drift] = self.drift.get(drift, 0) + 1
+            self.keys[i] = present
+        return value
+
+    def resolved(self):
+        """{field: key} for every field some record carried."""
+        return {name: key for name, key in zip(self.names, self.keys) if key is not None}
+
+    def report(self):
+        return [f"{self.schema.name}.{field}: '{old}' -> '{new}' in {n} record(s)"
+                for (field, old, new), n in sorted(self.drift.items())]
+
+
+def remember(conn, *extractors, log=print):
+    """Log drift within these extractors' streams and fields whose key differs
+    from the last run's, then record the keys in meta. Returns the logged lines.
+    A DB without a meta table is left alone."""
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key=?", (FIELD_MAP_KEY,)).fetchone()
+    except sqlite3.OperationalError:
+        return []
+    known = json.loads(row[0]) if row and row[0] else {}
+    lines, changed = [], False
+    for ex in extractors:
+        lines += ex.report()
+        drifted = {field for field, _, _ in ex.drift}
+        fields = known.setdefault(ex.schema.name, {})
+        for field, key in ex.resolved().items():
+            old = fields.get(field)
+            if old == key:
+                continue
+            if old is not None and field not in drifted:
+                lines.append(f"{ex.schema.name}.{field}: now '{key}' (was '{old}' last run)")
+            fields[field] = key
+            changed = True
+    if changed:
+        conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)",
+                     (FIELD_MAP_KEY, json.dumps(known, sort_keys=True)))
+    for line in lines:
+        log(f"  field drift: {line}")
+    return lines
+
+
+PROPERTY = Schema("properties", [
+    ("id", ("id", "propertyId", "propid"), None),
+    ("name", ("name",), None),
+    ("currency", ("currency",), None),
+    ("rooms", ("roomTypes", "rooms"), []),
+])
+
+ROOM = Schema("rooms", [
+    ("id", ("id", "roomId", "roomTypeId"), None),
+    ("name", ("name",), None),
+    ("qty", ("qty", "units", "roomQty"), 1),
+])
+
+BOOKING = Schema("bookings", [
+    ("id", ("id", "bookId", "bookingId"), None),
+    ("property_id", ("propertyId", "propId"), None),
+    ("room_id", ("roomId", "roomTypeId"), None),
+    ("status", ("status",), ""),
+    ("arrival", ("arrival", "firstNight"), None),
+    ("departure", ("departure", "lastNight"), None),
+    ("num_adult", ("numAdult", "adults"), 0),
+    ("num_child", ("numChild", "children"), 0),
+    ("price", ("price", "total"), 0),
+    ("channel", ("channel", "apiSource", "apiSourceId"), ""),
+    ("referer", ("referer", "source"), ""),
+    ("first_name", ("firstName", "guestFirstName"), None),
+    ("last_name", ("lastName", "guestName", "guestLastName"), None),
+    ("booking_time", ("bookingTime", "bookingDate"), None),
+    ("modified_time", ("modifiedTime", "modified"), None),
+])
+
+# a booking from GET /bookings?includeMessages=true, read for its messages only
+BOOKING_MESSAGES = Schema("booking_messages", [
+    ("messages", ("messages", "messageList"), None),
+    ("id", ("id", "bookId", "bookingId"), None),
+    ("property_id", ("propertyId", "propId"), None),
+    ("channel", ("referer", "channel", "apiSource"), "Other"),
+])
+
+# one day of GET /inventory/rooms/calendar
+AVAILABILITY = Schema("availability", [
+    ("date", ("date", "from"), None),
+    ("num_available", ("numAvail", "numAvailable", "inventory"), None),
+    ("price", ("price1", "price"), None),
+])
+
+MESSAGE = Schema("messages", [
+    ("id", ("id", "messageId", "msgId"), None),
+    ("booking_id", ("bookingId", "bookId", "booking_id"), None),
+    ("property_id", ("propertyId",), None),
+    ("type", ("source", "type", "messageType"), ""),
+    ("body", ("message", "text", "body"), ""),
+    ("time", ("time", "date", "dateTime", "created"), None),
+    ("read", ("read", "seen"), None),
+])
@@ -0,0 +1,190 @@
+"""
+Resident messages poller — one long-running process instead of launchd starting
+run_messages.sh (and a fresh Python for each of its steps) every 5 minutes.
+
+The Beds24 client (and its access token), the DB connection and the imports stay
+warm between polls. Each poll is the same incremental bulk call as
+messages_fetch.py (high-water mark, upsert-only-changes, webhook reconciliation),
+and the interval adapts to what the inbox looks like:
+
+  - ACTIVE_INTERVAL     a poll just found messages, or a thread moved within
+                        ACTIVE_MINUTES: a conversation is probably going on
+  - UNANSWERED_INTERVAL a guest is waiting on a reply (one who wrote within
+                        UNANSWERED_HOURS; an old thread that ended on the
+                        guest's "thanks" doesn't hold the interval down)
+  - otherwise back off from BASE_INTERVAL by BACKOFF per quiet poll, up to
+    MAX_INTERVAL (a quiet account at night costs a couple of calls an hour)
+
+The inbox is rebuilt only when a poll changed messages, plus once an hour for
+the page's "last fetch" stamp; MESSAGES_DEPLOY_CMD runs after a build that
+wrote something, as in run_messages.sh. A rate limit sleeps until the credit
+window resets; other errors are logged and retried at BASE_INTERVAL.
+
+Run:  python messages_daemon.py [--max-age 120] [--no-build]
+      python messages_daemon.py --once          # one poll + build, then exit
+"""
+
+import argparse
+import datetime as dt
+import os
+import sqlite3
+import subprocess
+import threading
+import urllib.error
+
+from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
+from build_messages_dashboard import OUT_PATH, build as build_page
+from common import DB_PATH, HERE
+from db import connect
+from messages_fetch import (fetch_bulk, finish_poll, init_messages_table, poll_due,
+                            poll_window, read_hwm)
+from messages_inbox import _now_epoch
+
+
+ACTIVE_INTERVAL = 60
+UNANSWERED_INTERVAL = 120
+BASE_INTERVAL = 300
+MAX_INTERVAL = 1800
+BACKOFF = 1.5
+ACTIVE_MINUTES = 30
+UNANSWERED_HOURS = 72
+MAX_AGE_DAYS = 120
+
+
+def next_interval(prev, changed, last_epoch, unanswered, now_epoch):
+    """Seconds until the next poll. last_epoch is the newest thread activity
+    (threads.last_epoch), unanswered the number of threads waiting on a reply
+    (see traffic())."""
+    if changed or (last_epoch is not None and now_epoch - last_epoch < ACTIVE_MINUTES * 60):
+        return ACTIVE_INTERVAL
+    if unanswered:
+        return UNANSWERED_INTERVAL
+    if prev is None or prev < BASE_INTERVAL:
+        return BASE_INTERVAL
+    return min(int(prev * BACKOFF), MAX_INTERVAL)
+
+
+def traffic(conn, now_epoch):
+    """(newest thread activity epoch or None, number of threads whose guest has
+    been waiting on a reply for less than UNANSWERED_HOURS)."""
+    try:
+        last = conn.execute("SELECT MAX(last_epoch) FROM threads").fetchone()[0]
+        unanswered = conn.execute(
+            "SELECT COUNT(*) FROM threads WHERE unanswered = 1 AND wait_start >= ?",
+            (now_epoch - UNANSWERED_HOURS * 3600,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None, 0
+    return last, unanswered
+
+
+def _log(msg):
+    print(f"[{dt.datetime.now().strftime('%H:%M:%S')}] {msg}", flush=True)
+
+
+class MessagesDaemon:
+
+    def __init__(self, client, db_path=DB_PATH, max_age=MAX_AGE_DAYS, build=True,
+                 out_path=OUT_PATH, deploy_cmd=None, log=_log):
+        self.client = client
+        self.db_path = db_path
+        self.out_path = out_path
+        self.max_age = max_age
+        self.build = build
+        self.deploy_cmd = deploy_cmd
+        self.log = log
+        self.conn = connect(db_path)
+        init_messages_table(self.conn)
+        self.interval = None
+        self.built_hour = None
+        self.skipping = False
+        self.stop_event = threading.Event()
+
+    def poll(self, now=None):
+        """One poll (unless webhooks make it unnecessary) + rebuild if needed.
+        Returns {"changed", "skipped", "built", "interval"}."""
+        now = now or dt.datetime.now()
+        hwm = read_hwm(self.conn)
+        due, why = poll_due(self.conn, hwm, now)
+        changed, skipped = 0, not due
+        if due:
+            window = poll_window(hwm, self.max_age, now)
+            changed, n_bk, n_rows, newest = fetch_bulk(self.client, self.conn, window)
+            finish_poll(self.conn, newest, now)
+            if changed:
+                self.log(f"{n_rows} messages across {n_bk} bookings ({window}d), "
+                         f"{changed} new or changed")
+        built = self._build(changed, now)
+        now_epoch = _now_epoch(now)
+        last, unanswered = traffic(self.conn, now_epoch)
+        prev = self.interval
+        self.interval = next_interval(prev, changed, last, unanswered, now_epoch)
+        if skipped and not self.skipping:
+            self.log(f"skipping polls — {why}")
+        self.skipping = skipped
+        if self.interval != prev:
+            self.log(f"polling every {self.interval}s ({unanswered} unanswered)")
+        return {"changed": changed, "skipped": skipped, "built": built,
+                "interval": self.interval}
+
+    def _build(self, changed, now):
+        hour = now.strftime("%Y-%m-%dT%H")
+        if not self.build or not (changed or hour != self.built_hour):
+            return False
+        self.built_hour = hour
+        _, inbox = build_page(self.db_path, self.out_path)
+        if inbox is None:
+            return False
+        s = inbox["summary"]
+        self.log(f"inbox rebuilt: threads={s['total_threads']} unanswered={s['unanswered']}")
+        if self.deploy_cmd:
+            self.log(f"deploying inbox: {self.deploy_cmd}")
+            subprocess.run(self.deploy_cmd, shell=True, cwd=HERE)
+        return True
+
+    def run(self, max_polls=None):
+        polls = 0
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+                wait = self.interval
+            except Beds24RateLimit as e:
+                wait = float(e.resets_in or BASE_INTERVAL)
+                self.log(f"rate limited — waiting {wait:.0f}s for the credit window")
+            except (Beds24Error, urllib.error.URLError, OSError, sqlite3.Error) as e:
+                wait = BASE_INTERVAL
+                self.log(f"poll failed ({e}); retrying in {wait}s")
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                break
+            self.stop_event.wait(wait)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--max-age", type=int, default=MAX_AGE_DAYS,
+                    help="Pull messages from the last N days on a full poll")
+    ap.add_argument("--no-build", action="store_true",
+                    help="Don't rebuild messages-dashboard.html")
+    ap.add_argument("--once", action="store_true", help="One poll, then exit")
+    args = ap.parse_args()
+
+    if not os.path.exists(args.db):
+        raise SystemExit("data/beds24.db not found — run fetch.py first to load bookings.")
+    daemon = MessagesDaemon(Beds24Client(), args.db, args.max_age, build=not args.no_build,
+                            deploy_cmd=os.environ.get("MESSAGES_DEPLOY_CMD") or None)
+    _log(f"messages poller started (pid {os.getpid()})")
+    try:
+        daemon.run(max_polls=1 if args.once else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+    if not args.once:
+        _log("messages poller stopped")
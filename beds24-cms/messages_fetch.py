@@ -7,36 +7,53 @@ Strategy (rate-limit friendly for frequent polling):
   1. Primary: GET /bookings with includeMessages=true over a "comms window"
      (current + near-future + recently-departed guests). One paginated call set
      returns each booking with its message thread embedded.
-  2. Fallback: if no embedded messages are present, call GET /bookings/messages
-     per booking in the window.
+  2. Fallback (--deep): GET /bookings/messages per booking, within a credit
+     budget, for the bookings sweep_scheduler.py ranks likeliest to have news.
+
+Polling is incremental: a high-water mark in meta ('messages_hwm': newest message
+time + id, and when the last successful poll started) limits the bulk call to the
+days since that poll plus OVERLAP_DAYS, and messages are upserted only when new or
+changed — so a poll costs in proportion to new traffic, not four months of history.
+--full (or no high-water mark yet) pulls the whole --max-age window.
 
 Message types per Beds24: guest | host | internalNote | system.
   - 'guest'  = inbound (from the guest)         -> counts for "unanswered"
   - 'host'   = outbound (you / your auto-replies)
   - internalNote / system are ignored for unanswered logic.
 
+When webhook_receiver.py is running and Beds24 is delivering to it, new messages
+arrive by push and a poll becomes a reconciliation: it is skipped unless the last
+one is RECONCILE_MINUTES old (--force polls anyway).
+
 Run:  python messages_fetch.py                # default comms window
-      python messages_fetch.py --days-back 30 --days-fwd 120
+      python messages_fetch.py --deep --deep-credits 25
+      python messages_fetch.py --full       # ignore the high-water mark
 """
 
 import argparse
 import datetime as dt
+import hashlib
 import json
+import math
 import os
-import sqlite3
 
-from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
+from beds24_client import Beds24Client, Beds24RateLimit
+from common import DB_PATH, save_raw
+from db import connect
+from fieldmap import MESSAGE, remember
+from messages_inbox import init_threads_table, refresh_threads, time_epoch
+from messages_search import init_search_index
 
-HERE = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(HERE, "data", "beds24.db")
-RAW_DIR = os.path.join(HERE, "raw")
 
+HWM_KEY = "messages_hwm"
+OVERLAP_DAYS = 1  # re-read this much before the last poll (late edits, clock skew)
 
-def _g(d, *keys, default=None):
-    for k in keys:
-        if isinstance(d, dict) and k in d and d[k] not in (None, ""):
-            return d[k]
-    return default
+# webhook_receiver.py keeps {"alive_at", "last_at", "refreshed"} here. While it is
+# running and Beds24 is delivering, polls drop to one per RECONCILE_MINUTES.
+WEBHOOK_KEY = "messages_webhook"
+WEBHOOK_ALIVE_MINUTES = 5
+WEBHOOK_QUIET_HOURS = 24
+RECONCILE_MINUTES = 60
 
 
 def _iso(d):
@@ -47,11 +64,12 @@ def init_messages_table(conn):
     conn.executescript(
         """
         CREATE TABLE IF NOT EXISTS messages (
-            id TEXT PRIMARY KEY,           -- stable id (or booking:index fallback)
+            id TEXT PRIMARY KEY,           -- stable id (or booking:h<content hash> fallback)
             booking_id INTEGER,
             property_id INTEGER,
             channel TEXT,                  -- Booking.com / Expedia / ...
             time TEXT,                     -- ISO timestamp of the message
+            time_epoch INTEGER,            -- time as seconds: the sort key (messages_inbox)
             mtype TEXT,                    -- guest | host | internalNote | system
             direction TEXT,                -- inbound | outbound | note | system
             read INTEGER,                  -- 1/0 if provided by API
@@ -62,13 +80,36 @@ def init_messages_table(conn):
         CREATE INDEX IF NOT EXISTS idx_msg_time ON messages(time);
         """
     )
+    init_search_index(conn)
+    _migrate_fallback_ids(conn)
+    init_threads_table(conn)
     conn.commit()
 
 
-def save_raw(name, payload):
-    os.makedirs(RAW_DIR, exist_ok=True)
-    with open(os.path.join(RAW_DIR, f"{name}.json"), "w") as f:
-        json.dump(payload, f, indent=2)
+def _fallback_id(booking_id, time, mtype, body):
+    """Id for a message the API returned without one: derived from its content, so
+    the same message gets the same id whatever window or page it arrives in."""
+    h = hashlib.sha1(f"{time}|{mtype}|{body}".encode("utf-8")).hexdigest()[:16]
+    return f"{booking_id}:h{h}"
+
+
+def _migrate_fallback_ids(conn):
+    """Older fetches keyed id-less messages booking:<position in the response>,
+    which shifts once polls return partial windows. Re-key them by content."""
+    rows = conn.execute(
+        "SELECT id, booking_id, time, mtype, body FROM messages WHERE id LIKE '%:%'"
+    ).fetchall()
+    for mid, bid, time, mtype, body in rows:
+        _, _, tail = mid.partition(":")
+        if not tail.isdigit():
+            continue
+        new = _fallback_id(bid, time, mtype, body)
+        # plain DELETE/UPDATE rather than OR REPLACE: REPLACE's implicit delete
+        # skips the triggers that keep messages_fts in sync
+        if conn.execute("SELECT 1 FROM messages WHERE id=?", (new,)).fetchone():
+            conn.execute("DELETE FROM messages WHERE id=?", (mid,))
+        else:
+            conn.execute("UPDATE messages SET id=? WHERE id=?", (new, mid))
 
 
 def _direction(mtype):
@@ -82,133 +123,256 @@ def _direction(mtype):
     return "system"
 
 
-def _store_message(conn, booking_id, property_id, channel, msg, idx):
-    mid = _g(msg, "id", "messageId", "msgId")
+MESSAGE_COLUMNS = ("id", "booking_id", "property_id", "channel", "time", "time_epoch",
+                   "mtype", "direction", "read", "body", "raw")
+
+
+def _message_row(booking_id, property_id, channel, msg, f):
+    """One messages row (MESSAGE_COLUMNS order) from a message and its MESSAGE
+    fields f. property_id / channel are the caller's fallbacks; ingest_messages
+    prefers what the bookings table says."""
+    mtype = str(f["type"]).strip()
+    body, time, read, mid = f["body"], f["time"], f["read"], f["id"]
     if mid is None:
-        mid = f"{booking_id}:{idx}"  # synthesize a stable id
-    mtype = str(_g(msg, "source", "type", "messageType", default="")).strip()
-    body = _g(msg, "message", "text", "body", default="")
-    time = _g(msg, "time", "date", "dateTime", "created", default=None)
-    read = _g(msg, "read", "seen", default=None)
-    conn.execute(
-        """INSERT OR REPLACE INTO messages
-           (id,booking_id,property_id,channel,time,mtype,direction,read,body,raw)
-           VALUES (?,?,?,?,?,?,?,?,?,?)""",
-        (
-            str(mid), booking_id, property_id, channel, time, mtype,
-            _direction(mtype),
-            (1 if read in (True, 1, "1", "true") else (0 if read is not None else None)),
-            body, json.dumps(msg),
-        ),
+        mid = _fallback_id(booking_id, time, mtype, body)
+    return (
+        str(mid), booking_id, property_id, channel, time, time_epoch(time), mtype,
+        _direction(mtype),
+        (1 if read in (True, 1, "1", "true") else (0 if read is not None else None)),
+        body, json.dumps(msg),
     )
 
 
-def _channel_for_booking(conn, booking_id, fallback=None):
-    row = conn.execute(
-        "SELECT referer, channel FROM bookings WHERE id=?", (booking_id,)
-    ).fetchone()
-    if row:
-        return (row[0] or row[1] or fallback or "Other")
-    return fallback or "Other"
+def ingest_messages(conn, batch):
+    """Upsert a batch of (booking_id, property_id, channel, msg) in one transaction.
+    An item may carry msg's MESSAGE fields as a fifth element if the caller has
+    already extracted them (fetch_bulk); otherwise they are extracted here.
+
+    Rows are staged in a temp table with executemany, property and channel are
+    resolved with one join against bookings (falling back to the values given),
+    and a single INSERT ... SELECT upserts them — writing only rows that are new or
+    whose payload / booking / property / channel changed. The threads rows of the
+    bookings those writes touched are refreshed in the same transaction. Returns
+    (changed, newest) where newest is the (time, id) of the newest message in the
+    batch, or None."""
+    fields = None
+    rows = []
+    for item in batch:
+        if len(item) < 5:
+            fields = fields or MESSAGE.extractor()
+            item = (*item, fields(item[3]))
+        rows.append(_message_row(*item))
+    if not rows:
+        return 0, None
+    if fields is not None:
+        remember(conn, fields)
+    newest = max(((r[4] or "", r[0]) for r in rows))
+    cols = ", ".join(MESSAGE_COLUMNS)
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS message_stage ({cols}, "
+                 f"PRIMARY KEY (id))")
+    conn.execute("DELETE FROM message_stage")
+    # a message repeated within the batch keeps its last copy
+    conn.executemany(f"INSERT OR REPLACE INTO message_stage ({cols}) "
+                     f"VALUES ({', '.join('?' * len(MESSAGE_COLUMNS))})", rows)
+    # a message moving to another booking also touches the thread it left
+    touched = {r[0] for r in conn.execute(
+        "SELECT m.booking_id FROM messages m JOIN message_stage s ON s.id = m.id "
+        "WHERE m.booking_id IS NOT s.booking_id")}
+    written = conn.execute(
+        f"""INSERT INTO messages ({cols})
+           SELECT s.id, s.booking_id, COALESCE(b.property_id, s.property_id),
+                  COALESCE(NULLIF(b.referer, ''), NULLIF(b.channel, ''),
+                           NULLIF(s.channel, ''), 'Other'),
+                  s.time, s.time_epoch, s.mtype, s.direction, s.read, s.body, s.raw
+           FROM message_stage s LEFT JOIN bookings b ON b.id = s.booking_id
+           WHERE true
+           ON CONFLICT(id) DO UPDATE SET
+             booking_id=excluded.booking_id, property_id=excluded.property_id,
+             channel=excluded.channel, time=excluded.time, time_epoch=excluded.time_epoch,
+             mtype=excluded.mtype,
+             direction=excluded.direction, read=excluded.read, body=excluded.body,
+             raw=excluded.raw
+           WHERE messages.raw IS NOT excluded.raw
+              OR messages.booking_id IS NOT excluded.booking_id
+              OR messages.property_id IS NOT excluded.property_id
+              OR messages.channel IS NOT excluded.channel
+           RETURNING booking_id""").fetchall()
+    touched.update(r[0] for r in written)
+    refresh_threads(conn, touched)
+    conn.execute("DELETE FROM message_stage")
+    conn.commit()
+    return len(written), (newest[0] or None, newest[1])
+
+
+def read_hwm(conn):
+    """The polling high-water mark: {"time", "id", "polled_at"}, or None."""
+    row = conn.execute("SELECT value FROM meta WHERE key=?", (HWM_KEY,)).fetchone()
+    try:
+        return json.loads(row[0]) if row else None
+    except ValueError:
+        return None
+
+
+def save_hwm(conn, hwm):
+    conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)",
+                 (HWM_KEY, json.dumps(hwm)))
+
+
+def advance_hwm(hwm, newest, polled_at):
+    """New mark after a successful poll that started at polled_at. `newest` is the
+    (time, id) of the newest message seen, or None; the mark never moves back."""
+    out = dict(hwm or {})
+    if newest and (newest[0] or "", newest[1]) > (out.get("time") or "", out.get("id") or ""):
+        out["time"], out["id"] = newest
+    out["polled_at"] = polled_at.isoformat(timespec="seconds")
+    return out
+
+
+def poll_window(hwm, max_age_days, now=None):
+    """maxAge (whole days) for the next bulk call: the days since the last
+    successful poll plus OVERLAP_DAYS, capped at max_age_days. No mark -> full."""
+    polled = (hwm or {}).get("polled_at")
+    if not polled:
+        return max_age_days
+    now = now or dt.datetime.now()
+    try:
+        since = now - dt.datetime.fromisoformat(polled)
+    except ValueError:
+        return max_age_days
+    days = math.ceil(max(since.total_seconds(), 0) / 86400) + OVERLAP_DAYS
+    return max(1, min(days, max_age_days))
+
+
+def read_webhook_state(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key=?", (WEBHOOK_KEY,)).fetchone()
+    try:
+        return json.loads(row[0]) if row else {}
+    except ValueError:
+        return {}
+
+
+def _minutes_since(iso, now):
+    try:
+        return (now - dt.datetime.fromisoformat(iso)).total_seconds() / 60
+    except (TypeError, ValueError):
+        return None
+
+
+def poll_due(conn, hwm, now=None):
+    """(due, reason). Always due unless the webhook receiver is alive, has had a
+    delivery in the last WEBHOOK_QUIET_HOURS and the last successful poll is less
+    than RECONCILE_MINUTES old — then the poll is only a reconciliation."""
+    now = now or dt.datetime.now()
+    hook = read_webhook_state(conn)
+    alive = _minutes_since(hook.get("alive_at"), now)
+    last = _minutes_since(hook.get("last_at"), now)
+    if alive is None or alive > WEBHOOK_ALIVE_MINUTES:
+        return True, "webhook receiver not running"
+    if last is None or last > WEBHOOK_QUIET_HOURS * 60:
+        return True, "no webhook deliveries lately"
+    polled = _minutes_since((hwm or {}).get("polled_at"), now)
+    if polled is None or polled >= RECONCILE_MINUTES:
+        return True, "reconciliation due"
+    return False, (f"webhooks live (last {last:.0f} min ago); next reconciliation in "
+                   f"{RECONCILE_MINUTES - polled:.0f} min")
 
 
 def fetch_bulk(client, conn, max_age_days):
     """Primary, credit-cheap path: ONE account-wide call for recent messages.
     GET /bookings/messages?maxAge=<days>. Each message references its bookingId;
-    channel is looked up from the bookings table."""
+    property and channel come from the bookings table. Returns (changed, bookings,
+    rows, newest) where newest is the (time, id) of the newest message seen."""
     rows = client.get_all_pages("/bookings/messages", params={"maxAge": max_age_days})
     save_raw("messages_bulk", {"count": len(rows), "data": rows[:50]})
-    total = 0
-    # group by booking for stable per-thread indexing
-    by_booking = {}
+    fields = MESSAGE.extractor()
+    batch = []
     for m in rows:
-        bid = _g(m, "bookingId", "bookId", "booking_id")
-        by_booking.setdefault(bid, []).append(m)
-    for bid, msgs in by_booking.items():
-        pid_row = conn.execute("SELECT property_id FROM bookings WHERE id=?", (bid,)).fetchone()
-        pid = pid_row[0] if pid_row else _g(msgs[0], "propertyId")
-        channel = _channel_for_booking(conn, bid)
-        for i, m in enumerate(msgs):
-            _store_message(conn, bid, pid, channel, m, i)
-            total += 1
-    conn.commit()
-    return total, len(by_booking), len(rows)
-
-
-def fetch_deep(client, conn, days_back, days_fwd, max_queries=25):
-    """Opt-in fallback (--deep): per-booking GET /bookings/messages, but HARD
-    CAPPED and credit-aware so it can never blow the budget. Stops on 429."""
-    today = dt.date.today()
-    lo = (today - dt.timedelta(days=days_back)).isoformat()
-    hi = (today + dt.timedelta(days=days_fwd)).isoformat()
-    booking_ids = [r[0] for r in conn.execute(
-        "SELECT id FROM bookings WHERE departure >= ? AND arrival <= ? ORDER BY arrival LIMIT ?",
-        (lo, hi, max_queries)
-    ).fetchall()]
-    total = 0
-    sample = []
-    for bid in booking_ids:
-        try:
-            payload = client.get("/bookings/messages", params={"bookingId": bid})
-        except Beds24RateLimit as e:
-            print(f"  stopped early — rate limited after {total} messages ({e.resets_in}s to reset)")
-            break
-        except Beds24Error:
-            continue
-        data = payload.get("data", payload if isinstance(payload, list) else [])
-        if data and len(sample) < 20:
-            sample.append({"bookingId": bid, "data": data})
-        pid_row = conn.execute("SELECT property_id FROM bookings WHERE id=?", (bid,)).fetchone()
-        pid = pid_row[0] if pid_row else None
-        channel = _channel_for_booking(conn, bid)
-        for i, m in enumerate(data):
-            _store_message(conn, bid, pid, channel, m, i)
-            total += 1
-    if sample:
-        save_raw("messages_deep", sample)
-    conn.commit()
-    return total, len(booking_ids)
+        f = fields(m)
+        batch.append((f["booking_id"], f["property_id"], None, m, f))
+    remember(conn, fields)
+    total, newest = ingest_messages(conn, batch)
+    return total, len({b[0] for b in batch}), len(rows), newest
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--max-age", type=int, default=120,
-                    help="Pull messages from the last N days (bulk call)")
-    ap.add_argument("--days-back", type=int, default=30)
-    ap.add_argument("--days-fwd", type=int, default=120)
-    ap.add_argument("--deep", action="store_true",
-                    help="Also do a capped per-booking sweep (more API credits)")
-    args = ap.parse_args()
+def fetch_deep(client, conn, budget=25):
+    """Opt-in fallback (--deep): per-booking GET /bookings/messages, HARD CAPPED at
+    `budget` credits and spent on the bookings likeliest to have new messages
+    (sweep_scheduler.py). Stops on 429. Returns (changed, bookings checked)."""
+    from sweep_scheduler import run_cycle
 
-    if not os.path.exists(DB_PATH):
-        raise SystemExit("data/beds24.db not found — run fetch.py first to load bookings.")
+    res = run_cycle(client, conn, budget)
+    if res["rate_limited"]:
+        print(f"  stopped early — rate limited after {res['checked']} bookings")
+    return res["changed"], res["checked"]
+
+
+def finish_poll(conn, newest, polled_at):
+    """Record a successful poll that started at polled_at. Only a poll that got
+    this far moves the mark: a rate-limited one retries the same window."""
+    save_hwm(conn, advance_hwm(read_hwm(conn), newest, polled_at))
+    conn.execute(
+        "INSERT OR REPLACE INTO meta (key,value) VALUES ('last_messages_fetch', ?)",
+        (dt.datetime.now().isoformat(timespec="seconds"),),
+    )
+    conn.commit()
 
-    conn = sqlite3.connect(DB_PATH)
-    init_messages_table(conn)
-    client = Beds24Client()
 
+def poll(client, conn, max_age=120, full=False, force=False, deep=False, deep_credits=25):
+    """One poll on an open client + connection (main(), beds24.py messages).
+    Returns the number of new or changed messages, or None if skipped or rate
+    limited."""
+    init_messages_table(conn)
+    hwm = None if full else read_hwm(conn)
+    due, why = poll_due(conn, hwm)
+    if not (due or full or force or deep):
+        print(f"Skipping poll — {why}")
+        return None
+    window = poll_window(hwm, max_age)
+    polled_at = dt.datetime.now()
     try:
-        print(f"Fetching messages (bulk, last {args.max_age} days)...")
-        n_msg, n_bk, n_rows = fetch_bulk(client, conn, args.max_age)
-        print(f"  {n_rows} messages across {n_bk} bookings, stored {n_msg}")
-        if args.deep:
+        print(f"Fetching messages (bulk, last {window} days"
+              f"{'' if hwm else ', full window'})...")
+        n_msg, n_bk, n_rows, newest = fetch_bulk(client, conn, window)
+        print(f"  {n_rows} messages across {n_bk} bookings, {n_msg} new or changed")
+        if deep:
             print("Deep sweep (capped)...")
-            dn, dq = fetch_deep(client, conn, args.days_back, args.days_fwd)
-            print(f"  deep: queried {dq} bookings, stored {dn} more")
+            dn, dq = fetch_deep(client, conn, deep_credits)
+            print(f"  deep: checked {dq} bookings, {dn} with new or changed messages")
     except Beds24RateLimit as e:
         print(f"RATE LIMITED — backing off. {e}")
         print(f"  credit remaining={e.remaining}, resets in {e.resets_in}s. "
               f"Try again after the window resets.")
-        conn.close()
-        return
+        return None
+    finish_poll(conn, newest, polled_at)
+    return n_msg
 
-    conn.execute(
-        "INSERT OR REPLACE INTO meta (key,value) VALUES ('last_messages_fetch', ?)",
-        (dt.datetime.now().isoformat(timespec="seconds"),),
-    )
-    conn.commit()
+
+def add_arguments(ap):
+    ap.add_argument("--max-age", type=int, default=120,
+                    help="Pull messages from the last N days (bulk call) on a full poll")
+    ap.add_argument("--full", action="store_true",
+                    help="Ignore the high-water mark and pull the whole --max-age window")
+    ap.add_argument("--force", action="store_true",
+                    help="Poll even if webhooks are live and a reconciliation isn't due")
+    ap.add_argument("--deep", action="store_true",
+                    help="Also do a capped per-booking sweep (more API credits)")
+    ap.add_argument("--deep-credits", type=float, default=25,
+                    help="Credit budget for the --deep sweep")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add_arguments(ap)
+    args = ap.parse_args()
+
+    if not os.path.exists(DB_PATH):
+        raise SystemExit("data/beds24.db not found — run fetch.py first to load bookings.")
+
+    conn = connect(DB_PATH)
+    if poll(Beds24Client(), conn, args.max_age, args.full, args.force, args.deep,
+            args.deep_credits) is not None:
+        print("Done. Raw in ./raw, messages in data/beds24.db")
     conn.close()
-    print("Done. Raw in ./raw, messages in data/beds24.db")
 
 
 if __name__ == "__main__":
@@ -4,84 +4,193 @@ unanswered detection. Pure functions so the logic is unit-testable.
 
 A thread is "unanswered" when, ignoring internal notes and system messages, the
 most recent message is from the guest (inbound) — i.e. you haven't replied yet.
+
+Thread state (last message, unanswered, wait start, unread and message counts)
+is kept in the threads table and refreshed by messages_fetch.ingest_messages only
+for the bookings an ingest touched; build_inbox reads that table rather than
+regrouping and re-sorting the whole message history. messages.time_epoch is the
+normalised, indexed sort key.
 """
 
+import calendar
 import datetime as dt
 import sqlite3
 
+from db import reading
+
+PREVIEW_CHARS = 160
+# thread columns persisted in the threads table (wait_hours is derived from
+# wait_start at build time, so the table never goes stale as time passes)
+THREAD_COLUMNS = ("booking_id", "property_id", "channel", "message_count", "last_time",
+                  "last_epoch", "last_type", "last_direction", "unanswered", "wait_start",
+                  "unread", "preview")
+
 
 def _dt(s):
     if not s:
         return None
-    s = str(s)
-    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
-        try:
-            return dt.datetime.strptime(s[:19], fmt)
-        except ValueError:
-            continue
     try:
-        return dt.datetime.fromisoformat(s[:19])
+        return dt.datetime.fromisoformat(str(s)[:19])
     except ValueError:
         return None
 
 
+def time_epoch(s):
+    """Message time -> integer seconds, the normalised sort key stored in
+    messages.time_epoch. Naive timestamps are taken as-is (no zone shift), so
+    differences against _now_epoch() are wall-clock hours like before."""
+    d = _dt(s)
+    return calendar.timegm(d.timetuple()) if d else None
+
+
+def _now_epoch(now=None):
+    return calendar.timegm((now or dt.datetime.now()).timetuple())
+
+
+def init_threads_table(conn):
+    """messages.time_epoch (+ index) and the threads table; backfills both the
+    first time they appear on an existing DB."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(messages)")}
+    if "time_epoch" not in cols:
+        conn.execute("ALTER TABLE messages ADD COLUMN time_epoch INTEGER")
+        rows = conn.execute("SELECT id, time FROM messages WHERE time IS NOT NULL").fetchall()
+        conn.executemany("UPDATE messages SET time_epoch=? WHERE id=?",
+                         [(time_epoch(t), mid) for mid, t in rows])
+    conn.executescript(
+        """
+        CREATE INDEX IF NOT EXISTS idx_msg_booking_epoch ON messages(booking_id, time_epoch);
+        CREATE TABLE IF NOT EXISTS threads (
+            booking_id INTEGER PRIMARY KEY,
+            property_id INTEGER,
+            channel TEXT,
+            message_count INTEGER,        -- guest/host messages (all, if none)
+            last_time TEXT,
+            last_epoch INTEGER,
+            last_type TEXT,
+            last_direction TEXT,
+            unanswered INTEGER,           -- 1 = last guest/host message is inbound
+            wait_start INTEGER,           -- epoch of that inbound message, if unanswered
+            unread INTEGER,
+            preview TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_threads_order ON threads(unanswered, wait_start, last_epoch);
+        """
+    )
+    if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM threads)").fetchone()[0]:
+        refresh_threads(conn)
+
+
+def thread_state(bid, msgs_sorted):
+    """Persisted state of one thread from its messages, oldest first."""
+    # conversation = guest/host only (exclude internal notes & system)
+    convo = [m for m in msgs_sorted if (m.get("direction") in ("inbound", "outbound"))]
+    if not convo:
+        convo = msgs_sorted
+    last = convo[-1]
+    unanswered = last.get("direction") == "inbound"
+    last_epoch = last.get("time_epoch") or time_epoch(last.get("time"))
+    return {
+        "booking_id": bid,
+        "property_id": last.get("property_id"),
+        "channel": last.get("channel") or "Other",
+        "message_count": len(convo),
+        "last_time": last.get("time"),
+        "last_epoch": last_epoch,
+        "last_type": last.get("mtype"),
+        "last_direction": last.get("direction"),
+        "unanswered": unanswered,
+        # waiting time = since the last inbound that has no later outbound
+        "wait_start": last_epoch if unanswered else None,
+        "unread": sum(1 for m in convo if m.get("direction") == "inbound" and m.get("read") == 0),
+        "preview": (last.get("body") or "")[:PREVIEW_CHARS],
+    }
+
+
+def _thread(state, now_epoch):
+    """Thread as the inbox page sees it: state + wait_hours at now_epoch."""
+    wait = state["wait_start"]
+    return {
+        "booking_id": state["booking_id"],
+        "property_id": state["property_id"],
+        "channel": state["channel"],
+        "unanswered": bool(state["unanswered"]),
+        "wait_hours": round((now_epoch - wait) / 3600, 1) if wait is not None else None,
+        "unread": state["unread"],
+        "last_time": state["last_time"],
+        "last_type": state["last_type"],
+        "message_count": state["message_count"],
+        "preview": state["preview"],
+    }
+
+
+def _sort_key(t):
+    # unanswered first, longest-waiting first; then answered by most recent
+    if t["unanswered"]:
+        return (0, -(t["wait_hours"] or 0))
+    return (1, -(time_epoch(t["last_time"]) or float("-inf")))
+
+
+def _message(m):
+    return {"time": m.get("time"), "direction": m.get("direction"),
+            "type": m.get("mtype"), "body": m.get("body") or ""}
+
+
 def build_threads(messages, now=None):
     """messages: list of dicts with keys booking_id, channel, property_id, time,
     mtype, direction, body, read. Returns thread list + summary."""
-    now = now or dt.datetime.now()
+    now_epoch = _now_epoch(now)
     by_booking = {}
     for m in messages:
         by_booking.setdefault(m["booking_id"], []).append(m)
 
     threads = []
     for bid, msgs in by_booking.items():
-        msgs_sorted = sorted(msgs, key=lambda x: (_dt(x.get("time")) or dt.datetime.min))
-        # conversation = guest/host only (exclude internal notes & system)
-        convo = [m for m in msgs_sorted if (m.get("direction") in ("inbound", "outbound"))]
-        if not convo:
-            convo = msgs_sorted
-        last = convo[-1]
-        unanswered = last.get("direction") == "inbound"
-        # waiting time = since the last inbound that has no later outbound
-        wait_hours = None
-        if unanswered:
-            t = _dt(last.get("time"))
-            if t:
-                wait_hours = round((now - t).total_seconds() / 3600, 1)
-        unread = sum(1 for m in convo if m.get("direction") == "inbound" and m.get("read") == 0)
-        threads.append({
-            "booking_id": bid,
-            "property_id": last.get("property_id"),
-            "channel": last.get("channel") or "Other",
-            "unanswered": unanswered,
-            "wait_hours": wait_hours,
-            "unread": unread,
-            "last_time": last.get("time"),
-            "last_type": last.get("mtype"),
-            "message_count": len(convo),
-            "preview": (last.get("body") or "")[:160],
-            "messages": [
-                {
-                    "time": m.get("time"),
-                    "direction": m.get("direction"),
-                    "type": m.get("mtype"),
-                    "body": m.get("body") or "",
-                }
-                for m in msgs_sorted
-            ],
-        })
-
-    # sort: unanswered first, longest-waiting first; then answered by most recent
-    def sort_key(t):
-        if t["unanswered"]:
-            return (0, -(t["wait_hours"] or 0))
-        last = _dt(t["last_time"]) or dt.datetime.min
-        return (1, -last.timestamp())
-
-    threads.sort(key=sort_key)
+        msgs_sorted = sorted(msgs, key=lambda x: (time_epoch(x.get("time")) or float("-inf")))
+        t = _thread(thread_state(bid, msgs_sorted), now_epoch)
+        t["messages"] = [_message(m) for m in msgs_sorted]
+        threads.append(t)
+    threads.sort(key=_sort_key)
     return threads
 
 
+def refresh_threads(conn, booking_ids=None):
+    """Recompute the threads rows for booking_ids (all bookings if None) from
+    messages, in the caller's transaction. Bookings left with no messages are
+    dropped. Reads messages already ordered by (booking_id, time_epoch)."""
+    sql = "SELECT * FROM messages"
+    if booking_ids is not None:
+        booking_ids = sorted({b for b in booking_ids if b is not None})
+        if not booking_ids:
+            return 0
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS thread_refresh (booking_id PRIMARY KEY)")
+        conn.execute("DELETE FROM thread_refresh")
+        conn.executemany("INSERT OR IGNORE INTO thread_refresh VALUES (?)",
+                         [(b,) for b in booking_ids])
+        sql += " WHERE booking_id IN (SELECT booking_id FROM thread_refresh)"
+        conn.execute("DELETE FROM threads WHERE booking_id IN "
+                     "(SELECT booking_id FROM thread_refresh)")
+    else:
+        conn.execute("DELETE FROM threads")
+    cur = conn.execute(sql + " ORDER BY booking_id, time_epoch, rowid")
+    cols = [d[0] for d in cur.description]
+    states, bid, msgs = [], None, []
+    for row in cur:
+        m = dict(zip(cols, row))
+        if msgs and m["booking_id"] != bid:
+            states.append(thread_state(bid, msgs))
+            msgs = []
+        bid = m["booking_id"]
+        msgs.append(m)
+    if msgs:
+        states.append(thread_state(bid, msgs))
+    conn.executemany(
+        f"INSERT INTO threads ({', '.join(THREAD_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(THREAD_COLUMNS))})",
+        [tuple(int(s[c]) if c == "unanswered" else s[c] for c in THREAD_COLUMNS)
+         for s in states])
+    return len(states)
+
+
 def summarize(threads):
     by_channel = {}
     unanswered = 0
@@ -99,27 +208,82 @@ def summarize(threads):
     }
 
 
-def build_inbox(db_path):
-    conn = sqlite3.connect(db_path)
+def iter_thread_messages(conn, booking_ids=None):
+    """(booking_id, [message, ...]) per thread, oldest message first, from one
+    ordered scan of messages (or just booking_ids)."""
+    sql = "SELECT booking_id, time, direction, mtype, body FROM messages"
+    params = []
+    if booking_ids is not None:
+        params = list(booking_ids)
+        sql += f" WHERE booking_id IN ({','.join('?' * len(params))})"
+    bid, msgs = None, []
+    for b, time, direction, mtype, body in conn.execute(
+            sql + " ORDER BY booking_id, time_epoch, rowid", params):
+        if msgs and b != bid:
+            yield bid, msgs
+            msgs = []
+        bid = b
+        msgs.append(_message({"time": time, "direction": direction, "mtype": mtype,
+                              "body": body}))
+    if msgs:
+        yield bid, msgs
+
+
+def thread_messages(conn, booking_id):
+    """One conversation, oldest first ([] if the booking has no messages)."""
+    for _, msgs in iter_thread_messages(conn, [booking_id]):
+        return msgs
+    return []
+
+
+def _load_threads(conn, now=None, with_messages=False):
+    """Threads from the threads table; their messages too if with_messages."""
     conn.row_factory = sqlite3.Row
-    try:
-        rows = [dict(r) for r in conn.execute("SELECT * FROM messages").fetchall()]
-    except sqlite3.OperationalError:
-        rows = []
-    prop_names = {}
-    try:
-        for r in conn.execute("SELECT id,name FROM properties").fetchall():
-            prop_names[r[0]] = r[1]
-    except sqlite3.OperationalError:
-        pass
-    meta = {}
-    try:
-        meta = {r[0]: r[1] for r in conn.execute("SELECT key,value FROM meta").fetchall()}
-    except sqlite3.OperationalError:
-        pass
-    conn.close()
+    now_epoch = _now_epoch(now)
+    threads = [_thread(dict(r), now_epoch) for r in conn.execute("SELECT * FROM threads")]
+    conn.row_factory = None
+    if with_messages:
+        by_booking = {t["booking_id"]: t for t in threads}
+        for t in threads:
+            t["messages"] = []
+        for bid, msgs in iter_thread_messages(conn):
+            if bid in by_booking:
+                by_booking[bid]["messages"] = msgs
+    threads.sort(key=_sort_key)
+    return threads
+
+
+def build_inbox(db_path, with_messages=False):
+    """Inbox index: summary + one entry per thread (preview, counts, wait). Each
+    thread's conversation is only included with with_messages; otherwise the page
+    loads it on demand (thread_messages / the threads/<id>.json shards)."""
+    with reading(db_path) as conn:
+        try:
+            threads = _load_threads(conn, with_messages=with_messages)
+        except sqlite3.OperationalError:
+            # no threads table yet (messages_fetch hasn't run on this DB): derive in memory
+            conn.row_factory = sqlite3.Row
+            try:
+                rows = [dict(r) for r in conn.execute("SELECT * FROM messages").fetchall()]
+            except sqlite3.OperationalError:
+                rows = []
+            conn.row_factory = None
+            threads = build_threads(rows)
+            if not with_messages:
+                for t in threads:
+                    del t["messages"]
+        prop_names = {}
+        try:
+            for r in conn.execute("SELECT id,name FROM properties").fetchall():
+                prop_names[r[0]] = r[1]
+        except sqlite3.OperationalError:
+            pass
+        meta = {}
+        try:
+            meta = {r[0]: r[1] for r in conn.execute("SELECT key,value FROM meta").fetchall()}
+        except sqlite3.OperationalError:
+            pass
 
-    threads = build_threads(rows)
     for t in threads:
         t["property"] = prop_names.get(t["property_id"], t["property_id"])
     return {
@@ -0,0 +1,206 @@
+"""
+Full-text search over guest messages — SQLite FTS5, no extra dependencies.
+
+messages_fts is an external-content FTS5 index over messages.body (the text lives
+once, in messages; the index holds only tokens). Triggers on messages keep it in
+sync, so every ingest (insert, upsert or delete) updates it in the same
+transaction. Ranking is FTS5's bm25; each hit thread is returned once, with its
+best-matching message and a snippet around the match.
+
+    search(conn, "parking")                           # ranked threads
+    search(conn, "early check-in", channel="Booking.com", since="2026-01-01")
+
+Query text is treated as words (all must match, any order); "quoted phrases" stay
+phrases and a trailing * on a word matches prefixes (park*). raw=True passes FTS5
+query syntax through untouched (OR, NEAR, column filters...).
+
+The index refers to messages by rowid. VACUUM can renumber rowids of a table
+without an INTEGER PRIMARY KEY, so run `python messages_search.py --rebuild` after
+one (it's also safe at any other time).
+
+Run:  python messages_search.py parking [--channel Booking.com] [--property 101]
+                                [--from 2026-01-01] [--to 2026-07-01] [--limit 20] [--json]
+      python messages_search.py --rebuild
+"""
+
+import argparse
+import datetime as dt
+import json
+import re
+
+from common import DB_PATH
+from db import connect
+from messages_inbox import time_epoch
+
+
+RESULT_LIMIT = 20
+MAX_RESULT_LIMIT = 200
+SNIPPET_TOKENS = 12
+# snippet match markers: control characters can't occur in the escaped page text,
+# so the inbox swaps them for <mark> after HTML-escaping
+MARK_OPEN, MARK_CLOSE = "\x02", "\x03"
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    body, content='messages', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, body) VALUES (new.rowid, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, body) VALUES ('delete', old.rowid, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF body ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, body) VALUES ('delete', old.rowid, old.body);
+    INSERT INTO messages_fts(rowid, body) VALUES (new.rowid, new.body);
+END;
+"""
+
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name=?", (name,)).fetchone() is not None
+
+
+def init_search_index(conn):
+    """Create the index + sync triggers if missing (building it from existing
+    messages the first time). No-op on a DB without a messages table."""
+    if not _has_table(conn, "messages"):
+        return False
+    if not _has_table(conn, "messages_fts"):
+        conn.executescript(SCHEMA)
+        rebuild_search_index(conn)
+    return True
+
+
+def rebuild_search_index(conn):
+    conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def to_match(text):
+    """Plain search text -> FTS5 MATCH expression: every word/phrase quoted (so
+    punctuation like check-in or it's can't be a syntax error), all required."""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text or ""):
+        term = phrase if phrase else word
+        prefix = not phrase and term.endswith("*")
+        term = term.rstrip("*").replace('"', '""').strip()
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _bound(value):
+    """ISO date/datetime -> epoch (messages.time_epoch scale), or None if not
+    given. A bound that doesn't parse is a ValueError, not a dropped filter."""
+    if not value:
+        return None
+    epoch = time_epoch(value)
+    if epoch is None:
+        raise ValueError(f"bad date: {value!r}")
+    return epoch
+
+
+def _as_list(v):
+    if v is None or v == "":
+        return []
+    if isinstance(v, (list, tuple)):
+        return [x for x in v if x not in (None, "")]
+    return [x.strip() for x in str(v).split(",") if x.strip()]
+
+
+def search(conn, query, channel=None, property_id=None, since=None, until=None,
+           limit=RESULT_LIMIT, raw=False):
+    """Threads matching `query`, best first. channel / property_id take a value, a
+    list or a comma-separated string; since is inclusive, until exclusive (ISO).
+    Returns {"query", "match", "results": [...]}; each result is one booking's
+    thread with its best message's id, time and snippet and the number of hits."""
+    limit = max(1, min(int(limit or RESULT_LIMIT), MAX_RESULT_LIMIT))
+    bounds = ((">=", _bound(since)), ("<", _bound(until)))
+    match = query if raw else to_match(query)
+    out = {"query": query, "match": match, "results": []}
+    if not match:
+        return out
+    where, params = ["messages_fts MATCH ?"], [match]
+    for col, values in (("m.channel", _as_list(channel)),
+                        ("m.property_id", [int(p) for p in _as_list(property_id)])):
+        if values:
+            where.append(f"{col} IN ({','.join('?' * len(values))})")
+            params += values
+    for op, value in bounds:
+        if value is not None:
+            where.append(f"m.time_epoch {op} ?")
+            params.append(value)
+    # one row per thread: min(rank) picks the best message's bare columns (SQLite)
+    rows = conn.execute(
+        f"""SELECT m.booking_id, MIN(messages_fts.rank) AS best, COUNT(*) AS hits, m.rowid,
+                   m.id, m.time, m.channel, m.property_id, m.direction
+            FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+            WHERE {' AND '.join(where)}
+            GROUP BY m.booking_id ORDER BY best LIMIT ?""",
+        params + [limit]).fetchall()
+    if not rows:
+        return out
+    # snippets only for the messages actually returned
+    rowids = [r[3] for r in rows]
+    snippets = dict(conn.execute(
+        f"""SELECT rowid, snippet(messages_fts, 0, ?, ?, '…', ?) FROM messages_fts
+            WHERE messages_fts MATCH ? AND rowid IN ({','.join('?' * len(rowids))})""",
+        [MARK_OPEN, MARK_CLOSE, SNIPPET_TOKENS, match] + rowids))
+    names = dict(conn.execute("SELECT id, name FROM properties")) \
+        if _has_table(conn, "properties") else {}
+    for bid, best, hits, rowid, mid, time, chan, pid, direction in rows:
+        out["results"].append({
+            "booking_id": bid, "property_id": pid, "property": names.get(pid, pid),
+            "channel": chan, "message_id": mid, "time": time, "direction": direction,
+            "hits": hits, "score": round(-best, 6), "snippet": snippets.get(rowid, ""),
+        })
+    return out
+
+
+def search_db(db_path, query, **filters):
+    conn = connect(db_path)
+    try:
+        if not init_search_index(conn):
+            return {"query": query, "match": "", "results": []}
+        return search(conn, query, **filters)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("query", nargs="?", default="")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--channel", default=None)
+    ap.add_argument("--property", default=None, help="Property id(s), comma-separated")
+    ap.add_argument("--from", dest="since", default=None, help="Messages on/after (ISO)")
+    ap.add_argument("--to", dest="until", default=None, help="Messages before (ISO)")
+    ap.add_argument("--limit", type=int, default=RESULT_LIMIT)
+    ap.add_argument("--raw", action="store_true", help="Query is FTS5 syntax")
+    ap.add_argument("--json", action="store_true")
+    ap.add_argument("--rebuild", action="store_true", help="Rebuild the index from messages")
+    args = ap.parse_args()
+    if args.rebuild:
+        conn = connect(args.db)
+        if init_search_index(conn):
+            rebuild_search_index(conn)
+            print(f"Rebuilt messages_fts ({conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]}"
+                  f" messages)")
+        conn.close()
+        if not args.query:
+            raise SystemExit(0)
+    t0 = dt.datetime.now()
+    res = search_db(args.db, args.query, channel=args.channel, property_id=args.property,
+                    since=args.since, until=args.until, limit=args.limit, raw=args.raw)
+    ms = (dt.datetime.now() - t0).total_seconds() * 1000
+    if args.json:
+        print(json.dumps(res, indent=2, ensure_ascii=False))
+    else:
+        print(f"{len(res['results'])} thread(s) for {res['match'] or '(empty query)'} "
+              f"in {ms:.1f} ms")
+        for r in res["results"]:
+            snip = r["snippet"].replace(MARK_OPEN, "[").replace(MARK_CLOSE, "]")
+            print(f"  #{r['booking_id']} {r['property']} · {r['channel']} · "
+                  f"{(r['time'] or '')[:16]} ({r['hits']} hit{'s' * (r['hits'] != 1)}): {snip}")
@@ -14,13 +14,41 @@ RevPAR                 = room revenue / available room-nights  (= ADR * occupanc
 
 Active statuses (count toward revenue/occupancy) default to confirmed + new.
 'cancelled' and 'black' (owner blocks) are excluded.
+
+Closed months (fully in the past) are cached in the metrics_cache table, keyed by
+a fingerprint of the bookings that touch the month, so a rebuild only recomputes
+open/future months and any closed month whose bookings actually changed.
+
+Every KPI is an accumulator (add one booking, then result()). The list-based
+functions (occupancy_block, channel_mix, ...) feed one a list; build_summary
+feeds all of them from a single fetchmany cursor (iter_bookings), so its memory
+doesn't grow with the bookings table. Same rows in the same order -> identical
+numbers either way.
 """
 
 import datetime as dt
+import hashlib
+import json
 import sqlite3
+from bisect import insort
 from collections import defaultdict
 
+from db import connect, reading
+from sketches import Histogram, QuantileSketch
+
 ACTIVE_STATUSES = {"confirmed", "new", "1"}  # lowercased
+# the bookings columns the metrics read (the cursor skips raw JSON etc.)
+BOOKING_COLUMNS = ("id", "property_id", "status", "arrival", "departure", "num_nights",
+                   "price", "channel", "referer", "first_name", "last_name", "booking_time")
+CACHE_VERSION = 1  # bump when occupancy_block's maths change to drop stale entries
+
+# histogram bucket edges for the distribution panels (last bucket is open-ended)
+LEAD_EDGES = [0, 1, 3, 7, 14, 30, 60, 90, 180, 365]
+LOS_EDGES = [1, 2, 3, 4, 5, 7, 14, 28]
+RATE_EDGES = [0, 50, 75, 100, 125, 150, 200, 300]
+# daily cube window around this month: enough history for year-on-year of the past year
+CUBE_MONTHS_BACK = 24
+CUBE_MONTHS_FWD = 12
 
 
 def _date(s):
@@ -43,17 +71,44 @@ def _is_active(status):
     return str(status or "").strip().lower() in ACTIVE_STATUSES
 
 
+def _channel(booking):
+    return (booking.get("referer") or booking.get("channel") or "Direct/Other").strip() or "Direct/Other"
+
+
+def load_dimensions(db_path):
+    """Everything except bookings: properties, rooms and meta (all small)."""
+    with reading(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        rooms = [dict(r) for r in conn.execute("SELECT * FROM rooms").fetchall()]
+        props = [dict(r) for r in conn.execute("SELECT * FROM properties").fetchall()]
+        meta = {r[0]: r[1] for r in conn.execute("SELECT key,value FROM meta").fetchall()}
+    return props, rooms, meta
+
+
 def load_rows(db_path):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    rooms = [dict(r) for r in conn.execute("SELECT * FROM rooms").fetchall()]
-    props = [dict(r) for r in conn.execute("SELECT * FROM properties").fetchall()]
-    bookings = [dict(r) for r in conn.execute("SELECT * FROM bookings").fetchall()]
-    meta = {r[0]: r[1] for r in conn.execute("SELECT key,value FROM meta").fetchall()}
-    conn.close()
+    props, rooms, meta = load_dimensions(db_path)
+    with reading(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        bookings = [dict(r) for r in conn.execute("SELECT * FROM bookings").fetchall()]
     return props, rooms, bookings, meta
 
 
+def iter_bookings(db_path, where="", params=(), batch_size=1000):
+    """Stream bookings as dicts of BOOKING_COLUMNS through fetchmany, one batch in
+    memory at a time. Rows come in rowid order — the order load_rows() returns —
+    so float sums match the list-based functions exactly."""
+    cols = ",".join(BOOKING_COLUMNS)
+    sql = f"SELECT {cols} FROM bookings{' WHERE ' + where if where else ''} ORDER BY rowid"
+    with reading(db_path) as conn:
+        cur = conn.execute(sql, params)
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            for row in batch:
+                yield dict(zip(BOOKING_COLUMNS, row))
+
+
 def total_room_capacity(rooms):
     return sum(int(r.get("qty") or 1) for r in rooms)
 
@@ -83,157 +138,564 @@ def revenue_in_period(booking, p_start, p_end):
     return price * inside / total_nights
 
 
+class OccupancyAccumulator:
+    """Sold room-nights and revenue for one period, one booking at a time."""
+
+    def __init__(self, capacity, p_start, p_end):
+        self.capacity = capacity
+        self.p_start = p_start
+        self.p_end = p_end
+        self.sold = 0
+        self.revenue = 0.0
+
+    def add(self, b):
+        if not _is_active(b.get("status")):
+            return
+        self.sold += nights_in_period(b, self.p_start, self.p_end)
+        self.revenue += revenue_in_period(b, self.p_start, self.p_end)
+
+    def result(self):
+        available = self.capacity * (self.p_end - self.p_start).days
+        sold, revenue = self.sold, self.revenue
+        occ = (sold / available) if available else 0.0
+        adr = (revenue / sold) if sold else 0.0
+        revpar = (revenue / available) if available else 0.0
+        return {
+            "period_start": self.p_start.isoformat(),
+            "period_end": self.p_end.isoformat(),
+            "available_room_nights": available,
+            "sold_room_nights": sold,
+            "occupancy": round(occ, 4),
+            "revenue": round(revenue, 2),
+            "adr": round(adr, 2),
+            "revpar": round(revpar, 2),
+        }
+
+
 def occupancy_block(bookings, rooms, p_start, p_end):
-    capacity = total_room_capacity(rooms)
-    days = (p_end - p_start).days
-    available = capacity * days
-    sold = 0
-    revenue = 0.0
+    acc = OccupancyAccumulator(total_room_capacity(rooms), p_start, p_end)
     for b in bookings:
+        acc.add(b)
+    return acc.result()
+
+
+def init_metrics_cache(conn):
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_cache (
+            period_start TEXT,
+            period_end TEXT,
+            fingerprint TEXT,             -- period_fingerprint() of the inputs
+            block TEXT,                   -- occupancy_block() result as JSON
+            PRIMARY KEY (period_start, period_end)
+        );
+        """
+    )
+    conn.commit()
+
+
+def _booking_digest(b):
+    """128-bit digest of the booking fields occupancy_block reads."""
+    key = "|".join(str(b.get(k) if b.get(k) is not None else "")
+                   for k in ("id", "status", "arrival", "departure", "price"))
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=16).digest(), "big")
+
+
+def _touches(booking, p_start, p_end):
+    a = _date(booking.get("arrival"))
+    d = _date(booking.get("departure"))
+    return bool(a and d and a < d and a < p_end and d > p_start)
+
+
+def _fingerprint(capacity, n, acc):
+    head = f"v{CACHE_VERSION}|{capacity}|{','.join(sorted(ACTIVE_STATUSES))}|{n}"
+    return f"{head}|{acc:032x}"
+
+
+def period_fingerprint(bookings, rooms, p_start, p_end):
+    """Order-independent fingerprint of every input occupancy_block would read for
+    the period: the bookings that touch it (whatever their status), the room
+    capacity and the active-status set. Any edit to a touching booking changes it;
+    edits to bookings outside the period don't."""
+    acc = n = 0
+    for b in bookings:
+        if _touches(b, p_start, p_end):
+            acc = (acc + _booking_digest(b)) % (1 << 128)
+            n += 1
+    return _fingerprint(total_room_capacity(rooms), n, acc)
+
+
+def _cache_get(conn, p_start, p_end, fp):
+    row = conn.execute(
+        "SELECT fingerprint, block FROM metrics_cache WHERE period_start=? AND period_end=?",
+        (p_start.isoformat(), p_end.isoformat()),
+    ).fetchone()
+    return json.loads(row[1]) if row and row[0] == fp else None
+
+
+def _cache_put(conn, p_start, p_end, fp, blk):
+    conn.execute(
+        "INSERT OR REPLACE INTO metrics_cache (period_start,period_end,fingerprint,block) "
+        "VALUES (?,?,?,?)",
+        (p_start.isoformat(), p_end.isoformat(), fp, json.dumps(blk)),
+    )
+
+
+def cached_occupancy_block(conn, bookings, rooms, p_start, p_end):
+    """occupancy_block() for a closed period, served from metrics_cache when the
+    period's fingerprint is unchanged. The caller commits."""
+    fp = period_fingerprint(bookings, rooms, p_start, p_end)
+    blk = _cache_get(conn, p_start, p_end, fp)
+    if blk is None:
+        blk = occupancy_block(bookings, rooms, p_start, p_end)
+        _cache_put(conn, p_start, p_end, fp, blk)
+    return blk
+
+
+def _add_months(d, n):
+    y = d.year + (d.month - 1 + n) // 12
+    m = (d.month - 1 + n) % 12 + 1
+    return dt.date(y, m, 1)
+
+
+class MonthlyAccumulator:
+    """Occupancy blocks for months_back..months_fwd around `anchor`. Each booking
+    only visits the months it touches. With `cache` (a connection holding the
+    metrics_cache table) closed months are just fingerprinted during the pass;
+    result() serves them from the cache, and on a miss recomputes that month from
+    refetch(m_start, m_end), which must yield (at least) its touching bookings in
+    the original order."""
+
+    def __init__(self, rooms, months_back=12, months_fwd=6, anchor=None, cache=None,
+                 refetch=None):
+        anchor = anchor or dt.date.today().replace(day=1)
+        today = dt.date.today()
+        self.capacity = total_room_capacity(rooms)
+        self.first = _add_months(anchor, -months_back)
+        self.months = [(_add_months(self.first, i), _add_months(self.first, i + 1))
+                       for i in range(months_back + months_fwd + 1)]
+        self.cache = cache
+        self.refetch = refetch
+        self.closed = [cache is not None and m_end <= today for _, m_end in self.months]
+        self.blocks = [OccupancyAccumulator(self.capacity, s, e) for s, e in self.months]
+        self.digests = [[0, 0] for _ in self.months]  # closed months: [count, digest sum]
+
+    def add(self, b):
+        a = _date(b.get("arrival"))
+        d = _date(b.get("departure"))
+        if not a or not d or d <= a:
+            return
+        first = self.first
+        i = max((a.year - first.year) * 12 + a.month - first.month, 0)
+        digest = None
+        while i < len(self.months) and self.months[i][0] < d:
+            if self.closed[i]:
+                if digest is None:
+                    digest = _booking_digest(b)
+                fp = self.digests[i]
+                fp[0] += 1
+                fp[1] = (fp[1] + digest) % (1 << 128)
+            else:
+                self.blocks[i].add(b)
+            i += 1
+
+    def _closed_block(self, i):
+        m_start, m_end = self.months[i]
+        fp = _fingerprint(self.capacity, *self.digests[i])
+        blk = _cache_get(self.cache, m_start, m_end, fp)
+        if blk is None:
+            acc = OccupancyAccumulator(self.capacity, m_start, m_end)
+            for b in self.refetch(m_start, m_end):
+                if _touches(b, m_start, m_end):
+                    acc.add(b)
+            blk = acc.result()
+            _cache_put(self.cache, m_start, m_end, fp, blk)
+        return blk
+
+    def result(self):
+        out = []
+        for i, (m_start, _) in enumerate(self.months):
+            blk = self._closed_block(i) if self.closed[i] else self.blocks[i].result()
+            blk["label"] = m_start.strftime("%b %Y")
+            blk["month"] = m_start.isoformat()
+            out.append(blk)
+        return out
+
+
+def monthly_series(bookings, rooms, months_back=12, months_fwd=6, anchor=None, cache=None):
+    """Month-by-month occupancy blocks. With `cache` (a connection holding the
+    metrics_cache table) closed months are served from the cache when none of
+    their bookings changed; open and future months are always recomputed."""
+    acc = MonthlyAccumulator(rooms, months_back, months_fwd, anchor, cache,
+                             refetch=lambda s, e: bookings)
+    for b in bookings:
+        acc.add(b)
+    return acc.result()
+
+
+class DailyCubeAccumulator:
+    """Per-property, per-night sold room-nights and revenue (integer pence) over
+    [start, end), for slicing arbitrary ranges in the page with prefix sums.
+
+    A booking's price is split into pence across its nights with the remainder on
+    the first nights, so any range that covers a whole stay sums to its exact
+    price. Available nights are per-property capacity x days (as everywhere else
+    in this module), so capacity is stored once per property, not per day."""
+
+    def __init__(self, rooms, start, end):
+        self.start = start
+        self.end = end
+        self.days = max((end - start).days, 0)
+        self.capacity = defaultdict(int)
+        for r in rooms:
+            self.capacity[r.get("property_id")] += int(r.get("qty") or 1)
+        self.sold = {}
+        self.revenue = {}
+
+    def _rows(self, pid):
+        if pid not in self.sold:
+            self.sold[pid] = [0] * self.days
+            self.revenue[pid] = [0] * self.days
+        return self.sold[pid], self.revenue[pid]
+
+    def add(self, b):
         if not _is_active(b.get("status")):
+            return
+        a = _date(b.get("arrival"))
+        d = _date(b.get("departure"))
+        if not a or not d or d <= a or d <= self.start or a >= self.end:
+            return
+        n = (d - a).days
+        total = round(float(b.get("price") or 0) * 100)
+        base, extra = divmod(total, n)
+        sold, revenue = self._rows(b.get("property_id"))
+        for k in range(max((self.start - a).days, 0), min((self.end - a).days, n)):
+            i = (a - self.start).days + k
+            sold[i] += 1
+            revenue[i] += base + (1 if k < extra else 0)
+
+    def result(self):
+        pids = sorted(set(self.capacity) | set(self.sold), key=lambda p: (p is None, p))
+        empty = [0] * self.days
+        return {
+            "start": self.start.isoformat(),
+            "days": self.days,
+            "properties": pids,
+            "capacity": [self.capacity.get(p, 0) for p in pids],
+            "sold": [self.sold.get(p, empty) for p in pids],
+            "revenue_p": [self.revenue.get(p, empty) for p in pids],
+        }
+
+
+def daily_cube(bookings, rooms, start, end):
+    acc = DailyCubeAccumulator(rooms, start, end)
+    for b in bookings:
+        acc.add(b)
+    return acc.result()
+
+
+def cube_range(cube, p_start, p_end, property_ids=None):
+    """Python twin of the page's range query: occupancy block for [p_start, p_end)
+    from the cube, optionally for some properties only. Clipped to the cube."""
+    c0 = dt.date.fromisoformat(cube["start"])
+    i0 = min(max((p_start - c0).days, 0), cube["days"])
+    i1 = min(max((p_end - c0).days, i0), cube["days"])
+    sold = rev = cap = 0
+    for j, pid in enumerate(cube["properties"]):
+        if property_ids is not None and pid not in property_ids:
             continue
-        sold += nights_in_period(b, p_start, p_end)
-        revenue += revenue_in_period(b, p_start, p_end)
-    occ = (sold / available) if available else 0.0
-    adr = (revenue / sold) if sold else 0.0
-    revpar = (revenue / available) if available else 0.0
+        cap += cube["capacity"][j]
+        sold += sum(cube["sold"][j][i0:i1])
+        rev += sum(cube["revenue_p"][j][i0:i1])
+    available = cap * (i1 - i0)
+    revenue = rev / 100
     return {
-        "period_start": p_start.isoformat(),
-        "period_end": p_end.isoformat(),
         "available_room_nights": available,
         "sold_room_nights": sold,
-        "occupancy": round(occ, 4),
+        "occupancy": round(sold / available, 4) if available else 0.0,
         "revenue": round(revenue, 2),
-        "adr": round(adr, 2),
-        "revpar": round(revpar, 2),
+        "adr": round(revenue / sold, 2) if sold else 0.0,
+        "revpar": round(revenue / available, 2) if available else 0.0,
     }
 
 
-def monthly_series(bookings, rooms, months_back=12, months_fwd=6, anchor=None):
-    anchor = anchor or dt.date.today().replace(day=1)
-    out = []
-    # build month starts from months_back before to months_fwd after
-    def add_months(d, n):
-        y = d.year + (d.month - 1 + n) // 12
-        m = (d.month - 1 + n) % 12 + 1
-        return dt.date(y, m, 1)
+class ChannelMixAccumulator:
+    def __init__(self, p_start, p_end):
+        self.p_start = p_start
+        self.p_end = p_end
+        self.by = defaultdict(lambda: {"bookings": 0, "nights": 0, "revenue": 0.0})
+
+    def add(self, b):
+        if not _is_active(b.get("status")):
+            return
+        n = nights_in_period(b, self.p_start, self.p_end)
+        if n <= 0:
+            return
+        v = self.by[_channel(b)]
+        v["bookings"] += 1
+        v["nights"] += n
+        v["revenue"] += revenue_in_period(b, self.p_start, self.p_end)
 
-    for i in range(-months_back, months_fwd + 1):
-        m_start = add_months(anchor, i)
-        m_end = add_months(m_start, 1)
-        blk = occupancy_block(bookings, rooms, m_start, m_end)
-        blk["label"] = m_start.strftime("%b %Y")
-        blk["month"] = m_start.isoformat()
-        out.append(blk)
-    return out
+    def result(self):
+        rows = []
+        for k, v in self.by.items():
+            rows.append({"channel": k, "bookings": v["bookings"], "nights": v["nights"],
+                         "revenue": round(v["revenue"], 2)})
+        rows.sort(key=lambda r: r["revenue"], reverse=True)
+        return rows
 
 
 def channel_mix(bookings, p_start, p_end):
-    by = defaultdict(lambda: {"bookings": 0, "nights": 0, "revenue": 0.0})
+    acc = ChannelMixAccumulator(p_start, p_end)
     for b in bookings:
+        acc.add(b)
+    return acc.result()
+
+
+class PaceAccumulator:
+    """On-the-books comparison: arrivals in the next `window_days` this year vs the
+    same calendar window one year ago."""
+
+    def __init__(self, window_days=90):
+        today = dt.date.today()
+        self.window_days = window_days
+        this_start, this_end = today, today + dt.timedelta(days=window_days)
+        self.windows = [
+            (this_start, this_end),
+            (this_start.replace(year=this_start.year - 1), this_end.replace(year=this_end.year - 1)),
+        ]
+        self.stats = [[0, 0, 0.0] for _ in self.windows]  # bookings, sold, revenue
+
+    def add(self, b):
         if not _is_active(b.get("status")):
-            continue
-        n = nights_in_period(b, p_start, p_end)
-        if n <= 0:
-            continue
-        key = (b.get("referer") or b.get("channel") or "Direct/Other").strip() or "Direct/Other"
-        by[key]["bookings"] += 1
-        by[key]["nights"] += n
-        by[key]["revenue"] += revenue_in_period(b, p_start, p_end)
-    rows = []
-    for k, v in by.items():
-        rows.append({"channel": k, "bookings": v["bookings"], "nights": v["nights"],
-                     "revenue": round(v["revenue"], 2)})
-    rows.sort(key=lambda r: r["revenue"], reverse=True)
-    return rows
+            return
+        a = _date(b.get("arrival"))
+        if not a:
+            return
+        for (s, e), st in zip(self.windows, self.stats):
+            if s <= a < e:
+                st[0] += 1
+                st[1] += nights_in_period(b, s, e)
+                st[2] += revenue_in_period(b, s, e)
+
+    def result(self):
+        this_yr, last_yr = ({"bookings": bk, "sold_room_nights": sold, "revenue": round(rev, 2)}
+                            for bk, sold, rev in self.stats)
+        delta_rev = this_yr["revenue"] - last_yr["revenue"]
+        pct = (delta_rev / last_yr["revenue"] * 100) if last_yr["revenue"] else None
+        return {
+            "window_days": self.window_days,
+            "this_year": this_yr,
+            "last_year": last_yr,
+            "revenue_delta": round(delta_rev, 2),
+            "revenue_delta_pct": round(pct, 1) if pct is not None else None,
+        }
 
 
 def pace_vs_last_year(bookings, rooms, window_days=90):
     """On-the-books comparison: arrivals in the next `window_days` this year vs the
     same calendar window one year ago."""
-    today = dt.date.today()
-    this_start, this_end = today, today + dt.timedelta(days=window_days)
-    last_start = this_start.replace(year=this_start.year - 1)
-    last_end = this_end.replace(year=this_end.year - 1)
+    acc = PaceAccumulator(window_days)
+    for b in bookings:
+        acc.add(b)
+    return acc.result()
 
-    def window_stats(s, e):
-        sold = rev = bk = 0
-        rev = 0.0
-        for b in bookings:
-            if not _is_active(b.get("status")):
-                continue
-            a = _date(b.get("arrival"))
-            if a and s <= a < e:
-                bk += 1
-                sold += nights_in_period(b, s, e)
-                rev += revenue_in_period(b, s, e)
-        return {"bookings": bk, "sold_room_nights": sold, "revenue": round(rev, 2)}
-
-    this_yr = window_stats(this_start, this_end)
-    last_yr = window_stats(last_start, last_end)
-    delta_rev = this_yr["revenue"] - last_yr["revenue"]
-    pct = (delta_rev / last_yr["revenue"] * 100) if last_yr["revenue"] else None
-    return {
-        "window_days": window_days,
-        "this_year": this_yr,
-        "last_year": last_yr,
-        "revenue_delta": round(delta_rev, 2),
-        "revenue_delta_pct": round(pct, 1) if pct is not None else None,
-    }
 
+class LeadTimeAccumulator:
+    def __init__(self):
+        self.buckets = {"0-7d": 0, "8-30d": 0, "31-90d": 0, "91d+": 0, "unknown": 0}
 
-def lead_time_buckets(bookings):
-    """Distribution of booking lead time (arrival - booking_time), active bookings."""
-    buckets = {"0-7d": 0, "8-30d": 0, "31-90d": 0, "91d+": 0, "unknown": 0}
-    for b in bookings:
+    def add(self, b):
         if not _is_active(b.get("status")):
-            continue
+            return
         a = _date(b.get("arrival"))
         bt = _date(b.get("booking_time"))
         if not a or not bt:
-            buckets["unknown"] += 1
-            continue
+            self.buckets["unknown"] += 1
+            return
         lead = (a - bt).days
         if lead <= 7:
-            buckets["0-7d"] += 1
+            self.buckets["0-7d"] += 1
         elif lead <= 30:
-            buckets["8-30d"] += 1
+            self.buckets["8-30d"] += 1
         elif lead <= 90:
-            buckets["31-90d"] += 1
+            self.buckets["31-90d"] += 1
         else:
-            buckets["91d+"] += 1
-    return buckets
+            self.buckets["91d+"] += 1
+
+    def result(self):
+        return dict(self.buckets)
+
+
+def lead_time_buckets(bookings):
+    """Distribution of booking lead time (arrival - booking_time), active bookings."""
+    acc = LeadTimeAccumulator()
+    for b in bookings:
+        acc.add(b)
+    return acc.result()
+
+
+class DistributionAccumulator:
+    """One-pass, bounded-memory distributions of lead time, length of stay and
+    nightly rate for active bookings. Sketches are kept per (property, channel)
+    cell and merged up into per-channel, per-property and overall views, so two
+    accumulators (e.g. two months, or two shards of a cursor) merge exactly."""
+
+    MEASURES = {"lead_time": LEAD_EDGES, "los": LOS_EDGES, "nightly_rate": RATE_EDGES}
+
+    def __init__(self):
+        self.cells = {}  # (property_id, channel) -> {measure: (QuantileSketch, Histogram)}
+
+    def _empty(self):
+        return {m: (QuantileSketch(), Histogram(edges)) for m, edges in self.MEASURES.items()}
+
+    def _cell(self, key):
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = self._empty()
+        return cell
+
+    def add(self, b):
+        if not _is_active(b.get("status")):
+            return
+        a = _date(b.get("arrival"))
+        d = _date(b.get("departure"))
+        bt = _date(b.get("booking_time"))
+        cell = self._cell((b.get("property_id"), _channel(b)))
+        values = {}
+        if a and bt:
+            values["lead_time"] = (a - bt).days
+        if a and d and d > a:
+            nights = (d - a).days
+            values["los"] = nights
+            values["nightly_rate"] = float(b.get("price") or 0) / nights
+        for m, v in values.items():
+            sketch, hist = cell[m]
+            sketch.add(v)
+            hist.add(v)
+
+    def merge(self, other):
+        for key, cell in other.cells.items():
+            mine = self._cell(key)
+            for m, (sketch, hist) in cell.items():
+                mine[m][0].merge(sketch)
+                mine[m][1].merge(hist)
+        return self
+
+    def _rollup(self, group):
+        out = {}
+        for key, cell in self.cells.items():
+            g = group(key)
+            tgt = out.get(g)
+            if tgt is None:
+                tgt = out[g] = self._empty()
+            for m, (sketch, hist) in cell.items():
+                tgt[m][0].merge(sketch)
+                tgt[m][1].merge(hist)
+        return out
+
+    def summary(self, prop_names=None):
+        prop_names = prop_names or {}
+
+        def rows(groups, label):
+            out = [dict({label: k}, **{m: sk.summary() for m, (sk, _) in cell.items()})
+                   for k, cell in groups.items()]
+            out.sort(key=lambda r: r["los"]["n"], reverse=True)
+            return out
+
+        overall = self._rollup(lambda k: "all").get("all") or self._empty()
+        by_property = rows({prop_names.get(pid, pid): c
+                            for pid, c in self._rollup(lambda k: k[0]).items()}, "property")
+        return {
+            "overall": {m: sk.summary() for m, (sk, _) in overall.items()},
+            "by_channel": rows(self._rollup(lambda k: k[1]), "channel"),
+            "by_property": by_property,
+            "histograms": {m: h.to_dict() for m, (_, h) in overall.items()},
+        }
+
+
+def distribution_metrics(bookings, prop_names=None):
+    """p50/p90 lead time, length of stay and nightly rate, by channel and property."""
+    acc = DistributionAccumulator()
+    for b in bookings:
+        acc.add(b)
+    return acc.summary(prop_names)
+
+
+def feed_row(b, today):
+    """One bookings-feed row (shared with bookings_query's paged feed)."""
+    a = _date(b.get("arrival"))
+    return {
+        "id": b.get("id"),
+        "guest": " ".join(x for x in [b.get("first_name"), b.get("last_name")] if x) or "—",
+        "property_id": b.get("property_id"),
+        "arrival": b.get("arrival"),
+        "departure": b.get("departure"),
+        "nights": b.get("num_nights"),
+        "price": round(float(b.get("price") or 0), 2),
+        "channel": _channel(b),
+        "status": b.get("status"),
+        "days_until": (a - today).days if a else None,
+    }
+
+
+class FeedAccumulator:
+    """Upcoming + recent bookings sorted by arrival, for the bookings feed view.
+    Keeps only the `limit` earliest arrivals from 14 days ago onward.
+    (build_summary pages the feed straight from the DB — bookings_query.feed_page.)"""
+
+    def __init__(self, limit=50):
+        self.limit = limit
+        self.today = dt.date.today()
+        self.rows = []  # sorted (arrival, seq, row); seq keeps ties in input order
+        self.seq = 0
+
+    def add(self, b):
+        self.seq += 1
+        a = _date(b.get("arrival"))
+        if not a or (a - self.today).days < -14:
+            return
+        key = (b.get("arrival"), self.seq)
+        if len(self.rows) >= self.limit and key >= self.rows[-1][:2]:
+            return
+        insort(self.rows, key + (feed_row(b, self.today),))
+        del self.rows[self.limit:]
+
+    def result(self):
+        return [r for _, _, r in self.rows]
 
 
 def upcoming_feed(bookings, limit=50):
     """Upcoming + recent bookings sorted by arrival, for the bookings feed view."""
-    today = dt.date.today()
-    rows = []
+    acc = FeedAccumulator(limit)
     for b in bookings:
-        a = _date(b.get("arrival"))
-        if not a:
-            continue
-        rows.append({
-            "id": b.get("id"),
-            "guest": " ".join(x for x in [b.get("first_name"), b.get("last_name")] if x) or "—",
-            "property_id": b.get("property_id"),
-            "arrival": b.get("arrival"),
-            "departure": b.get("departure"),
-            "nights": b.get("num_nights"),
-            "price": round(float(b.get("price") or 0), 2),
-            "channel": b.get("referer") or b.get("channel") or "Direct/Other",
-            "status": b.get("status"),
-            "days_until": (a - today).days,
-        })
-    rows.sort(key=lambda r: r["arrival"])
-    # keep from 14 days ago onward
-    rows = [r for r in rows if r["days_until"] >= -14]
-    return rows[:limit]
-
-
-def build_summary(db_path):
-    """Top-level object the dashboard consumes."""
-    props, rooms, bookings, meta = load_rows(db_path)
+        acc.add(b)
+    return acc.result()
+
+
+def build_summary(db_path, use_cache=True, stream=True):
+    """Top-level object the dashboard consumes, computed in ONE pass over the
+    bookings. stream=True reads them through iter_bookings() so peak memory stays
+    flat as the table grows; stream=False loads the list first (load_rows). Same
+    numbers either way. use_cache=False recomputes every month from scratch (and
+    leaves metrics_cache untouched)."""
+    from bookings_query import feed_page  # these build on this module's helpers
+    from pickup import PickupAccumulator
+    from roomgrid import room_grid
+
+    props, rooms, meta = load_dimensions(db_path)
+    if stream:
+        bookings = iter_bookings(db_path)
+
+        def refetch(s, e):
+            return iter_bookings(db_path, "arrival < ? AND departure > ?",
+                                 (e.isoformat(), s.isoformat()))
+    else:
+        bookings = load_rows(db_path)[2]
+
+        def refetch(s, e):
+            return bookings
+
     today = dt.date.today()
     month_start = today.replace(day=1)
     next_month = (month_start.replace(year=month_start.year + 1, month=1)
@@ -241,26 +703,64 @@ def build_summary(db_path):
                   else month_start.replace(month=month_start.month + 1))
     next_30 = today + dt.timedelta(days=30)
     next_90 = today + dt.timedelta(days=90)
-
+    capacity = total_room_capacity(rooms)
     prop_names = {p["id"]: p.get("name") for p in props}
-    feed = upcoming_feed(bookings)
-    for r in feed:
-        r["property"] = prop_names.get(r["property_id"], r["property_id"])
+
+    cache = None
+    if use_cache:
+        cache = connect(db_path)
+        init_metrics_cache(cache)
+    try:
+        acc = {
+            "kpi_this_month": OccupancyAccumulator(capacity, month_start, next_month),
+            "kpi_next_30": OccupancyAccumulator(capacity, today, next_30),
+            "kpi_next_90": OccupancyAccumulator(capacity, today, next_90),
+            "monthly": MonthlyAccumulator(rooms, cache=cache, refetch=refetch),
+            "channel_mix": ChannelMixAccumulator(today.replace(month=1, day=1),
+                                                 today.replace(month=12, day=31)),
+            "pace": PaceAccumulator(),
+            "pickup": PickupAccumulator(),
+            "lead_time": LeadTimeAccumulator(),
+            "distributions": DistributionAccumulator(),
+            "cube": DailyCubeAccumulator(rooms, _add_months(month_start, -CUBE_MONTHS_BACK),
+                                         _add_months(month_start, CUBE_MONTHS_FWD)),
+        }
+        adders = [a.add for a in acc.values()]
+        n_bookings = 0
+        for b in bookings:
+            n_bookings += 1
+            for add in adders:
+                add(b)
+        results = {k: (a.summary(prop_names) if k == "distributions" else a.result())
+                   for k, a in acc.items()}
+        if cache is not None:
+            cache.commit()
+    finally:
+        if cache is not None:
+            cache.close()
+
+    # first page only (index-backed, no sort); the page fetches more by cursor
+    feed = feed_page(db_path, today=today)
+    grid = room_grid(db_path, today)
 
     return {
         "generated_at": dt.datetime.now().isoformat(timespec="seconds"),
         "last_fetch": meta.get("last_fetch"),
         "currency": (props[0]["currency"] if props and props[0].get("currency") else ""),
         "properties": [{"id": p["id"], "name": p.get("name")} for p in props],
-        "room_capacity": total_room_capacity(rooms),
-        "kpi_this_month": occupancy_block(bookings, rooms, month_start, next_month),
-        "kpi_next_30": occupancy_block(bookings, rooms, today, next_30),
-        "kpi_next_90": occupancy_block(bookings, rooms, today, next_90),
-        "monthly": monthly_series(bookings, rooms),
-        "channel_mix": channel_mix(bookings, today.replace(month=1, day=1),
-                                   today.replace(month=12, day=31)),
-        "pace": pace_vs_last_year(bookings, rooms),
-        "lead_time": lead_time_buckets(bookings),
-        "feed": feed,
-        "counts": {"properties": len(props), "rooms": len(rooms), "bookings": len(bookings)},
+        "room_capacity": capacity,
+        "kpi_this_month": results["kpi_this_month"],
+        "kpi_next_30": results["kpi_next_30"],
+        "kpi_next_90": results["kpi_next_90"],
+        "monthly": results["monthly"],
+        "channel_mix": results["channel_mix"],
+        "pace": results["pace"],
+        "pickup": results["pickup"],
+        "lead_time": results["lead_time"],
+        "distributions": results["distributions"],
+        "cube": results["cube"],
+        "grid": grid,
+        "feed": feed["rows"],
+        "feed_next": feed["next"],
+        "counts": {"properties": len(props), "rooms": len(rooms), "bookings": n_bookings},
     }
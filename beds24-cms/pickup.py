@@ -0,0 +1,180 @@
+"""
+Pickup matrix — room-nights and revenue on the books by stay date x days before
+arrival, built ONCE from booking_time / arrival / departure.
+
+Each active booking drops one cell per night it covers: (stay date, lead) where
+lead = stay date - booking date (capped at max_lead). The per-date rows are then
+turned into reverse prefix sums, so
+
+    cum[d][L] = everything on the books for stay date d at least L days out
+
+and "what was on the books for window W as of date X" is one lookup per stay
+date — no further passes over the bookings table. That answers pace curves for
+any window, any lead time and any year-over-year shift, and the simple additive
+pickup forecast below.
+
+Conventions match metrics.py: active statuses only, price pro-rated evenly across
+the nights of the stay. Bookings with no booking_time are counted at lead 0 (known
+to be on the books by arrival, nothing earlier), so final totals stay correct and
+early pace is conservative.
+"""
+
+import datetime as dt
+from array import array
+from itertools import accumulate
+
+from metrics import _date, _is_active
+
+MAX_LEAD = 365  # leads beyond this collapse into the last bucket
+
+
+def _shift_years(d, years):
+    try:
+        return d.replace(year=d.year + years)
+    except ValueError:  # Feb 29 -> Feb 28
+        return d.replace(year=d.year + years, day=28)
+
+
+class PickupMatrix:
+    """Stay dates [start, end) x leads 0..max_lead of room-nights and revenue."""
+
+    def __init__(self, start, end, max_lead=MAX_LEAD):
+        self.start = start
+        self.end = end
+        self.max_lead = max_lead
+        n = max((end - start).days, 0)
+        zeros = array("d", bytes(8 * (max_lead + 1)))
+        self.nights = [array("d", zeros) for _ in range(n)]
+        self.revenue = [array("d", zeros) for _ in range(n)]
+        self.finalized = False
+
+    @classmethod
+    def from_bookings(cls, bookings, start, end, max_lead=MAX_LEAD):
+        m = cls(start, end, max_lead)
+        for b in bookings:
+            m.add(b)
+        return m.finalize()
+
+    def add(self, booking):
+        """Accumulate one booking's nights into their (stay date, lead) cells."""
+        if self.finalized:
+            raise ValueError("PickupMatrix already finalized")
+        if not _is_active(booking.get("status")):
+            return
+        a = _date(booking.get("arrival"))
+        d = _date(booking.get("departure"))
+        if not a or not d or d <= a:
+            return
+        nightly = float(booking.get("price") or 0) / (d - a).days
+        bt = _date(booking.get("booking_time"))
+        lo = max(a, self.start)
+        hi = min(d, self.end)
+        i = (lo - self.start).days
+        # consecutive nights sit on a diagonal: lead grows by one per night
+        lead = (lo - bt).days if bt else 0
+        for _ in range((hi - lo).days):
+            cell = min(max(lead, 0), self.max_lead)
+            self.nights[i][cell] += 1
+            self.revenue[i][cell] += nightly
+            i += 1
+            if bt:
+                lead += 1
+
+    def finalize(self):
+        """Turn per-lead cells into reverse prefix sums (cum[L] = sum of l >= L)."""
+        if not self.finalized:
+            for rows in (self.nights, self.revenue):
+                for i, row in enumerate(rows):
+                    rows[i] = array("d", reversed(list(accumulate(reversed(row)))))
+            self.finalized = True
+        return self
+
+    # ---- queries ---------------------------------------------------------
+    def _dates(self, stay_start, stay_end):
+        i0 = max((stay_start - self.start).days, 0)
+        i1 = min((stay_end - self.start).days, len(self.nights))
+        return range(i0, i1)
+
+    def on_the_books(self, stay_start, stay_end, as_of):
+        """(room-nights, revenue) for stays in [stay_start, stay_end) that were
+        booked on or before `as_of`. Stay dates outside the matrix count as 0."""
+        self.finalize()
+        nights = rev = 0.0
+        for i in self._dates(stay_start, stay_end):
+            stay = self.start + dt.timedelta(days=i)
+            lead = min(max((stay - as_of).days, 0), self.max_lead)
+            nights += self.nights[i][lead]
+            rev += self.revenue[i][lead]
+        return nights, rev
+
+    def at_lead(self, stay_start, stay_end, lead):
+        """(room-nights, revenue) on the books `lead` days before each stay date."""
+        self.finalize()
+        lead = min(max(lead, 0), self.max_lead)
+        nights = rev = 0.0
+        for i in self._dates(stay_start, stay_end):
+            nights += self.nights[i][lead]
+            rev += self.revenue[i][lead]
+        return nights, rev
+
+    def pace_curve(self, stay_start, stay_end, days_before=range(120, -1, -7), years_back=0):
+        """On-the-books for a stay window as of `k` days before the window starts,
+        for each k in days_before (negative k = inside the window). years_back
+        shifts window and as-of dates together, for year-over-year curves."""
+        s = _shift_years(stay_start, -years_back)
+        e = _shift_years(stay_end, -years_back)
+        out = []
+        for k in days_before:
+            nights, rev = self.on_the_books(s, e, s - dt.timedelta(days=k))
+            out.append({"days_before": k, "nights": round(nights, 2), "revenue": round(rev, 2)})
+        return out
+
+    def forecast(self, stay_start, stay_end, as_of, years_back=1):
+        """Additive pickup forecast: on the books now + the pickup the same stay
+        dates saw `years_back` years ago from the same lead to arrival."""
+        self.finalize()
+        otb_n, otb_r = self.on_the_books(stay_start, stay_end, as_of)
+        s = _shift_years(stay_start, -years_back)
+        e = _shift_years(stay_end, -years_back)
+        ref_as_of = _shift_years(as_of, -years_back)
+        then_n, then_r = self.on_the_books(s, e, ref_as_of)
+        final_n, final_r = self.at_lead(s, e, 0)
+        return {
+            "on_the_books": {"nights": round(otb_n, 2), "revenue": round(otb_r, 2)},
+            "pickup": {"nights": round(final_n - then_n, 2), "revenue": round(final_r - then_r, 2)},
+            "forecast": {"nights": round(otb_n + final_n - then_n, 2),
+                         "revenue": round(otb_r + final_r - then_r, 2)},
+        }
+
+
+class PickupAccumulator:
+    """Dashboard block: pace curves for the next `window_days` this year vs last
+    year, plus the pickup forecast for the same window. Fed one booking at a time."""
+
+    def __init__(self, window_days=90, lookback_days=180, step=7, today=None):
+        self.today = today or dt.date.today()
+        self.window_days = window_days
+        self.days_before = range(lookback_days, -window_days - 1, -step)
+        self.w_start, self.w_end = self.today, self.today + dt.timedelta(days=window_days)
+        self.matrix = PickupMatrix(_shift_years(self.w_start, -1), self.w_end)
+
+    def add(self, booking):
+        self.matrix.add(booking)
+
+    def result(self):
+        m = self.matrix.finalize()
+        this_curve = [p for p in m.pace_curve(self.w_start, self.w_end, self.days_before)
+                      if p["days_before"] >= 0]
+        return {
+            "window_days": self.window_days,
+            "this_year": this_curve,
+            "last_year": m.pace_curve(self.w_start, self.w_end, self.days_before, years_back=1),
+            "forecast": m.forecast(self.w_start, self.w_end, self.today),
+        }
+
+
+def pickup_summary(bookings, window_days=90, lookback_days=180, step=7, today=None):
+    acc = PickupAccumulator(window_days, lookback_days, step, today)
+    for b in bookings:
+        acc.add(b)
+    return acc.result()
@@ -9,8 +9,8 @@ import json
 import os
 
 from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
+from common import HERE
 
-HERE = os.path.dirname(os.path.abspath(__file__))
 RAW = os.path.join(HERE, "raw", "messages_probe_once.json")
 
 
@@ -41,8 +41,8 @@ def one(client, path, params):
         return {"path": path, "params": params, "ok": False, "error": str(e)}
 
 
-def main():
-    client = Beds24Client()
+def main(client=None):
+    client = client or Beds24Client()
     results = []
 
     # Call 1: account-wide recent messages (one request).
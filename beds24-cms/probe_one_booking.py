@@ -10,8 +10,8 @@ import os
 import sys
 
 from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
+from common import HERE
 
-HERE = os.path.dirname(os.path.abspath(__file__))
 RAW = os.path.join(HERE, "raw", "one_booking_probe.json")
 
 
@@ -33,12 +33,7 @@ def call(client, label, path, params):
         return {"label": label, "error": str(e)}
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python probe_one_booking.py <BOOKING_ID>")
-        sys.exit(1)
-    bid = sys.argv[1].strip()
-    client = Beds24Client()
+def probe(client, bid):
     out = {"booking_id": bid, "results": []}
 
     out["results"].append(call(client, "messages by bookingId",
@@ -54,5 +49,12 @@ def main():
     print(f"\nSaved full output to {RAW}")
 
 
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python probe_one_booking.py <BOOKING_ID>")
+        sys.exit(1)
+    probe(Beds24Client(), sys.argv[1].strip())
+
+
 if __name__ == "__main__":
     main()
@@ -4,28 +4,36 @@ Pull ALL guest messages, unattended.
 Strategy:
   1. CHEAP: GET /bookings with includeMessages=true (paginated) — if messages come
      back embedded, parse them all in a handful of calls.
-  2. THOROUGH: if nothing is embedded, sweep EVERY booking via
-     GET /bookings/messages?bookingId=X, automatically throttling around the
-     Beds24 5-minute credit limit (pauses when low, resumes after reset).
+  2. THOROUGH: if nothing is embedded, sweep bookings via
+     GET /bookings/messages?bookingId=X in credit-budgeted cycles, likeliest first
+     (sweep_scheduler.py), throttling around the Beds24 5-minute credit limit
+     (pauses when low, resumes after reset) until every booking has been checked.
+     The sweep is resumable: each run does up to --cycles cycles and the next one
+     continues the same pass, skipping bookings already covered.
 
 Then rebuilds messages-dashboard.html.
 
-Run:  python pull_all_messages.py
+Run:  python pull_all_messages.py [--cycles 10] [--sweep] [--restart]
 """
+import argparse
 import datetime as dt
 import json
 import os
-import sqlite3
 import time
 
-from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
-from messages_fetch import init_messages_table, _store_message, _channel_for_booking, _g, save_raw
+from beds24_client import Beds24Client, Beds24RateLimit
+from common import DB_PATH, save_raw
+from db import connect
+from fieldmap import BOOKING_MESSAGES, remember
+from messages_fetch import init_messages_table, ingest_messages
+from messages_inbox import _now_epoch
+from sweep_scheduler import (CYCLE_CREDITS, freshness, init_state_table, plan, print_freshness,
+                             read_sweep, run_cycle, save_sweep)
 
-HERE = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(HERE, "data", "beds24.db")
 
 CREDIT_FLOOR = 4          # pause when remaining dips below this
 DEFAULT_SLEEP = 60        # fallback pause if header missing
+MAX_SWEEP_CYCLES = 10     # per run; each spends CYCLE_CREDITS (sweep_scheduler.py)
 
 
 def credit_remaining(client):
@@ -61,90 +69,109 @@ def try_bulk(client, conn):
         print(f"   rate limited: {e}; falling through to sweep")
         return 0
     save_raw("all_bookings_includeMessages", {"count": len(rows), "data": rows[:30]})
-    total = 0
+    batch = []
+    fields = BOOKING_MESSAGES.extractor()
     for b in rows:
-        msgs = _g(b, "messages", "messageList", default=None)
-        if not msgs:
+        f = fields(b)
+        if not f["messages"]:
             continue
-        bid = _g(b, "id", "bookId", "bookingId")
-        pid = _g(b, "propertyId", "propId")
-        channel = _g(b, "referer", "channel", "apiSource", default="Other")
-        for i, m in enumerate(msgs):
-            _store_message(conn, bid, pid, channel, m, i)
-            total += 1
-    conn.commit()
+        batch += [(f["id"], f["property_id"], f["channel"], m) for m in f["messages"]]
+    remember(conn, fields)
+    ingest_messages(conn, batch)
+    total = len(batch)
     print(f"   embedded messages found: {total}")
     return total
 
 
-def sweep_all(client, conn):
-    print("Step 2: sweeping every booking for messages (throttled)...")
-    # Check bookings NEAREST TO TODAY first — current/recent guests are the ones
-    # with messages; far-future bookings rarely have any. This finds real threads
-    # in the first handful of calls instead of wasting credits on 2027 bookings.
-    ids = [r[0] for r in conn.execute(
-        "SELECT id FROM bookings ORDER BY ABS(julianday(arrival) - julianday('now')) ASC"
-    ).fetchall()]
-    print(f"   {len(ids)} bookings to check (nearest-to-today first)")
-    total = 0
-    with_msgs = 0
-    sample = []
-    for n, bid in enumerate(ids, 1):
+def sweep_all(client, conn, budget=CYCLE_CREDITS, max_cycles=MAX_SWEEP_CYCLES, restart=False):
+    """One full-coverage pass over every booking, resumable: state is committed
+    after every check and the pass lives in meta, so an interrupted run (or one
+    that hits max_cycles) continues where it stopped next time."""
+    print("Step 2: sweeping bookings for messages (scheduled, throttled)...")
+    # sweep_scheduler ranks bookings by how likely they are to have messages (stay
+    # phase, channel, past activity, time since last check), so current guests are
+    # checked first and far-future/long-gone bookings only once their turn comes.
+    init_state_table(conn)
+    sweep = read_sweep(conn)
+    if restart or not sweep or sweep.get("completed_at"):
+        sweep = {"started_at": _now_epoch(), "completed_at": None, "checked": 0}
+        print("   starting a new pass")
+    else:
+        started = dt.datetime.fromtimestamp(sweep["started_at"], dt.timezone.utc)
+        print(f"   resuming the pass started {started:%Y-%m-%d %H:%M} "
+              f"({sweep['checked']} checked so far)")
+    save_sweep(conn, sweep)
+    before = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    remaining = len(plan(conn, pass_start=sweep["started_at"]))
+    if not remaining:
+        sweep["completed_at"] = _now_epoch()
+        save_sweep(conn, sweep)
+    for cycle in range(1, max_cycles + 1):
+        if not remaining:
+            break
         throttle(client)
-        try:
-            payload = client.get("/bookings/messages", params={"bookingId": bid})
-        except Beds24RateLimit:
+        res = run_cycle(client, conn, budget, pass_start=sweep["started_at"])
+        sweep["checked"] += res["checked"]
+        remaining = len(plan(conn, pass_start=sweep["started_at"]))
+        if not remaining:
+            sweep["completed_at"] = _now_epoch()
+        save_sweep(conn, sweep)
+        print(f"   cycle {cycle}: checked {res['checked']} for {res['credits']} credits, "
+              f"{res['changed']} with new messages, {res['errors']} failed; "
+              f"{remaining} left in this pass "
+              f"(credit remaining={credit_remaining(client)})")
+        if res["rate_limited"]:
             wait = credit_resets_in(client) + 3
-            print(f"   hit limit at booking {n}/{len(ids)}; pausing {wait}s")
+            print(f"   hit limit; pausing {wait}s")
             time.sleep(wait)
-            try:
-                payload = client.get("/bookings/messages", params={"bookingId": bid})
-            except Beds24Error:
-                continue
-        except Beds24Error:
-            continue
-        data = payload.get("data", payload if isinstance(payload, list) else [])
-        if data:
-            with_msgs += 1
-            if len(sample) < 25:
-                sample.append({"bookingId": bid, "data": data})
-            pid_row = conn.execute("SELECT property_id FROM bookings WHERE id=?", (bid,)).fetchone()
-            pid = pid_row[0] if pid_row else None
-            channel = _channel_for_booking(conn, bid)
-            for i, m in enumerate(data):
-                _store_message(conn, bid, pid, channel, m, i)
-                total += 1
-        if n % 25 == 0:
-            print(f"   ...{n}/{len(ids)} checked, {total} messages so far "
-                  f"(credit remaining={credit_remaining(client)})")
-    if sample:
-        save_raw("sweep_messages", sample)
-    conn.commit()
-    print(f"   sweep done: {total} messages across {with_msgs} bookings")
+        elif not (res["checked"] or res["errors"]):
+            break
+    print("   pass complete" if sweep["completed_at"] else
+          f"   pass paused with {remaining} bookings left — run again to continue")
+    print_freshness(freshness(conn))
+    total = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] - before
+    print(f"   sweep done: {total} new messages")
     return total
 
 
-def main():
-    if not os.path.exists(DB_PATH):
-        raise SystemExit("data/beds24.db not found — run fetch.py first.")
-    conn = sqlite3.connect(DB_PATH)
+def pull_all(client, conn, cycles=MAX_SWEEP_CYCLES, sweep=False, restart=False):
+    """Bulk attempt, then the sweep if it found nothing; returns messages stored."""
     init_messages_table(conn)
-    client = Beds24Client()
-
-    total = try_bulk(client, conn)
+    total = 0 if sweep else try_bulk(client, conn)
     if total == 0:
-        total = sweep_all(client, conn)
+        total = sweep_all(client, conn, max_cycles=cycles, restart=restart)
 
     conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES ('last_messages_fetch', ?)",
                  (dt.datetime.now().isoformat(timespec="seconds"),))
     conn.commit()
+    print(f"\nTotal messages stored: {total}")
+    return total
+
+
+def add_arguments(ap):
+    ap.add_argument("--cycles", type=int, default=MAX_SWEEP_CYCLES,
+                    help="Sweep cycles this run (the pass resumes next run)")
+    ap.add_argument("--sweep", action="store_true", help="Skip the bulk attempt")
+    ap.add_argument("--restart", action="store_true", help="Start a new sweep pass")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add_arguments(ap)
+    args = ap.parse_args()
+    if not os.path.exists(DB_PATH):
+        raise SystemExit("data/beds24.db not found — run fetch.py first.")
+    conn = connect(DB_PATH)
+    pull_all(Beds24Client(), conn, args.cycles, args.sweep, args.restart)
     conn.close()
 
-    print(f"\nTotal messages stored: {total}")
     # rebuild the inbox
     try:
         from build_messages_dashboard import build
         path, inbox = build()
+        if inbox is None:
+            print(f"Inbox unchanged: {path}")
+            return
         s = inbox["summary"]
         print(f"Inbox rebuilt: {path}")
         print(f"  threads={s['total_threads']} unanswered={s['unanswered']} channels={list(s['by_channel'])}")
@@ -0,0 +1,135 @@
+"""
+Room x date occupancy grid — the `availability` calendar joined with active
+bookings, run-length encoded for the dashboard heatmap.
+
+Each cell (room type, night) gets one small code:
+
+    0 OPEN     nothing sold, at least one unit free
+    1 PART     some units sold, some free (multi-unit room types)
+    2 FULL     every unit sold
+    3 CLOSED   nothing free but not sold out: blocked / closed in Beds24
+    4 ORPHAN   an OPEN/PART gap of <= ORPHAN_NIGHTS between two FULL nights —
+               usually unsellable under a minimum stay
+
+Units sold come from active bookings by room_id; units free from
+availability.num_available. A night with no availability row (e.g. the fetch ran
+with --skip-availability) is treated as free for whatever isn't sold.
+
+Each room's row is stored as runs: [code, length, code, length, ...]. A year of a
+mostly-booked room is a few dozen numbers, so hundreds of rooms stay tiny.
+
+Run:  python roomgrid.py [--days 365]      # prints per-room orphan / closed counts
+"""
+
+import argparse
+import datetime as dt
+
+from common import DB_PATH
+from db import reading
+from metrics import _date, _is_active
+
+
+OPEN, PART, FULL, CLOSED, ORPHAN = range(5)
+CODES = ["open", "part", "full", "closed", "orphan"]
+GRID_DAYS = 365
+ORPHAN_NIGHTS = 1
+
+
+def rle(cells):
+    out = []
+    for c in cells:
+        if out and out[-2] == c:
+            out[-1] += 1
+        else:
+            out += [c, 1]
+    return out
+
+
+def unrle(runs):
+    cells = []
+    for i in range(0, len(runs), 2):
+        cells += [runs[i]] * runs[i + 1]
+    return cells
+
+
+def mark_orphans(cells, max_gap=ORPHAN_NIGHTS):
+    """Re-code short OPEN/PART gaps between FULL nights as ORPHAN (in place)."""
+    i, n = 0, len(cells)
+    while i < n:
+        if cells[i] in (OPEN, PART):
+            j = i
+            while j < n and cells[j] in (OPEN, PART):
+                j += 1
+            if 0 < i and j < n and cells[i - 1] == FULL and cells[j] == FULL and j - i <= max_gap:
+                cells[i:j] = [ORPHAN] * (j - i)
+            i = j
+        else:
+            i += 1
+    return cells
+
+
+def room_cells(qty, sold, avail):
+    """Codes for one room type: sold/avail are per-night lists (avail may hold None)."""
+    cells = []
+    for s, a in zip(sold, avail):
+        s = min(s, qty)
+        free = (qty - s) if a is None else max(min(int(a), qty - s), 0)
+        if s >= qty:
+            cells.append(FULL)
+        elif free == 0:
+            cells.append(CLOSED)
+        else:
+            cells.append(PART if s else OPEN)
+    return cells
+
+
+def room_grid(db_path, start=None, days=GRID_DAYS, max_gap=ORPHAN_NIGHTS):
+    start = start or dt.date.today()
+    end = start + dt.timedelta(days=days)
+    with reading(db_path) as conn:
+        rooms = conn.execute(
+            "SELECT r.id, r.property_id, r.name, r.qty, p.name FROM rooms r "
+            "LEFT JOIN properties p ON p.id = r.property_id ORDER BY r.property_id, r.id"
+        ).fetchall()
+        sold = {r[0]: [0] * days for r in rooms}
+        for rid, status, a, d in conn.execute(
+                "SELECT room_id, status, arrival, departure FROM bookings "
+                "WHERE arrival < ? AND departure > ?", (end.isoformat(), start.isoformat())):
+            a, d = _date(a), _date(d)
+            if rid not in sold or not a or not d or not _is_active(status):
+                continue
+            row = sold[rid]
+            for i in range(max((a - start).days, 0), min((d - start).days, days)):
+                row[i] += 1
+        avail = {r[0]: [None] * days for r in rooms}
+        for rid, date, n in conn.execute(
+                "SELECT room_id, date, num_available FROM availability "
+                "WHERE date >= ? AND date < ?", (start.isoformat(), end.isoformat())):
+            d = _date(date)
+            if rid in avail and d and n is not None:
+                avail[rid][(d - start).days] = n
+
+    out_rooms, totals = [], [0] * len(CODES)
+    for rid, pid, name, qty, prop in rooms:
+        cells = mark_orphans(room_cells(int(qty or 1), sold[rid], avail[rid]), max_gap)
+        for c in cells:
+            totals[c] += 1
+        out_rooms.append({"id": rid, "property_id": pid, "name": name,
+                          "property": prop if prop is not None else pid,
+                          "qty": int(qty or 1), "runs": rle(cells)})
+    return {"start": start.isoformat(), "days": days, "codes": CODES,
+            "totals": dict(zip(CODES, totals)), "rooms": out_rooms}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--days", type=int, default=GRID_DAYS)
+    args = ap.parse_args()
+    grid = room_grid(args.db, days=args.days)
+    print(f"{len(grid['rooms'])} rooms x {grid['days']} nights from {grid['start']}: "
+          + ", ".join(f"{k}={v}" for k, v in grid["totals"].items()))
+    for r in grid["rooms"]:
+        cells = unrle(r["runs"])
+        print(f"  {r['property']} / {r['name']}: orphan={cells.count(ORPHAN)} "
+              f"closed={cells.count(CLOSED)} runs={len(r['runs']) // 2}")
@@ -11,17 +11,21 @@ PY="${BEDS24_PYTHON:-python3}"
 
 {
   echo "=== run $(date '+%Y-%m-%d %H:%M:%S') ==="
-  "$PY" fetch.py "$@"
-  "$PY" build_dashboard.py
-  # Also build a single, dependency-free file for CMS embedding.
-  "$PY" build_dashboard.py --inline --out dashboard-embed.html
+  before=$(cksum dashboard*.html 2>/dev/null || true)
+  # fetch + build in one process (one client, one DB connection). The build is
+  # one summary, every artifact: dashboard.html + the dependency-free
+  # dashboard-embed.html for CMS embedding (see OUTPUTS in build_dashboard.py).
+  # Skipped (files untouched) when nothing it reads has changed.
+  "$PY" beds24.py fetch "$@" + build --reports
+  after=$(cksum dashboard*.html 2>/dev/null || true)
   # Optional deploy step: set DEPLOY_CMD to push the file to your CMS server.
   # e.g. export DEPLOY_CMD='scp dashboard-embed.html user@cms:/var/www/app/beds24.html'
-  if [ -n "${DEPLOY_CMD:-}" ]; then
+  # Only runs when an output actually changed.
+  if [ -n "${DEPLOY_CMD:-}" ] && [ "$before" != "$after" ]; then
     echo "Deploying: $DEPLOY_CMD"
     eval "$DEPLOY_CMD"
   fi
   echo "=== done $(date '+%H:%M:%S') ==="
 } >> "$LOG" 2>&1
 
-echo "OK — dashboard.html + dashboard-embed.html rebuilt. Log: $LOG"
+echo "OK — dashboard.html + dashboard-embed.html up to date. Log: $LOG"
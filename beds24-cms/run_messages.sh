@@ -10,13 +10,16 @@ PY="${BEDS24_PYTHON:-python3}"
 
 {
   echo "--- poll $(date '+%H:%M:%S') ---"
-  "$PY" messages_fetch.py "$@"
-  "$PY" build_messages_dashboard.py
-  # Optional: deploy the inbox to your CMS (same hook style as run.sh)
-  if [ -n "${MESSAGES_DEPLOY_CMD:-}" ]; then
+  before=$(cat messages-dashboard.html threads/*.json 2>/dev/null | cksum)
+  # poll + inbox build in one process; the build is a no-op when no message changed
+  "$PY" beds24.py messages "$@" + build --inbox
+  after=$(cat messages-dashboard.html threads/*.json 2>/dev/null | cksum)
+  # Optional: deploy the inbox (page + threads/ shards) to your CMS (same hook
+  # style as run.sh), only when something actually changed
+  if [ -n "${MESSAGES_DEPLOY_CMD:-}" ] && [ "$before" != "$after" ]; then
     echo "Deploying inbox: $MESSAGES_DEPLOY_CMD"
     eval "$MESSAGES_DEPLOY_CMD"
   fi
 } >> "$LOG" 2>&1
 
-echo "OK — messages-dashboard.html rebuilt. Log: $LOG"
+echo "OK — messages-dashboard.html up to date. Log: $LOG"
@@ -0,0 +1,139 @@
+"""
+Streaming distribution accumulators — bounded memory, one pass, mergeable.
+
+QuantileSketch is a log-bucketed relative-error sketch (DDSketch-style): every
+value lands in bucket ceil(log_gamma(x)), so any quantile it reports is within
+`rel_err` of the true value, memory is capped at `max_bins` buckets regardless of
+how many values are added, and two sketches merge exactly by adding bucket
+counts — across properties, channels or months.
+
+Histogram is a fixed-edge counter for charting; it merges the same way.
+
+Both serialise to plain dicts (to_dict / from_dict) so partial results can be
+stored per month and combined later.
+"""
+
+import bisect
+import math
+
+
+class QuantileSketch:
+    def __init__(self, rel_err=0.01, max_bins=1024):
+        self.rel_err = rel_err
+        self.max_bins = max_bins
+        self.gamma = (1 + rel_err) / (1 - rel_err)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}      # bucket index -> count
+        self.zeros = 0      # values <= 0 (lead time of 0 days, free stays)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x, weight=1):
+        x = float(x)
+        self.count += weight
+        self.total += x * weight
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        if x <= 0:
+            self.zeros += weight
+            return
+        k = math.ceil(math.log(x) / self._log_gamma)
+        self.bins[k] = self.bins.get(k, 0) + weight
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        # fold the lowest buckets together: accuracy is kept where it matters (upper tail)
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins
+        target = keys[excess]
+        for k in keys[:excess]:
+            self.bins[target] += self.bins.pop(k)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with different rel_err")
+        for k, c in other.bins.items():
+            self.bins[k] = self.bins.get(k, 0) + c
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return min(self.min, 0.0)
+        seen = self.zeros
+        for k in sorted(self.bins):
+            seen += self.bins[k]
+            if seen > rank:
+                # bucket midpoint (in relative terms), clamped to the observed range
+                v = 2 * self.gamma ** k / (self.gamma + 1)
+                return min(max(v, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self, ndigits=1):
+        def r(v):
+            return round(v, ndigits) if v is not None else None
+        return {"n": self.count, "p50": r(self.quantile(0.5)), "p90": r(self.quantile(0.9)),
+                "mean": r(self.mean()), "max": r(self.max)}
+
+    def to_dict(self):
+        return {"rel_err": self.rel_err, "max_bins": self.max_bins,
+                "bins": {str(k): c for k, c in self.bins.items()}, "zeros": self.zeros,
+                "count": self.count, "total": self.total, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, d):
+        s = cls(d["rel_err"], d["max_bins"])
+        s.bins = {int(k): c for k, c in d["bins"].items()}
+        s.zeros, s.count, s.total = d["zeros"], d["count"], d["total"]
+        s.min, s.max = d["min"], d["max"]
+        return s
+
+
+class Histogram:
+    """Counts per [edges[i], edges[i+1]) bucket; the last bucket is open-ended."""
+
+    def __init__(self, edges):
+        self.edges = list(edges)
+        self.counts = [0] * len(self.edges)
+
+    def add(self, x, weight=1):
+        self.counts[max(bisect.bisect_right(self.edges, x) - 1, 0)] += weight
+
+    def merge(self, other):
+        if other.edges != self.edges:
+            raise ValueError("cannot merge histograms with different edges")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        return self
+
+    def labels(self):
+        out = []
+        for i, e in enumerate(self.edges):
+            nxt = self.edges[i + 1] if i + 1 < len(self.edges) else None
+            out.append(f"{e:g}+" if nxt is None else
+                       (f"{e:g}" if nxt - e == 1 else f"{e:g}-{nxt - 1:g}"))
+        return out
+
+    def to_dict(self):
+        return {"edges": self.edges, "counts": self.counts, "labels": self.labels()}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d["edges"])
+        h.counts = list(d["counts"])
+        return h
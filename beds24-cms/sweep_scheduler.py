@@ -0,0 +1,332 @@
+"""
+Priority scheduler for per-booking message checks (GET /bookings/messages?bookingId=X).
+
+Each call costs credits whatever it finds, so instead of walking every booking
+in date order, each cycle spends a fixed credit budget on the bookings most
+likely to have something new. A booking's score is its expected new-message rate
+times the hours since it was last checked:
+
+    rate  = phase weight x channel factor x activity (x CANCELLED_FACTOR if cancelled)
+
+  - stay phase: in-house and about-to-arrive guests message most; far-future and
+    long-departed bookings almost never (PHASES);
+  - channel: learned from the DB — the share of each channel's bookings that have
+    any messages, relative to the overall share (smoothed, clipped);
+  - activity: threads with more messages, and a message in the last two days,
+    are likelier to get another;
+  - hours since the last check: the longer a booking waits, the more its score
+    grows, so cold bookings still get their turn — just rarely.
+
+Per-booking check state (when, how many messages, a hash of them, when they last
+changed, when a check last failed) lives in booking_message_state and is
+committed after every check, so an interrupted or rate-limited run loses
+nothing. A full-coverage sweep (pull_all_messages.py) is a "pass" recorded in
+meta ('messages_sweep'): it only plans bookings not yet checked since the pass
+started — skipping those checked in the RECENT_UNCHANGED_HOURS before it with
+nothing new, and those whose check failed during it — and the next run resumes
+the same pass until it is complete. A failed booking is retried by the next pass
+or, sooner, when its priority comes round again: it ranks by the time since it
+was last tried, so it doesn't head every cycle. Each cycle reports freshness per
+stay phase: how many bookings were checked within the phase's target age, and
+the median age of their last check.
+
+Run:  python sweep_scheduler.py [--budget 40]     # one cycle
+      python sweep_scheduler.py --plan            # show the next cycle, no API calls
+"""
+
+import argparse
+import datetime as dt
+import hashlib
+import json
+import math
+import statistics
+
+from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
+from bookings_query import CHANNEL_SQL
+from common import DB_PATH
+from db import connect
+from messages_fetch import ingest_messages, init_messages_table
+from messages_inbox import _now_epoch
+from metrics import _date
+
+
+CYCLE_CREDITS = 40          # credits one cycle may spend (5-minute window is ~100)
+NEVER_CHECKED_HOURS = 24 * 30
+CANCELLED_FACTOR = 0.2
+CHANNEL_PRIOR = 20
+RECENT_MESSAGE_HOURS = 48
+RECENT_UNCHANGED_HOURS = 24  # a pass skips bookings checked this recently, unchanged
+SWEEP_KEY = "messages_sweep"
+
+# stay phase -> (weight, target hours between checks for the freshness report).
+# Days are relative to today: arrival for future stays, departure for past ones.
+PHASES = {
+    "in_house": (1.0, 1),
+    "arriving": (0.8, 2),        # arrival within 7 days
+    "departed": (0.35, 12),      # departed within 14 days
+    "upcoming": (0.2, 24),       # arrival in 8-60 days
+    "far_future": (0.03, 24 * 7),
+    "past": (0.005, 24 * 60),
+}
+
+
+def init_state_table(conn):
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS booking_message_state (
+            booking_id INTEGER PRIMARY KEY,
+            messages_checked_at INTEGER,   -- last check, messages.time_epoch scale
+            message_count INTEGER,         -- messages the API returned then
+            checks INTEGER DEFAULT 0,
+            changed_at INTEGER,            -- last check that found new/changed messages
+            message_hash TEXT,             -- message_hash() of what the API returned
+            error_at INTEGER,              -- last check that failed (Beds24Error)
+            errors INTEGER DEFAULT 0       -- failed checks since the last one that worked
+        );
+        """
+    )
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(booking_message_state)")}
+    for col, decl in (("message_hash", "TEXT"), ("error_at", "INTEGER"),
+                      ("errors", "INTEGER DEFAULT 0")):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE booking_message_state ADD COLUMN {col} {decl}")
+    conn.commit()
+
+
+def message_hash(data):
+    """Order-independent digest of one booking's messages as the API returned them."""
+    parts = sorted(json.dumps(m, sort_keys=True, separators=(",", ":")) for m in data)
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def read_sweep(conn):
+    """The current full-coverage pass: {"started_at", "completed_at", "checked"}."""
+    row = conn.execute("SELECT value FROM meta WHERE key=?", (SWEEP_KEY,)).fetchone()
+    try:
+        return json.loads(row[0]) if row else None
+    except ValueError:
+        return None
+
+
+def save_sweep(conn, sweep):
+    conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)",
+                 (SWEEP_KEY, json.dumps(sweep)))
+    conn.commit()
+
+
+def _covered(checked, changed_at, pass_start, error_at=None):
+    """Already done for the pass that started at pass_start? A check that failed
+    during the pass counts: the next pass retries it."""
+    if error_at and error_at >= pass_start:
+        return True
+    if not checked:
+        return False
+    if checked >= pass_start:
+        return True
+    recent = checked >= pass_start - RECENT_UNCHANGED_HOURS * 3600
+    return recent and changed_at != checked
+
+
+def stay_phase(arrival, departure, today):
+    a = _date(arrival)
+    d = _date(departure) or a
+    if not a:
+        return "past"
+    if a <= today < d or a == today:
+        return "in_house"
+    if a > today:
+        days = (a - today).days
+        return "arriving" if days <= 7 else "upcoming" if days <= 60 else "far_future"
+    return "departed" if (today - d).days <= 14 else "past"
+
+
+def channel_factors(conn):
+    """Channel -> how much likelier than average its bookings are to have messages."""
+    rows = conn.execute(
+        f"""SELECT {CHANNEL_SQL} AS ch, COUNT(*),
+                   SUM(EXISTS (SELECT 1 FROM threads t WHERE t.booking_id = b.id))
+            FROM bookings b GROUP BY ch""").fetchall()
+    total = sum(r[1] for r in rows)
+    with_msgs = sum(r[2] or 0 for r in rows)
+    if not with_msgs:
+        return {}  # nothing learned yet: every channel counts the same
+    overall = with_msgs / total
+    # shrink small channels towards the overall rate (CHANNEL_PRIOR pseudo-bookings)
+    return {ch: min(max(((m or 0) + CHANNEL_PRIOR * overall) / (n + CHANNEL_PRIOR) / overall,
+                        0.1), 3.0)
+            for ch, n, m in rows}
+
+
+def activity_factor(message_count, last_epoch, now_epoch):
+    a = 1 + math.log1p(message_count or 0)
+    if last_epoch and now_epoch - last_epoch <= RECENT_MESSAGE_HOURS * 3600:
+        a *= 2
+    return a
+
+
+def plan(conn, now=None, pass_start=None):
+    """Every booking scored, highest priority first: dicts with booking_id, phase,
+    rate, hours_since and priority. With pass_start, only bookings that pass still
+    has to cover."""
+    now = now or dt.datetime.now()
+    now_epoch = _now_epoch(now)
+    today = now.date()
+    chan = channel_factors(conn)
+    rows = conn.execute(
+        f"""SELECT b.id, b.arrival, b.departure, b.status, b.ch,
+                   t.message_count, t.last_epoch, s.messages_checked_at, s.changed_at,
+                   s.error_at
+            FROM (SELECT id, arrival, departure, status, {CHANNEL_SQL} AS ch FROM bookings) b
+            LEFT JOIN threads t ON t.booking_id = b.id
+            LEFT JOIN booking_message_state s ON s.booking_id = b.id""").fetchall()
+    out = []
+    for (bid, arrival, departure, status, ch, count, last_epoch, checked, changed_at,
+         error_at) in rows:
+        if pass_start is not None and _covered(checked, changed_at, pass_start, error_at):
+            continue
+        phase = stay_phase(arrival, departure, today)
+        rate = PHASES[phase][0] * chan.get(ch, 1.0) * activity_factor(count, last_epoch, now_epoch)
+        if str(status or "").strip().lower() == "cancelled":
+            rate *= CANCELLED_FACTOR
+        tried = max(checked or 0, error_at or 0)
+        hours = (now_epoch - tried) / 3600 if tried else NEVER_CHECKED_HOURS
+        out.append({"booking_id": bid, "phase": phase, "rate": rate,
+                    "hours_since": hours, "priority": rate * max(hours, 0)})
+    out.sort(key=lambda c: -c["priority"])
+    return out
+
+
+def _record_check(conn, booking_id, checked_at, data, ingested):
+    """Store one check; returns True if the booking's messages changed since the
+    last check (hash differs) or the ingest wrote anything."""
+    h = message_hash(data)
+    row = conn.execute("SELECT message_hash FROM booking_message_state WHERE booking_id=?",
+                       (booking_id,)).fetchone()
+    changed = bool(ingested) or (row[0] != h if row and row[0] else bool(data))
+    conn.execute(
+        """INSERT INTO booking_message_state
+               (booking_id, messages_checked_at, message_count, checks, changed_at, message_hash)
+           VALUES (?, ?, ?, 1, ?, ?)
+           ON CONFLICT(booking_id) DO UPDATE SET
+               messages_checked_at=excluded.messages_checked_at,
+               message_count=excluded.message_count,
+               checks=checks + 1,
+               changed_at=COALESCE(excluded.changed_at, changed_at),
+               message_hash=excluded.message_hash,
+               errors=0""",
+        (booking_id, checked_at, len(data), checked_at if changed else None, h))
+    conn.commit()
+    return changed
+
+
+def _record_error(conn, booking_id, failed_at):
+    """Store a check that failed, so neither a pass nor the next cycle keeps
+    coming back to it first."""
+    conn.execute(
+        """INSERT INTO booking_message_state (booking_id, error_at, errors) VALUES (?, ?, 1)
+           ON CONFLICT(booking_id) DO UPDATE SET
+               error_at=excluded.error_at, errors=COALESCE(errors, 0) + 1""",
+        (booking_id, failed_at))
+    conn.commit()
+
+
+def check_booking(client, conn, booking_id, checked_at):
+    """One per-booking GET /bookings/messages: ingest and record it. Returns True
+    if the booking's messages changed. Raises Beds24Error / Beds24RateLimit."""
+    payload = client.get("/bookings/messages", params={"bookingId": booking_id})
+    data = payload.get("data", payload if isinstance(payload, list) else [])
+    ingested = ingest_messages(conn, [(booking_id, None, None, m) for m in data])[0]
+    return _record_check(conn, booking_id, checked_at, data, ingested)
+
+
+def run_cycle(client, conn, budget=CYCLE_CREDITS, now=None, pass_start=None):
+    """Check the highest-priority bookings (of those pass_start still needs, if
+    given) until `budget` credits are spent or the API rate-limits us. Each check
+    is ingested and recorded as it completes, so an interrupted cycle keeps what it
+    did; a check that fails is recorded too (_record_error). Returns {"checked",
+    "credits", "changed", "errors", "rate_limited", "freshness"}."""
+    init_messages_table(conn)
+    init_state_table(conn)
+    now = now or dt.datetime.now()
+    now_epoch = _now_epoch(now)
+    spent, checked, changed, errors, limited = 0.0, 0, 0, 0, False
+    for cand in plan(conn, now, pass_start):
+        if spent >= budget:
+            break
+        bid = cand["booking_id"]
+        try:
+            found = check_booking(client, conn, bid, now_epoch)
+        except Beds24RateLimit:
+            limited = True
+            break
+        except Beds24Error:
+            _record_error(conn, bid, now_epoch)
+            errors += 1
+            continue
+        finally:
+            spent += _request_cost(client)
+        checked += 1
+        changed += found
+    return {"checked": checked, "credits": round(spent, 2), "changed": changed,
+            "errors": errors, "rate_limited": limited, "freshness": freshness(conn, now)}
+
+
+def _request_cost(client):
+    try:
+        return float(client.last_credit.get("x-request-cost") or 1)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def freshness(conn, now=None):
+    """Per stay phase: bookings, how many were checked within the phase's target
+    age, and the median hours since their last check (None if never checked)."""
+    now = now or dt.datetime.now()
+    now_epoch = _now_epoch(now)
+    rows = conn.execute(
+        """SELECT b.arrival, b.departure, s.messages_checked_at FROM bookings b
+           LEFT JOIN booking_message_state s ON s.booking_id = b.id""").fetchall()
+    ages = {p: [] for p in PHASES}
+    counts = dict.fromkeys(PHASES, 0)
+    for arrival, departure, checked in rows:
+        phase = stay_phase(arrival, departure, now.date())
+        counts[phase] += 1
+        if checked:
+            ages[phase].append((now_epoch - checked) / 3600)
+    out = {}
+    for phase, (_, target) in PHASES.items():
+        a = ages[phase]
+        out[phase] = {"bookings": counts[phase], "target_hours": target,
+                      "fresh": sum(1 for h in a if h <= target),
+                      "median_age_hours": round(statistics.median(a), 1) if a else None}
+    return out
+
+
+def print_freshness(fresh):
+    print(f"  {'phase':<11} {'bookings':>8} {'fresh':>6} {'target':>7} {'median age':>11}")
+    for phase, f in fresh.items():
+        med = "never" if f["median_age_hours"] is None else f"{f['median_age_hours']}h"
+        print(f"  {phase:<11} {f['bookings']:>8} {f['fresh']:>6} {f['target_hours']:>6}h {med:>11}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--budget", type=float, default=CYCLE_CREDITS, help="Credits for this cycle")
+    ap.add_argument("--plan", action="store_true", help="Show the next cycle; no API calls")
+    args = ap.parse_args()
+    conn = connect(args.db)
+    init_messages_table(conn)
+    init_state_table(conn)
+    if args.plan:
+        for c in plan(conn)[:int(args.budget)]:
+            print(f"  #{c['booking_id']:<10} {c['phase']:<11} rate={c['rate']:.3f} "
+                  f"since={c['hours_since']:.0f}h priority={c['priority']:.1f}")
+        print_freshness(freshness(conn))
+    else:
+        res = run_cycle(Beds24Client(), conn, args.budget)
+        print(f"Checked {res['checked']} bookings for {res['credits']} credits, "
+              f"{res['changed']} with new messages, {res['errors']} failed"
+              f"{' (stopped: rate limited)' if res['rate_limited'] else ''}")
+        print_freshness(res["freshness"])
+    conn.close()
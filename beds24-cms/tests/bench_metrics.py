@@ -0,0 +1,227 @@
+"""
+Metrics benchmark — times load_rows, each KPI function and build_summary end to
+end on synthetic beds24.db files of growing size, records peak memory, appends
+the results to a JSON history and flags regressions against earlier runs.
+
+No network. Synthetic DBs are cached in tests/bench/ (rebuilt with --regen).
+
+Run:  python tests/bench_metrics.py                      # 1k, 10k, 100k, 1M bookings
+      python tests/bench_metrics.py --sizes 1000,10000   # quicker
+      python tests/bench_metrics.py --check              # exit 1 on a regression
+      python tests/bench_metrics.py --budget 300         # ...or if build_summary > 300s
+"""
+import argparse
+import datetime as dt
+import gc
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics as M  # noqa: E402
+from fetch import init_db  # noqa: E402
+from pickup import pickup_summary  # noqa: E402
+from roomgrid import room_grid  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(HERE, "bench")
+HISTORY_PATH = os.path.join(BENCH_DIR, "history.json")
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+CHANNELS = ["Booking.com", "Airbnb", "Direct", "Vrbo", "Expedia"]
+STATUSES = ["confirmed", "new", "cancelled", "request", "black"]
+THRESHOLD = 1.25   # flag when a timing is >25% slower than the recent median
+NOISE_FLOOR = 0.05  # ...and slower by more than this many seconds
+BASELINE_RUNS = 5  # how many earlier runs form the median
+
+
+def make_db(path, n_bookings, seed=7):
+    """Synthetic DB shaped like fetch.py's output: ~1 room type per 250 bookings,
+    spread over properties of 1-8 room types, stays from 2y back to 1y forward."""
+    if os.path.exists(path):
+        os.remove(path)
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    init_db(conn)
+    n_rooms = max(4, n_bookings // 250)
+    rooms = []
+    pid = 1000
+    while len(rooms) < n_rooms:
+        pid += 1
+        conn.execute("INSERT INTO properties (id,name,currency,raw) VALUES (?,?,?,?)",
+                     (pid, f"Property {pid}", "£", "{}"))
+        for _ in range(rnd.randint(1, 8)):
+            rid = pid * 100 + len(rooms)
+            qty = rnd.choice([1, 1, 1, 2, 4])
+            conn.execute("INSERT INTO rooms (id,property_id,name,qty,raw) VALUES (?,?,?,?,?)",
+                         (rid, pid, f"Room {rid}", qty, "{}"))
+            rooms.append((rid, pid))
+    today = dt.date.today()
+
+    def rows():
+        for bid in range(1, n_bookings + 1):
+            rid, p = rnd.choice(rooms)
+            arrival = today + dt.timedelta(days=rnd.randint(-730, 365))
+            nights = rnd.choice([1, 2, 2, 3, 3, 4, 5, 7, 14])
+            channel = rnd.choices(CHANNELS, weights=[40, 30, 12, 8, 10])[0]
+            booked = arrival - dt.timedelta(days=rnd.choice([0, 2, 5, 10, 20, 45, 80, 120, 200]))
+            yield (bid, p, rid, rnd.choices(STATUSES, weights=[70, 15, 10, 3, 2])[0],
+                   arrival.isoformat(), (arrival + dt.timedelta(days=nights)).isoformat(),
+                   nights, rnd.randint(1, 4), 0, float(nights * rnd.choice([85, 110, 140, 180])),
+                   channel, channel, "Sam", "Lee", booked.isoformat(), today.isoformat(), "{}")
+
+    conn.executemany(
+        """INSERT INTO bookings (id,property_id,room_id,status,arrival,departure,
+           num_nights,num_adult,num_child,price,channel,referer,first_name,last_name,
+           booking_time,modified_time,raw) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+        rows())
+    conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES ('last_fetch',?)",
+                 (dt.datetime.now().isoformat(timespec="seconds"),))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _timed(fn, *args, **kw):
+    gc.collect()
+    t0 = time.perf_counter()
+    out = fn(*args, **kw)
+    return out, round(time.perf_counter() - t0, 4)
+
+
+def _peak_mb(fn, *args, **kw):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(*args, **kw)
+        return round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_size(n, regen=False, memory=True):
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    path = os.path.join(BENCH_DIR, f"bench-{n}.db")
+    if regen or not os.path.exists(path):
+        print(f"  generating {path} ...")
+        make_db(path, n)
+    today = dt.date.today()
+    month_start = today.replace(day=1)
+    timings = {}
+    (props, rooms, bookings, meta), timings["load_rows"] = _timed(M.load_rows, path)
+    kpis = {
+        "occupancy_block": lambda: M.occupancy_block(bookings, rooms, month_start,
+                                                     today + dt.timedelta(days=90)),
+        "monthly_series": lambda: M.monthly_series(bookings, rooms),
+        "channel_mix": lambda: M.channel_mix(bookings, today.replace(month=1, day=1),
+                                             today.replace(month=12, day=31)),
+        "pace_vs_last_year": lambda: M.pace_vs_last_year(bookings, rooms),
+        "lead_time_buckets": lambda: M.lead_time_buckets(bookings),
+        "upcoming_feed": lambda: M.upcoming_feed(bookings),
+        "distribution_metrics": lambda: M.distribution_metrics(bookings),
+        "pickup_summary": lambda: pickup_summary(bookings),
+        "daily_cube": lambda: M.daily_cube(
+            bookings, rooms, M._add_months(month_start, -M.CUBE_MONTHS_BACK),
+            M._add_months(month_start, M.CUBE_MONTHS_FWD)),
+    }
+    kpis["room_grid"] = lambda: room_grid(path)
+    for name, fn in kpis.items():
+        _, timings[name] = _timed(fn)
+    del props, rooms, bookings, meta
+    # end to end: cold (no closed-month cache) then warm
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE IF EXISTS metrics_cache")
+    conn.commit()
+    conn.close()
+    _, timings["build_summary_cold"] = _timed(M.build_summary, path)
+    _, timings["build_summary"] = _timed(M.build_summary, path)
+    _, timings["build_summary_list"] = _timed(M.build_summary, path, stream=False)
+    result = {"bookings": n, "timings": timings}
+    if memory:
+        result["peak_mb"] = {"load_rows": _peak_mb(M.load_rows, path),
+                             "build_summary": _peak_mb(M.build_summary, path),
+                             "build_summary_list": _peak_mb(M.build_summary, path, stream=False)}
+    return result
+
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_regressions(history, run, threshold=THRESHOLD, noise=NOISE_FLOOR, k=BASELINE_RUNS):
+    """Compare each timing in `run` to the median of the last k runs on the same
+    host at the same size. Returns human-readable findings."""
+    out = []
+    for res in run["results"]:
+        prior = [r for h in history if h.get("host") == run["host"]
+                 for r in h["results"] if r["bookings"] == res["bookings"]][-k:]
+        for name, secs in res["timings"].items():
+            base = [r["timings"][name] for r in prior if name in r["timings"]]
+            if not base:
+                continue
+            med = statistics.median(base)
+            if secs > med * threshold and secs - med > noise:
+                out.append(f"{name} @ {res['bookings']:,}: {secs:.3f}s vs median {med:.3f}s "
+                           f"(+{(secs / med - 1) * 100 if med else 0:.0f}%)")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                    help="Comma-separated booking counts")
+    ap.add_argument("--regen", action="store_true", help="Rebuild the synthetic DBs")
+    ap.add_argument("--no-memory", action="store_true", help="Skip peak-memory runs (faster)")
+    ap.add_argument("--history", default=HISTORY_PATH)
+    ap.add_argument("--threshold", type=float, default=THRESHOLD,
+                    help="Regression ratio vs recent median (default 1.25)")
+    ap.add_argument("--budget", type=float, default=None,
+                    help="Fail if build_summary takes longer than this many seconds")
+    ap.add_argument("--check", action="store_true", help="Exit non-zero on regressions")
+    args = ap.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    run = {"at": dt.datetime.now().isoformat(timespec="seconds"),
+           "host": platform.node(), "python": platform.python_version(), "results": []}
+    print("Running metrics benchmark...")
+    for n in sizes:
+        print(f"\n{n:,} bookings")
+        res = bench_size(n, regen=args.regen, memory=not args.no_memory)
+        for name, secs in res["timings"].items():
+            print(f"  {name:<20} {secs:>9.3f}s")
+        for name, mb in res.get("peak_mb", {}).items():
+            print(f"  peak {name:<15} {mb:>8.1f} MB")
+        run["results"].append(res)
+
+    history = load_history(args.history)
+    problems = find_regressions(history, run, threshold=args.threshold)
+    if args.budget is not None:
+        problems += [f"build_summary @ {r['bookings']:,}: {r['timings']['build_summary']:.1f}s "
+                     f"exceeds budget {args.budget:.0f}s"
+                     for r in run["results"] if r["timings"]["build_summary"] > args.budget]
+    os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+    with open(args.history, "w") as f:
+        json.dump(history + [run], f, indent=2)
+    print(f"\nHistory: {args.history} ({len(history) + 1} runs)")
+
+    if problems:
+        print(f"\n{len(problems)} REGRESSION(S):")
+        for p in problems:
+            print(f"  - {p}")
+        if args.check:
+            sys.exit(1)
+    else:
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
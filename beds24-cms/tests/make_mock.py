@@ -69,6 +69,23 @@ def build(db_path=DB_PATH):
              json.dumps({"id": bid})))
         bid += 1
 
+    # forward availability calendar like fetch_availability stores it: 0 when the
+    # unit is sold, plus the odd owner block (0 without a booking)
+    rnd = random.Random(7)
+    booked = set()
+    for rid, a, d in conn.execute("SELECT room_id, arrival, departure FROM bookings "
+                                  "WHERE status IN ('confirmed','new')"):
+        day = dt.date.fromisoformat(a)
+        while day < dt.date.fromisoformat(d):
+            booked.add((rid, day))
+            day += dt.timedelta(days=1)
+    for pid, _ in PROPERTIES:
+        for offset in range(0, 180):
+            day = today + dt.timedelta(days=offset)
+            free = 0 if (pid * 10, day) in booked or rnd.random() < 0.04 else 1
+            conn.execute("INSERT INTO availability (room_id,date,num_available,price) "
+                         "VALUES (?,?,?,?)", (pid * 10, day.isoformat(), free, 120))
+
     conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES ('last_fetch',?)",
                  (dt.datetime.now().isoformat(timespec="seconds"),))
     conn.commit()
@@ -2,12 +2,22 @@
 Unit tests for inbox logic — unanswered detection, sorting, channel summary.
 No network. Run: python tests/test_messages.py
 """
+import contextlib
 import datetime as dt
+import io
+import json
 import os
+import random
+import sqlite3
 import sys
+import tempfile
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import messages_fetch as MF  # noqa: E402
 import messages_inbox as MI  # noqa: E402
+import messages_search as MS  # noqa: E402
+import sweep_scheduler as SS  # noqa: E402
+from beds24_client import Beds24Error, Beds24RateLimit  # noqa: E402
 
 failures = []
 
@@ -59,10 +69,703 @@ def test_wait_hours():
     check("wait_hours", threads[0]["wait_hours"], 3.0)
 
 
+class FakeClient:
+    """Stands in for Beds24Client: serves a fixed message list, records maxAge."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def get_all_pages(self, path, params=None):
+        self.calls.append(params["maxAge"])
+        return list(self.rows)
+
+
+def test_incremental_poll():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                 "referer TEXT, channel TEXT)")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT INTO bookings VALUES (1, 10, 'Booking.com', NULL)")
+    MF.init_messages_table(conn)
+    rows = [{"id": 5, "bookingId": 1, "source": "guest", "message": "hi",
+             "time": "2026-06-16T10:00:00"},
+            {"bookingId": 1, "source": "host", "message": "hello",
+             "time": "2026-06-16T10:30:00"}]
+    client = FakeClient(rows)
+    n, _, _, newest = MF.fetch_bulk(client, conn, 120)
+    check("first_poll_writes_all", n, 2)
+    check("newest", newest[0], "2026-06-16T10:30:00")
+    n = MF.fetch_bulk(client, conn, 120)[0]
+    check("repoll_writes_nothing", n, 0)
+    rows[0]["message"] = "hi (edited)"
+    client.rows = rows[1:] + rows[:1]  # different order: fallback id must not move
+    n = MF.fetch_bulk(client, conn, 120)[0]
+    check("edit_writes_one", n, 1)
+    check("no_duplicates", conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 2)
+
+    # legacy booking:index ids are re-keyed by content
+    conn.execute("INSERT INTO messages (id,booking_id,time,mtype,body) "
+                 "VALUES ('1:7',1,'2026-06-16T10:30:00','host','hello')")
+    MF.init_messages_table(conn)
+    check("legacy_id_migrated", conn.execute(
+        "SELECT COUNT(*) FROM messages WHERE id='1:7'").fetchone()[0], 0)
+    check("legacy_merged", conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 2)
+
+    now = dt.datetime(2026, 6, 16, 12, 0, 0)
+    hwm = MF.advance_hwm(None, newest, now)
+    check("hwm_time", hwm["time"], "2026-06-16T10:30:00")
+    check("hwm_never_back", MF.advance_hwm(hwm, ("2026-01-01T00:00:00", "9"), now)["time"],
+          "2026-06-16T10:30:00")
+    check("window_no_mark", MF.poll_window(None, 120, now), 120)
+    check("window_minutes", MF.poll_window(hwm, 120, now + dt.timedelta(minutes=5)),
+          1 + MF.OVERLAP_DAYS)
+    check("window_days", MF.poll_window(hwm, 120, now + dt.timedelta(days=3, hours=1)),
+          4 + MF.OVERLAP_DAYS)
+    check("window_capped", MF.poll_window(hwm, 120, now + dt.timedelta(days=400)), 120)
+
+
+def test_ingest_resolves_from_bookings():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                 "referer TEXT, channel TEXT)")
+    conn.executemany("INSERT INTO bookings VALUES (?,?,?,?)",
+                     [(1, 10, "", "Expedia"), (2, 20, "Booking.com", "x")])
+    MF.init_messages_table(conn)
+    batch = [(1, None, None, {"id": 1, "source": "guest", "message": "a"}),
+             (2, 99, "Airbnb", {"id": 2, "source": "guest", "message": "b"}),
+             ("3", 30, "Vrbo", {"id": 3, "source": "guest", "message": "c"}),
+             (4, None, None, {"id": 4, "source": "host", "message": "d"}),
+             (1, None, None, {"id": 1, "source": "guest", "message": "a2"})]
+    changed, _ = MF.ingest_messages(conn, batch)
+    check("ingest_changed", changed, 4)  # id 1 twice in the batch: last copy wins
+    got = {r[0]: r[1:] for r in conn.execute(
+        "SELECT id, booking_id, property_id, channel, body FROM messages")}
+    check("channel_falls_back_to_channel", got["1"], (1, 10, "Expedia", "a2"))
+    check("bookings_row_wins", got["2"], (2, 20, "Booking.com", "b"))
+    check("unknown_booking_uses_hints", got["3"], (3, 30, "Vrbo", "c"))
+    check("no_hints_other", got["4"], (4, None, "Other", "d"))
+    conn.execute("UPDATE bookings SET referer='Booking.com' WHERE id=1")
+    check("booking_change_rewrites", MF.ingest_messages(conn, batch[4:])[0], 1)
+
+
+def test_threads_table():
+    rnd = random.Random(3)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "t.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                     "referer TEXT, channel TEXT)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        MF.init_messages_table(conn)
+
+        def poll(n, first_id):
+            batch = []
+            for i in range(n):
+                t = dt.datetime(2026, 6, 1) + dt.timedelta(minutes=rnd.randint(0, 20000))
+                batch.append((rnd.randint(1, 30), 1, "Booking.com", {
+                    "id": first_id + i, "source": rnd.choice(["guest", "host", "internalNote"]),
+                    "message": f"m{first_id + i}", "time": t.isoformat(),
+                    "read": rnd.choice([0, 1])}))
+            return MF.ingest_messages(conn, batch)
+
+        poll(200, 0)
+        poll(15, 1000)  # only the touched threads are refreshed
+        incremental = conn.execute("SELECT * FROM threads ORDER BY booking_id").fetchall()
+        MI.refresh_threads(conn)
+        full = conn.execute("SELECT * FROM threads ORDER BY booking_id").fetchall()
+        check("incremental_equals_full", incremental == full, True)
+        conn.commit()
+
+        inbox = MI.build_inbox(path, with_messages=True)
+        conn.row_factory = sqlite3.Row
+        legacy = MI.build_threads([dict(r) for r in conn.execute("SELECT * FROM messages")])
+        conn.close()
+        strip = lambda ts: [{k: v for k, v in t.items() if k not in ("property", "wait_hours")}
+                            for t in ts]
+        check("inbox_from_table_matches_messages", strip(inbox["threads"]) == strip(legacy), True)
+        check("thread_count", len(inbox["threads"]), 30)
+
+
+def test_lazy_threads():
+    import build_messages_dashboard as BMD
+    with tempfile.TemporaryDirectory() as tmp:
+        path, out = os.path.join(tmp, "t.db"), os.path.join(tmp, "inbox.html")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                     "referer TEXT, channel TEXT)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        MF.init_messages_table(conn)
+        MF.ingest_messages(conn, [
+            (bid, 1, "Airbnb", {"id": bid * 10 + i, "source": "guest" if i % 2 == 0 else "host",
+                                "message": f"b{bid} m{i}", "time": f"2026-06-0{i + 1}T10:00:00"})
+            for bid in (1, 2, 3) for i in range(3)])
+
+        _, inbox = BMD.build(path, out)
+        check("index_has_no_messages", any("messages" in t for t in inbox["threads"]), False)
+        with open(out) as f:
+            check("page_has_no_bodies", "b2 m1" in f.read(), False)
+        folder = BMD.threads_dir(out)
+        check("one_shard_per_thread", sorted(os.listdir(folder)), ["1.json", "2.json", "3.json"])
+        with open(os.path.join(folder, "2.json")) as f:
+            shard = json.load(f)
+        check("shard_matches_thread_messages", shard["messages"], MI.thread_messages(conn, 2))
+        check("shard_oldest_first", [m["body"] for m in shard["messages"]],
+              ["b2 m0", "b2 m1", "b2 m2"])
+
+        mtime = os.stat(os.path.join(folder, "1.json")).st_mtime_ns
+        MF.ingest_messages(conn, [(2, 1, "Airbnb", {"id": 99, "source": "guest",
+                                                    "message": "late", "time": "2026-06-09T10:00:00"})])
+        conn.execute("DELETE FROM messages WHERE booking_id = 3")
+        MI.refresh_threads(conn, [3])
+        conn.commit()
+        _, inbox = BMD.build(path, out)
+        check("changed_shards_only", inbox["shards"], (1, 1))
+        check("unchanged_shard_untouched", os.stat(os.path.join(folder, "1.json")).st_mtime_ns, mtime)
+        check("stale_shard_removed", sorted(os.listdir(folder)), ["1.json", "2.json"])
+
+        _, inbox = BMD.build(path, out, force=True, embed_messages=True)
+        check("embed_messages", {t["booking_id"]: len(t["messages"]) for t in inbox["threads"]},
+              {1: 3, 2: 4})
+        conn.close()
+
+
+def test_search():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                 "referer TEXT, channel TEXT)")
+    conn.executemany("INSERT INTO bookings VALUES (?,?,?,?)",
+                     [(1, 10, "Booking.com", None), (2, 20, "Expedia", None),
+                      (3, 10, "Airbnb", None)])
+    MF.init_messages_table(conn)
+    batch = [(1, None, None, {"id": 1, "source": "guest", "time": "2026-01-05T09:00:00",
+                              "message": "Is there parking? Parking for two cars?"}),
+             (1, None, None, {"id": 2, "source": "host", "time": "2026-01-05T10:00:00",
+                              "message": "Street parking only"}),
+             (2, None, None, {"id": 3, "source": "guest", "time": "2026-03-01T12:00:00",
+                              "message": "Could we have an early check-in?"}),
+             (3, None, None, {"id": 4, "source": "guest", "time": "2026-03-02T12:00:00",
+                              "message": "Where do I park? Any parking permit?"})]
+    MF.ingest_messages(conn, batch)
+    res = MS.search(conn, "parking")
+    check("search_threads", [r["booking_id"] for r in res["results"]], [1, 3])
+    check("search_hits", res["results"][0]["hits"], 2)
+    check("search_snippet", MS.MARK_OPEN + "parking" + MS.MARK_CLOSE
+          in res["results"][0]["snippet"].lower(), True)
+    check("search_channel", [r["booking_id"] for r in
+                             MS.search(conn, "parking", channel="Airbnb")["results"]], [3])
+    check("search_property", [r["booking_id"] for r in
+                              MS.search(conn, "parking", property_id="10,20")["results"]], [1, 3])
+    check("search_dates", [r["booking_id"] for r in
+                           MS.search(conn, "parking", since="2026-02-01")["results"]], [3])
+    for bound in ("since", "until"):
+        try:
+            MS.search(conn, "parking", **{bound: "garbage"})
+            check(f"search_bad_{bound}_rejected", False, True)
+        except ValueError:
+            check(f"search_bad_{bound}_rejected", True, True)
+    check("search_punctuation", [r["booking_id"] for r in
+                                 MS.search(conn, "early check-in?")["results"]], [2])
+    check("search_prefix", len(MS.search(conn, "par*")["results"]), 2)
+    check("to_match_quotes", MS.to_match('say "hi there" it\'s'), '"say" "hi there" "it\'s"')
+    # upserted edits and deletes stay in sync through the triggers
+    MF.ingest_messages(conn, [(2, None, None, {"id": 3, "source": "guest",
+                                               "time": "2026-03-01T12:00:00",
+                                               "message": "Late checkout please"})])
+    check("search_after_edit_old", MS.search(conn, "early")["results"], [])
+    check("search_after_edit_new", len(MS.search(conn, "checkout")["results"]), 1)
+    conn.execute("DELETE FROM messages WHERE id='4'")
+    check("search_after_delete", [r["booking_id"] for r in
+                                  MS.search(conn, "parking")["results"]], [1])
+    check("fts_integrity", conn.execute(
+        "INSERT INTO messages_fts(messages_fts, rank) VALUES ('integrity-check', 1)").rowcount, 1)
+
+
+class FakeBookingClient:
+    """Per-booking GET /bookings/messages with a fixed cost; rate-limits after N calls,
+    and always fails for the bookings in `failing`."""
+
+    def __init__(self, threads, cost=1, limit_after=None, failing=()):
+        self.threads, self.calls, self.limit_after = threads, [], limit_after
+        self.failing = set(failing)
+        self.last_credit = {"x-request-cost": str(cost)}
+
+    def get(self, path, params=None):
+        if self.limit_after is not None and len(self.calls) >= self.limit_after:
+            raise Beds24RateLimit(path, "", {})
+        self.calls.append(params["bookingId"])
+        if params["bookingId"] in self.failing:
+            raise Beds24Error(f"{path}: HTTP 500")
+        return {"data": self.threads.get(params["bookingId"], [])}
+
+
+def test_sweep_scheduler():
+    today = dt.date(2026, 6, 16)
+    now = dt.datetime(2026, 6, 16, 12, 0, 0)
+    d = lambda n: (today + dt.timedelta(days=n)).isoformat()
+    check("phase_in_house", SS.stay_phase(d(-2), d(1), today), "in_house")
+    check("phase_arriving", SS.stay_phase(d(3), d(5), today), "arriving")
+    check("phase_upcoming", SS.stay_phase(d(30), d(33), today), "upcoming")
+    check("phase_far", SS.stay_phase(d(200), d(203), today), "far_future")
+    check("phase_departed", SS.stay_phase(d(-9), d(-5), today), "departed")
+    check("phase_past", SS.stay_phase(d(-90), d(-85), today), "past")
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                 "status TEXT, arrival TEXT, departure TEXT, referer TEXT, channel TEXT)")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    rows = [(1, 1, "confirmed", d(-1), d(2), "Booking.com", None),    # in house
+            (2, 1, "confirmed", d(200), d(203), "Booking.com", None),  # far future
+            (3, 1, "cancelled", d(-1), d(2), "Booking.com", None),     # in house, cancelled
+            (4, 1, "confirmed", d(2), d(4), "Booking.com", None),      # arriving
+            (5, 1, "confirmed", d(-300), d(-297), "Booking.com", None)]  # long gone
+    conn.executemany("INSERT INTO bookings VALUES (?,?,?,?,?,?,?)", rows)
+    MF.init_messages_table(conn)
+    SS.init_state_table(conn)
+    order = [c["booking_id"] for c in SS.plan(conn, now)]
+    check("plan_order", order, [1, 4, 3, 2, 5])
+
+    msgs = {4: [{"id": 40, "source": "guest", "message": "hi", "time": now.isoformat()}]}
+    client = FakeBookingClient(msgs, cost=2)
+    res = SS.run_cycle(client, conn, budget=4, now=now)
+    check("budget_respected", (client.calls, res["credits"]), ([1, 4], 4.0))
+    check("found_new", res["changed"], 1)
+    check("fresh_in_house", res["freshness"]["in_house"]["fresh"], 1)
+    check("state_rows", conn.execute("SELECT booking_id, message_count, changed_at IS NOT NULL "
+                                     "FROM booking_message_state ORDER BY booking_id").fetchall(),
+          [(1, 0, 0), (4, 1, 1)])
+    # just-checked bookings wait their turn; the next cycle moves on
+    client = FakeBookingClient(msgs, cost=1, limit_after=1)
+    res = SS.run_cycle(client, conn, budget=10, now=now + dt.timedelta(minutes=5))
+    check("next_cycle_moves_on", client.calls, [3])
+    check("rate_limited_stops", res["rate_limited"], True)
+
+
+def test_resumable_sweep():
+    import pull_all_messages as PA
+    today = dt.date.today()
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                 "status TEXT, arrival TEXT, departure TEXT, referer TEXT, channel TEXT)")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT INTO bookings VALUES (?,1,'confirmed',?,?,'Booking.com',NULL)",
+                     [(i, (today + dt.timedelta(days=i)).isoformat(),
+                       (today + dt.timedelta(days=i + 2)).isoformat()) for i in range(1, 8)])
+    MF.init_messages_table(conn)
+    msgs = {3: [{"id": 30, "source": "guest", "message": "hi", "time": "2026-06-16T10:00:00"}]}
+    client = FakeBookingClient(msgs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        PA.sweep_all(client, conn, budget=2, max_cycles=1)
+    check("sweep_first_run", len(client.calls), 2)
+    check("sweep_paused", SS.read_sweep(conn)["completed_at"], None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        PA.sweep_all(client, conn, budget=2, max_cycles=10)
+    check("sweep_resumed_no_repeats", sorted(client.calls), list(range(1, 8)))
+    check("sweep_complete", SS.read_sweep(conn)["completed_at"] is not None, True)
+    check("sweep_hash_saved", conn.execute("SELECT message_hash FROM booking_message_state "
+                                           "WHERE booking_id=3").fetchone()[0],
+          SS.message_hash(msgs[3]))
+    # a new pass skips what was just checked with nothing new; changed ones go again
+    conn.execute("UPDATE booking_message_state SET messages_checked_at = messages_checked_at - 60, "
+                 "changed_at = changed_at - 60")
+    pass_start = MI._now_epoch()
+    check("recent_unchanged_skipped",
+          [c["booking_id"] for c in SS.plan(conn, pass_start=pass_start)], [3])
+
+
+def test_failed_checks():
+    import pull_all_messages as PA
+    today = dt.date.today()
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                 "status TEXT, arrival TEXT, departure TEXT, referer TEXT, channel TEXT)")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT INTO bookings VALUES (?,1,'confirmed',?,?,'Booking.com',NULL)",
+                     [(i, (today + dt.timedelta(days=i)).isoformat(),
+                       (today + dt.timedelta(days=i + 2)).isoformat()) for i in range(1, 5)])
+    MF.init_messages_table(conn)
+    SS.init_state_table(conn)
+    # a failed check isn't first in line again next cycle
+    now = dt.datetime.combine(today, dt.time(12))
+    client = FakeBookingClient({}, failing={1})
+    SS.run_cycle(client, conn, budget=1, now=now)
+    res = SS.run_cycle(client, conn, budget=1, now=now + dt.timedelta(minutes=5))
+    check("failed_check_not_first_again", client.calls, [1, 2])
+    check("failed_check_recorded", conn.execute(
+        "SELECT messages_checked_at, error_at IS NOT NULL, errors FROM booking_message_state "
+        "WHERE booking_id=1").fetchone(), (None, 1, 1))
+    # a booking that always fails still lets the pass complete
+    conn.execute("DELETE FROM booking_message_state")
+    client = FakeBookingClient({}, failing={2})
+    age = ("UPDATE booking_message_state SET messages_checked_at = messages_checked_at - 60, "
+           "error_at = error_at - 60")
+    for _ in range(2):
+        conn.execute(age)
+        with contextlib.redirect_stdout(io.StringIO()):
+            PA.sweep_all(client, conn, budget=10, max_cycles=5)
+        check("sweep_completes_despite_failure", SS.read_sweep(conn)["completed_at"] is not None,
+              True)
+    check("failed_booking_retried_next_pass", client.calls[4:], [2])
+    check("failed_checks_counted", conn.execute(
+        "SELECT errors FROM booking_message_state WHERE booking_id=2").fetchone()[0], 2)
+    # one that works again clears the count
+    client.failing.clear()
+    conn.execute(age)
+    with contextlib.redirect_stdout(io.StringIO()):
+        PA.sweep_all(client, conn, budget=10, max_cycles=5, restart=True)
+    check("errors_reset_on_success", conn.execute(
+        "SELECT errors FROM booking_message_state WHERE booking_id=2").fetchone()[0], 0)
+
+
+class FakeApiClient:
+    """GET /bookings?id= and /bookings/messages?bookingId= from dicts."""
+
+    def __init__(self, bookings, threads):
+        self.bookings, self.threads, self.calls = bookings, threads, []
+        self.last_credit = {}
+
+    def get(self, path, params=None):
+        self.calls.append(path)
+        if path == "/bookings":
+            b = self.bookings.get(params["id"])
+            return {"data": [b] if b else []}
+        return {"data": self.threads.get(params["bookingId"], [])}
+
+
+def test_webhook_receiver():
+    import threading
+    import urllib.error
+    import urllib.request
+    import webhook_receiver as W
+    from make_mock import build as make_mock_db
+
+    check("ids_booking_object", W.booking_ids({"booking": {"id": 5, "arrival": "2026-06-01"},
+                                               "messages": [{"id": 99, "bookingId": 5}]}), [5])
+    check("ids_message_list", W.booking_ids([{"id": 98, "bookingId": "6"}, {"bookId": 7}]), [6, 7])
+    check("ids_message_with_booking_fields",
+          W.booking_ids({"id": 555, "bookingId": 12, "propertyId": 3}), [12])
+    check("ids_top_level_booking", W.booking_ids({"id": 8, "arrival": "2026-06-01",
+                                                  "roomId": 2}), [8])
+    check("ids_none", W.booking_ids({"hello": "world"}), [])
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            path = make_mock_db(os.path.join(tmp, "mock.db"))
+        new = {"id": 9001, "propertyId": 101, "roomId": 1010, "status": "new",
+               "arrival": "2026-07-01", "departure": "2026-07-03", "referer": "Airbnb"}
+        client = FakeApiClient({9001: new}, {9001: [
+            {"id": 1, "source": "guest", "message": "Can we check in early?",
+             "time": "2026-06-20T09:00:00"}]})
+        builds = []
+        server = W.make_server(client, path, port=0, secret="s3cret",
+                               on_change=lambda: builds.append(1),
+                               record_dir=os.path.join(tmp, "hooks"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}{W.PATH}"
+
+        def post(payload, token="s3cret"):
+            req = urllib.request.Request(url + (f"?token={token}" if token else ""),
+                                         data=json.dumps(payload).encode(), method="POST")
+            try:
+                with urllib.request.urlopen(req) as r:
+                    return r.status, json.loads(r.read())
+            except urllib.error.HTTPError as e:
+                return e.code, None
+
+        try:
+            check("webhook_bad_token", post({"bookingId": 9001}, token="nope")[0], 403)
+            check("webhook_no_token", post({"bookingId": 9001}, token=None)[0], 403)
+            status, reply = post({"booking": new, "messages": [{"id": 1, "bookingId": 9001}]})
+            check("webhook_accepted", (status, reply["bookings"]), (200, [9001]))
+            check("webhook_drained", server.refresher.drain(), True)
+            conn = sqlite3.connect(path)
+            check("webhook_booking_upserted", conn.execute(
+                "SELECT status, referer FROM bookings WHERE id=9001").fetchone(), ("new", "Airbnb"))
+            check("webhook_message_ingested", conn.execute(
+                "SELECT booking_id, channel FROM messages").fetchall(), [(9001, "Airbnb")])
+            check("webhook_thread_refreshed", conn.execute(
+                "SELECT unanswered FROM threads WHERE booking_id=9001").fetchone(), (1,))
+            check("webhook_inbox_rebuilt", len(builds), 1)
+            due, _ = MF.poll_due(conn, {"polled_at": dt.datetime.now().isoformat()})
+            check("webhook_poll_becomes_reconciliation", due, False)
+            check("poll_due_first_poll", MF.poll_due(conn, None)[0], True)
+            conn.close()
+            # recorded payloads replay end to end; an unchanged thread doesn't rebuild
+            recorded = sorted(os.listdir(os.path.join(tmp, "hooks")))
+            check("webhook_recorded", len(recorded), 1)
+            res = W.replay([os.path.join(tmp, "hooks", recorded[0])], url + "?token=s3cret")
+            check("webhook_replayed", [(r[1], r[2]["bookings"]) for r in res], [(200, [9001])])
+            server.refresher.drain()
+            check("webhook_unchanged_no_rebuild", len(builds), 1)
+            check("webhook_healthz", urllib.request.urlopen(
+                url.replace(W.PATH, "/healthz")).status, 200)
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.refresher.stop()
+
+
+def test_messages_daemon():
+    import messages_daemon as D
+    now = 1_800_000_000
+    check("interval_active", D.next_interval(600, 3, None, 0, now), D.ACTIVE_INTERVAL)
+    check("interval_recent_thread", D.next_interval(600, 0, now - 600, 0, now), D.ACTIVE_INTERVAL)
+    check("interval_unanswered", D.next_interval(600, 0, now - 86400, 2, now),
+          D.UNANSWERED_INTERVAL)
+    check("interval_quiet_starts_at_base", D.next_interval(D.ACTIVE_INTERVAL, 0, None, 0, now),
+          D.BASE_INTERVAL)
+    check("interval_backs_off", D.next_interval(D.BASE_INTERVAL, 0, None, 0, now),
+          int(D.BASE_INTERVAL * D.BACKOFF))
+    check("interval_capped", D.next_interval(D.MAX_INTERVAL, 0, None, 0, now), D.MAX_INTERVAL)
+
+    def booking_db(path):
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                     "referer TEXT, channel TEXT)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT INTO bookings VALUES (1, 10, 'Booking.com', NULL)")
+        conn.commit()
+        conn.close()
+        return path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = booking_db(os.path.join(tmp, "t.db"))
+        t0 = dt.datetime(2026, 6, 16, 10, 0, 0)
+        client = FakeClient([{"id": 5, "bookingId": 1, "source": "guest", "message": "hi",
+                              "time": (t0 - dt.timedelta(days=2)).isoformat()}])
+        daemon = D.MessagesDaemon(client, path, out_path=os.path.join(tmp, "inbox.html"),
+                                  log=lambda msg: None)
+        first = daemon.poll(t0)
+        check("daemon_first_poll", (first["changed"], first["built"], first["interval"]),
+              (1, True, D.ACTIVE_INTERVAL))
+        second = daemon.poll(t0 + dt.timedelta(minutes=1))
+        check("daemon_quiet_poll_no_build", (second["changed"], second["built"]), (0, False))
+        check("daemon_unanswered_interval", second["interval"], D.UNANSWERED_INTERVAL)
+        check("daemon_incremental_window", client.calls, [120, 2])
+        client.rows.append({"id": 6, "bookingId": 1, "source": "host", "message": "hello",
+                            "time": (t0 - dt.timedelta(days=1)).isoformat()})
+        third = daemon.poll(t0 + dt.timedelta(minutes=3))
+        check("daemon_new_message_rebuilds", (third["changed"], third["built"]), (1, True))
+        fourth = daemon.poll(t0 + dt.timedelta(minutes=4))
+        fifth = daemon.poll(t0 + dt.timedelta(minutes=9))
+        check("daemon_backs_off_when_quiet", (fourth["interval"], fifth["interval"]),
+              (D.BASE_INTERVAL, int(D.BASE_INTERVAL * D.BACKOFF)))
+        # a new hour re-checks the page (its "last fetch" stamp) even without messages
+        daemon.poll(t0 + dt.timedelta(hours=1))
+        check("daemon_hourly_stamp_check", daemon.built_hour, "2026-06-16T11")
+        daemon.close()
+
+        # a guest's last word weeks ago ("thanks!") is unanswered but not waiting
+        client = FakeClient([{"id": 7, "bookingId": 1, "source": "guest", "message": "thanks!",
+                              "time": (t0 - dt.timedelta(days=20)).isoformat()}])
+        old = booking_db(os.path.join(tmp, "old.db"))
+        daemon = D.MessagesDaemon(client, old, out_path=os.path.join(tmp, "old.html"),
+                                  log=lambda msg: None)
+        polls = [daemon.poll(t0 + dt.timedelta(minutes=m)) for m in (0, 1, 6)]
+        check("daemon_old_thread_unanswered",
+              daemon.conn.execute("SELECT unanswered FROM threads").fetchone()[0], 1)
+        check("daemon_old_unanswered_backs_off", [p["interval"] for p in polls[1:]],
+              [D.BASE_INTERVAL, int(D.BASE_INTERVAL * D.BACKOFF)])
+        daemon.close()
+
+
+def test_cli():
+    import beds24 as CLI
+    check("cli_split_steps", CLI.split_steps(["fetch", "--skip-availability", "+", "build"]),
+          [["fetch", "--skip-availability"], ["build"]])
+    opts, steps = CLI.parse(["--db", "x.db", "messages", "--full", "+", "build", "--inbox"])
+    check("cli_parse_chain", (opts.db, [name for name, _ in steps], steps[0][1].full,
+                              steps[1][1].inbox), ("x.db", ["messages", "build"], True, True))
+    for bad in (["fetch", "+"], ["fetch", "+", "nope"], ["build", "--reprots"]):
+        try:
+            with contextlib.redirect_stderr(io.StringIO()):
+                CLI.parse(bad)
+            check(f"cli_rejects {bad}", "parsed", "SystemExit")
+        except SystemExit:
+            pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "t.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, property_id INTEGER, "
+                     "referer TEXT, channel TEXT)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT INTO bookings VALUES (1, 10, 'Booking.com', NULL)")
+        conn.commit()
+        conn.close()
+        client = FakeClient([{"id": 5, "bookingId": 1, "source": "guest", "message": "hi",
+                              "time": (dt.datetime.now() - dt.timedelta(days=2)).isoformat()}])
+        ctx = CLI.Context(path)
+        ctx._client = client
+        _, steps = CLI.parse(["messages", "+", "messages"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, args in steps:
+                CLI.COMMANDS[name][2](ctx, args)
+        # the second step's poll is incremental: it saw the first step's high-water mark
+        check("cli_steps_share_state", client.calls, [120, 2])
+        ctx.close()
+        conn = sqlite3.connect(path)
+        check("cli_messages_stored", conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 1)
+        conn.close()
+
+
+def test_concurrent_jobs():
+    """fetch, the messages poller and both builds at once on one DB, through db.py."""
+    import threading
+    import time
+    import build_dashboard as B
+    import build_messages_dashboard as BM
+    import db
+    from fetch import upsert_bookings
+    from make_mock import build as make_mock_db
+
+    def booking(bid):
+        return {"id": bid, "propertyId": 101, "roomId": 1010, "status": "confirmed",
+                "arrival": "2026-07-01", "departure": "2026-07-03", "price": 200,
+                "referer": "Airbnb"}
+
+    def count(table):
+        with db.reading(path) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(io.StringIO()):
+            path = make_mock_db(os.path.join(tmp, "mock.db"))
+        writer = db.connect(path)
+        check("db_wal", writer.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        before = count("bookings")
+        with db.snapshot(path):
+            upsert_bookings(writer, [booking(90000)])
+            writer.commit()
+            during = count("bookings")
+        check("snapshot_ignores_later_commits", (during, count("bookings")), (before, before + 1))
+        writer.close()
+
+        errors = []
+
+        def run(job, n):
+            try:
+                for i in range(n):
+                    job(i)
+            except Exception as e:  # "database is locked" lands here
+                errors.append(f"{job.__name__}: {e!r}")
+
+        def fetch_job(i):
+            conn = db.connect(path)
+            upsert_bookings(conn, [booking(91000 + i * 100 + k) for k in range(100)])
+            time.sleep(0.05)  # a long upsert: the write lock stays held meanwhile
+            conn.commit()
+            conn.close()
+
+        client = FakeClient([])
+
+        def poll_job(i):
+            client.rows.append({"id": 500 + i, "bookingId": 1, "source": "guest",
+                                "message": f"question {i}", "time": f"2026-06-16T10:{i:02d}:00"})
+            conn = db.connect(path)
+            MF.poll(client, conn, force=True)
+            conn.close()
+
+        def build_job(i):
+            _, summary = B.build_all(path, [("dashboard.html", False)], tmp, force=True)
+            _, inbox = BM.build(path, os.path.join(tmp, "inbox.html"), force=True)
+            # the page and its shards come from one snapshot
+            shards = len(os.listdir(os.path.join(tmp, BM.THREADS_DIR)))
+            if shards != inbox["summary"]["total_threads"]:
+                errors.append(f"build_job: {shards} shards for "
+                              f"{inbox['summary']['total_threads']} threads")
+
+        jobs = [threading.Thread(target=run, args=(fetch_job, 6)),
+                threading.Thread(target=run, args=(poll_job, 12)),
+                threading.Thread(target=run, args=(build_job, 3))]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for t in jobs:
+                t.start()
+            for t in jobs:
+                t.join()
+        check("concurrent_jobs_no_errors", errors, [])
+        check("concurrent_fetch_complete", count("bookings"), before + 1 + 600)
+        check("concurrent_poll_complete", count("messages"), 12)
+
+
+def test_field_mapping():
+    import fieldmap as FM
+    from fetch import init_db, upsert_bookings
+
+    check("probe_skips_empty", FM.probe({"id": "", "bookId": 7}, ("id", "bookId")), 7)
+    check("probe_default", FM.probe(["not", "a", "dict"], ("id",), default=0), 0)
+    ex = FM.MESSAGE.extractor()
+    first = ex({"messageId": 1, "bookingId": 4, "type": "guest", "text": "hi", "read": False})
+    check("extract_variants", (first["id"], first["type"], first["body"], first["read"],
+                               first["time"]), (1, "guest", "hi", False, None))
+    check("extract_resolved", ex.resolved()["body"], "text")
+    # resolved key present but empty: other variants still count, no drift
+    check("extract_empty_falls_back", ex({"messageId": 2, "text": "", "body": "b"})["body"], "b")
+    check("extract_no_drift_on_empty", ex.drift, {})
+    # resolved key gone: the shape changed
+    check("extract_drift_value", ex({"id": 3, "message": "m"})["body"], "m")
+    check("extract_drift", sorted(ex.drift),
+          [("body", "text", "message"), ("id", "messageId", "id")])
+    check("extract_follows_drift", ex.resolved()["body"], "message")
+    # an empty first value still fixes the key the account uses
+    bx = FM.BOOKING.extractor()
+    bx({"id": 1, "lastName": "", "guestName": "Lee"})
+    check("extract_resolves_present_key", bx.resolved()["last_name"], "lastName")
+
+    conn = sqlite3.connect(":memory:")
+    init_db(conn)
+    logged = []
+    canonical = {"id": 1, "propertyId": 101, "roomId": 1010, "status": "new",
+                 "arrival": "2026-07-01", "departure": "2026-07-04", "numAdult": 2,
+                 "price": 300, "referer": "Airbnb", "firstName": "Ann", "lastName": "Lee"}
+    legacy = {"bookId": 2, "propId": 101, "roomTypeId": 1010, "status": "new",
+              "firstNight": "2026-07-01", "lastNight": "2026-07-04", "adults": 2,
+              "total": "300", "source": "Airbnb", "guestFirstName": "Ann", "guestName": "Lee"}
+    with contextlib.redirect_stdout(io.StringIO()):
+        upsert_bookings(conn, [canonical])
+        upsert_bookings(conn, [legacy])
+    rows = conn.execute("SELECT id, property_id, room_id, arrival, departure, num_nights, "
+                        "num_adult, price, referer, first_name, last_name FROM bookings "
+                        "ORDER BY id").fetchall()
+    check("legacy_shape_same_row", rows[1][1:], rows[0][1:])
+    stored = json.loads(conn.execute(
+        "SELECT value FROM meta WHERE key=?", (FM.FIELD_MAP_KEY,)).fetchone()[0])
+    check("field_map_recorded", stored["bookings"]["arrival"], "firstNight")
+    ex = FM.BOOKING.extractor()
+    ex(canonical)
+    lines = FM.remember(conn, ex, log=logged.append)
+    check("field_map_reports_rename", "bookings.arrival: now 'arrival' (was 'firstNight' last run)"
+          in lines, True)
+    check("field_map_logged", len(logged), len(lines))
+
+    # items that carry their fields (fetch_bulk) are not extracted or remembered again
+    MF.init_messages_table(conn)
+    m = {"id": 9, "source": "guest", "message": "hi", "time": "2026-07-01T10:00:00"}
+    statements = []
+    conn.set_trace_callback(statements.append)
+    MF.ingest_messages(conn, [(1, 101, "Airbnb", m, FM.MESSAGE.extractor()(m))])
+    conn.set_trace_callback(None)
+    check("preextracted_skips_field_map", [s for s in statements if FM.FIELD_MAP_KEY in s], [])
+    check("preextracted_ingested", conn.execute(
+        "SELECT body FROM messages WHERE id='9'").fetchone(), ("hi",))
+
+
 if __name__ == "__main__":
     print("Running inbox unit tests...")
     test_unanswered_and_sorting()
     test_wait_hours()
+    test_incremental_poll()
+    test_ingest_resolves_from_bookings()
+    test_threads_table()
+    test_lazy_threads()
+    test_search()
+    test_sweep_scheduler()
+    test_resumable_sweep()
+    test_failed_checks()
+    test_webhook_receiver()
+    test_messages_daemon()
+    test_cli()
+    test_concurrent_jobs()
+    test_field_mapping()
     if failures:
         print(f"\n{len(failures)} FAILURE(S): {failures}")
         sys.exit(1)
@@ -4,10 +4,15 @@ Run: python tests/test_metrics.py   (exits non-zero on failure)
 """
 import datetime as dt
 import os
+import sqlite3
 import sys
+import tempfile
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 import metrics as M  # noqa: E402
+import pickup as P  # noqa: E402
+from sketches import QuantileSketch  # noqa: E402
 
 failures = []
 
@@ -84,12 +89,345 @@ def test_lead_time():
     check("lead_91plus", lt["91d+"], 1)
 
 
+def test_closed_month_cache():
+    rooms = [{"qty": 1}, {"qty": 1}]
+    anchor = dt.date(2026, 3, 1)  # Jan-Mar 2026: all closed months
+    bookings = [
+        {"id": 1, "status": "confirmed", "arrival": "2026-01-10", "departure": "2026-01-14", "price": 400},
+        {"id": 2, "status": "confirmed", "arrival": "2026-01-30", "departure": "2026-02-03", "price": 400},
+        {"id": 3, "status": "new", "arrival": "2026-02-20", "departure": "2026-02-22", "price": 200},
+    ]
+    conn = sqlite3.connect(":memory:")
+    M.init_metrics_cache(conn)
+    plain = M.monthly_series(bookings, rooms, months_back=2, months_fwd=0, anchor=anchor)
+    cached = M.monthly_series(bookings, rooms, months_back=2, months_fwd=0, anchor=anchor, cache=conn)
+    check("cache_first_build_identical", cached, plain)
+    check("cache_rows_written", conn.execute("SELECT COUNT(*) FROM metrics_cache").fetchone()[0], 3)
+    again = M.monthly_series(bookings, rooms, months_back=2, months_fwd=0, anchor=anchor, cache=conn)
+    check("cache_hit_identical", again, plain)
+
+    jan, feb = dt.date(2026, 1, 1), dt.date(2026, 2, 1)
+    fp_jan = M.period_fingerprint(bookings, rooms, jan, feb)
+    bookings[2]["status"] = "cancelled"  # touches Feb only
+    check("untouched_month_fp_stable", M.period_fingerprint(bookings, rooms, jan, feb), fp_jan)
+    after = M.monthly_series(bookings, rooms, months_back=2, months_fwd=0, anchor=anchor, cache=conn)
+    check("invalidated_feb_sold", after[1]["sold_room_nights"], 2)      # booking 2's Feb nights only
+    check("jan_unchanged", after[0]["sold_room_nights"], plain[0]["sold_room_nights"])
+
+
+def test_pickup_matrix():
+    bookings = [
+        # booked 10 days before a 2-night stay, 100/night
+        {"status": "confirmed", "arrival": "2026-05-10", "departure": "2026-05-12",
+         "price": 200, "booking_time": "2026-04-30"},
+        # booked 2 days before a 1-night stay
+        {"status": "new", "arrival": "2026-05-11", "departure": "2026-05-12",
+         "price": 150, "booking_time": "2026-05-09"},
+        # last year's same stay window: booked 5 days out
+        {"status": "confirmed", "arrival": "2025-05-10", "departure": "2025-05-12",
+         "price": 180, "booking_time": "2025-05-05"},
+        {"status": "cancelled", "arrival": "2026-05-10", "departure": "2026-05-11",
+         "price": 999, "booking_time": "2026-05-01"},
+    ]
+    m = P.PickupMatrix.from_bookings(bookings, dt.date(2025, 1, 1), dt.date(2027, 1, 1))
+    w0, w1 = dt.date(2026, 5, 10), dt.date(2026, 5, 12)
+    check("pickup_final_nights", m.at_lead(w0, w1, 0)[0], 3.0)
+    check("pickup_final_revenue", m.at_lead(w0, w1, 0)[1], 350.0)
+    check("pickup_as_of_early", m.on_the_books(w0, w1, dt.date(2026, 5, 1))[0], 2.0)
+    check("pickup_lead_5", m.at_lead(w0, w1, 5)[0], 2.0)  # the 2-day-out booking isn't in yet
+    ly = m.pace_curve(w0, w1, days_before=[6, 0], years_back=1)
+    check("pickup_ly_curve", [p["nights"] for p in ly], [0.0, 2.0])
+    fc = m.forecast(w0, w1, as_of=dt.date(2026, 5, 6))
+    # as of 4 days before the window: 2 nights on books; LY picked up 0 from the same point
+    check("pickup_forecast_nights", fc["forecast"]["nights"], 2.0)
+
+
+def test_quantile_sketch():
+    values = [(i * 37) % 1000 + 1 for i in range(10000)]  # 1..1000, uniform
+    a, b = QuantileSketch(), QuantileSketch()
+    for i, v in enumerate(values):
+        (a if i % 2 else b).add(v)
+    merged = a.merge(b)
+    exact = sorted(values)
+    for q in (0.5, 0.9):
+        want = exact[int(q * (len(exact) - 1))]
+        got = merged.quantile(q)
+        check(f"sketch_p{int(q * 100)}_within_1pct", abs(got - want) <= 0.01 * want + 1e-9, True)
+    check("sketch_count", merged.count, 10000)
+    check("sketch_bounded", len(merged.bins) <= merged.max_bins, True)
+    check("sketch_roundtrip", QuantileSketch.from_dict(merged.to_dict()).quantile(0.9),
+          merged.quantile(0.9))
+
+
+def test_distributions():
+    bookings = [
+        {"status": "confirmed", "property_id": 1, "referer": "Booking.com", "arrival": "2026-06-10",
+         "departure": "2026-06-12", "price": 200, "booking_time": "2026-06-01"},
+        {"status": "confirmed", "property_id": 2, "referer": "Booking.com", "arrival": "2026-06-10",
+         "departure": "2026-06-14", "price": 480, "booking_time": "2026-05-11"},
+        {"status": "cancelled", "property_id": 2, "referer": "Airbnb", "arrival": "2026-06-10",
+         "departure": "2026-06-20", "price": 999, "booking_time": "2026-01-01"},
+    ]
+    d = M.distribution_metrics(bookings, {1: "A", 2: "B"})
+    by = {r["channel"]: r for r in d["by_channel"]}
+    check("dist_cancelled_excluded", sorted(by), ["Booking.com"])
+    check("dist_los_n", d["overall"]["los"]["n"], 2)
+    check("dist_lead_max", d["overall"]["lead_time"]["max"], 30.0)
+    check("dist_by_property", sorted(r["property"] for r in d["by_property"]), ["A", "B"])
+    check("dist_hist_total", sum(d["histograms"]["los"]["counts"]), 2)
+
+
+def test_daily_cube():
+    rooms = [{"property_id": 1, "qty": 2}, {"property_id": 2, "qty": 1}]
+    bookings = [
+        # 3 nights at 100.00: 3333 + 3333 + 3334 pence -> remainder on the first night
+        {"status": "confirmed", "property_id": 1, "arrival": "2026-05-30",
+         "departure": "2026-06-02", "price": 100},
+        {"status": "confirmed", "property_id": 2, "arrival": "2026-06-05",
+         "departure": "2026-06-07", "price": 240},
+        {"status": "cancelled", "property_id": 2, "arrival": "2026-06-05",
+         "departure": "2026-06-07", "price": 999},
+    ]
+    start, end = dt.date(2026, 5, 1), dt.date(2026, 7, 1)
+    cube = M.daily_cube(bookings, rooms, start, end)
+    check("cube_properties", cube["properties"], [1, 2])
+    check("cube_capacity", cube["capacity"], [2, 1])
+    check("cube_split_pence", cube["revenue_p"][0][29:32], [3334, 3333, 3333])
+    june = M.cube_range(cube, dt.date(2026, 6, 1), dt.date(2026, 7, 1))
+    want = M.occupancy_block(bookings, rooms, dt.date(2026, 6, 1), dt.date(2026, 7, 1))
+    for k in ("available_room_nights", "sold_room_nights", "revenue", "occupancy"):
+        check(f"cube_june_{k}", june[k], want[k], tol=0.01)
+    check("cube_whole_stay_exact", M.cube_range(cube, start, end, {1})["revenue"], 100.0)
+    check("cube_clipped", M.cube_range(cube, dt.date(2026, 6, 20), dt.date(2027, 1, 1))
+          ["available_room_nights"], 3 * 11)
+
+
+def test_room_grid():
+    import roomgrid as R
+    from make_mock import build as make_mock_db
+    F, O, C = R.FULL, R.OPEN, R.CLOSED
+    check("grid_cells", R.room_cells(2, [0, 1, 2, 0], [2, 1, 0, 0]), [O, R.PART, F, C])
+    check("grid_no_avail_row_is_open", R.room_cells(1, [0], [None]), [O])
+    check("grid_orphan", R.mark_orphans([F, O, F, O, O, F]), [F, R.ORPHAN, F, O, O, F])
+    check("grid_edge_not_orphan", R.mark_orphans([O, F, O]), [O, F, O])
+    cells = [F] * 5 + [O] * 3 + [C]
+    check("grid_rle", R.rle(cells), [F, 5, O, 3, C, 1])
+    check("grid_unrle", R.unrle(R.rle(cells)), cells)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_mock_db(os.path.join(tmp, "mock.db"))
+        today = dt.date.today()
+        grid = R.room_grid(path, today, days=30)
+        check("grid_rooms", len(grid["rooms"]), 4)
+        check("grid_run_lengths", all(sum(r["runs"][1::2]) == 30 for r in grid["rooms"]), True)
+        sold = sum(R.unrle(r["runs"]).count(F) for r in grid["rooms"])
+        # mock rooms have qty 1 (and the odd overlapping booking): FULL == nights covered
+        covered = {(b["property_id"], today + dt.timedelta(days=i))
+                   for b in M.load_rows(path)[2] if M._is_active(b["status"])
+                   for i in range(30)
+                   if b["arrival"] <= (today + dt.timedelta(days=i)).isoformat() < b["departure"]}
+        check("grid_full_matches_sold", sold, len(covered))
+
+
+def test_streamed_summary_matches_list():
+    from make_mock import build as make_mock_db
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_mock_db(os.path.join(tmp, "mock.db"))
+        listed = M.build_summary(path, use_cache=False, stream=False)
+        streamed = M.build_summary(path, stream=True, use_cache=True)
+        warm = M.build_summary(path, stream=True, use_cache=True)
+        for s in (listed, streamed, warm):
+            s.pop("generated_at")
+        check("stream_matches_list", streamed == listed, True)
+        check("stream_cached_matches_list", warm == listed, True)
+        rows = list(M.iter_bookings(path, batch_size=7))
+        check("iter_bookings_count", len(rows), listed["counts"]["bookings"])
+        check("iter_bookings_columns", tuple(rows[0]), M.BOOKING_COLUMNS)
+
+
+def test_fingerprint_skip():
+    import build_dashboard as B
+    from make_mock import build as make_mock_db
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_mock_db(os.path.join(tmp, "mock.db"))
+        outputs = [("dash.html", False)]
+        check("fp_first_build", B.build_all(path, outputs, tmp)[1] is not None, True)
+        check("fp_skip_unchanged", B.build_all(path, outputs, tmp)[1] is None, True)
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES ('unrelated','x')")
+        conn.commit()
+        check("fp_skip_unrelated_write", B.build_all(path, outputs, tmp)[1] is None, True)
+        conn.execute("UPDATE bookings SET price = price + 1 WHERE id = (SELECT MIN(id) FROM bookings)")
+        conn.commit()
+        conn.close()
+        check("fp_rebuild_on_change", B.build_all(path, outputs, tmp)[1] is not None, True)
+        check("fp_force", B.build_all(path, outputs, tmp, force=True)[1] is not None, True)
+        leftovers = [f for f in os.listdir(tmp) if f.endswith(".tmp")]
+        check("fp_no_temp_files", leftovers, [])
+
+
+def test_split_build():
+    import json
+    import build_dashboard as B
+    import columnar
+    from make_mock import build as make_mock_db
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_mock_db(os.path.join(tmp, "mock.db"))
+        site = os.path.join(tmp, "site")
+        manifest, summary = B.build_split(path, site)
+        for key in ("shell", "chart", "summary"):
+            check(f"split_{key}_exists", os.path.exists(os.path.join(site, manifest[key])), True)
+        with open(os.path.join(site, manifest["summary"])) as f:
+            check("split_summary_roundtrip", columnar.decode(json.load(f)) == summary, True)
+        with open(os.path.join(site, manifest["shell"])) as f:
+            shell = f.read()
+        check("split_shell_has_no_data", summary["generated_at"] in shell, False)
+        check("split_shell_loads_hashed_chart", f'src="{manifest["chart"]}"' in shell, True)
+        check("split_skip_unchanged", B.build_split(path, site)[1] is None, True)
+        again, _ = B.build_split(path, site, force=True)
+        check("split_shell_stable", again["shell"], manifest["shell"])
+        for _ in range(4):
+            B.build_split(path, site, force=True)
+        n = sum(1 for f in os.listdir(site) if f.startswith("summary.") and f.endswith(".json"))
+        check("split_prunes_old_summaries", n <= B.SPLIT_KEEP, True)
+
+
+def test_columnar_encoding():
+    import gzip
+    import json
+    import columnar
+    import build_dashboard as B
+    from make_mock import build as make_mock_db
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_mock_db(os.path.join(tmp, "mock.db"))
+        summary = M.build_summary(path)
+        enc = json.loads(json.dumps(columnar.encode(summary)))
+        check("columnar_roundtrip", columnar.decode(enc) == summary, True)
+        check("columnar_smaller", len(json.dumps(enc)) < len(json.dumps(summary)), True)
+        check("columnar_channel_dict", sorted(enc["_dict"]["channel"]),
+              sorted({r["channel"] for r in summary["feed"] + summary["channel_mix"]}))
+        check("columnar_property_dict", sorted(enc["_dict"]["property_id"]),
+              sorted({r["property_id"] for r in summary["feed"]}))
+        check("columnar_property_indexed", set(enc["feed"]["cols"]["property_id"]),
+              set(range(len(enc["_dict"]["property_id"]))))
+        names = {p["name"] for p in summary["properties"]}
+        check("columnar_property_names_dict", sorted(enc["_dict"]["property"]),
+              sorted({r["property"] for r in summary["feed"]}))
+        check("columnar_no_raw_names", [v for f, col in enc["feed"]["cols"].items()
+                                        for v in col if v in names], [])
+        check("columnar_passthrough", columnar.decode({"a": 1}), {"a": 1})
+        out = os.path.join(tmp, "dash.html")
+        B.build(path, out)
+        with open(out, "rb") as f, gzip.open(out + ".gz") as g:
+            check("gz_sibling_matches", g.read() == f.read(), True)
+
+
+def test_bookings_pagination():
+    import bookings_query as Q
+    from make_mock import build as make_mock_db
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_mock_db(os.path.join(tmp, "mock.db"))
+        conn = sqlite3.connect(path)
+        Q.ensure_indexes(conn)
+        rows = conn.execute("SELECT arrival, id, referer, channel, property_id FROM bookings "
+                            "WHERE arrival IS NOT NULL").fetchall()
+        want_all = sorted((a, i) for a, i, _, _, _ in rows)
+        got, cursor, pages = [], None, 0
+        while True:
+            page = Q.query_bookings(conn, cursor=cursor, limit=17)
+            got += [(r["arrival"], r["id"]) for r in page["rows"]]
+            pages += 1
+            cursor = page["next"]
+            if not cursor:
+                break
+        check("keyset_walk_matches_sort", got == want_all, True)
+        check("keyset_pages", pages, -(-len(want_all) // 17))
+        chan = M._channel({"referer": rows[0][2], "channel": rows[0][3]})
+        page = Q.query_bookings(conn, channel=chan, property_id=rows[0][4], limit=500)
+        want = sorted((a, i) for a, i, r, c, p in rows
+                      if p == rows[0][4] and M._channel({"referer": r, "channel": c}) == chan)
+        check("keyset_filtered", [(r["arrival"], r["id"]) for r in page["rows"]] == want, True)
+        plan = " ".join(str(r) for r in conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT id FROM bookings WHERE {Q.CHANNEL_SQL} IN (?) "
+            "AND (arrival, id) > (?, ?) ORDER BY arrival, id LIMIT 50", (chan, "2026-01-01", 0)))
+        check("keyset_uses_channel_index", "idx_bookings_channel" in plan, True)
+        try:
+            Q.decode_cursor("not-a-cursor")
+            check("bad_cursor_rejected", False, True)
+        except ValueError:
+            check("bad_cursor_rejected", True, True)
+        conn.close()
+        summary = M.build_summary(path)
+        first = Q.feed_page(path)
+        check("summary_feed_is_first_page", summary["feed"] == first["rows"], True)
+        check("summary_feed_next", summary["feed_next"], first["next"])
+
+
+def test_dashboard_server():
+    import threading
+    import urllib.error
+    import urllib.request
+    import dashboard_server
+    from make_mock import build as make_mock_db
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_mock_db(os.path.join(tmp, "mock.db"))
+        server = dashboard_server.make_server(path, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        def get(url, etag=None):
+            req = urllib.request.Request(base + url, headers={"If-None-Match": etag} if etag else {})
+            try:
+                with urllib.request.urlopen(req) as r:
+                    return r.status, r.headers["ETag"]
+            except urllib.error.HTTPError as e:
+                return e.code, e.headers["ETag"]
+
+        try:
+            status, etag = get("/summary.json")
+            check("server_summary_ok", status, 200)
+            check("server_page_ok", get("/")[0], 200)
+            check("server_inbox_ok", get("/messages")[0], 200)
+            check("server_404", get("/nope")[0], 404)
+            check("server_search_no_messages", get("/api/messages/search?q=parking")[0], 200)
+            check("server_thread_no_messages_404", get("/threads/1.json")[0], 404)
+            check("server_304", get("/summary.json", etag)[0], 304)
+            builds = server.cache.rebuilds
+            conn = sqlite3.connect(path)
+            conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES ('unrelated','x')")
+            conn.commit()
+            get("/")
+            check("server_unrelated_write_no_rebuild", server.cache.rebuilds, builds)
+            conn.execute("UPDATE bookings SET price = price + 1 WHERE id = (SELECT MIN(id) FROM bookings)")
+            conn.commit()
+            conn.close()
+            status, new_etag = get("/summary.json", etag)
+            check("server_change_200", status, 200)
+            check("server_change_new_etag", new_etag != etag, True)
+            check("server_rebuilt_dashboard_only", server.cache.rebuilds, builds + 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.cache.close()
+
+
 if __name__ == "__main__":
     print("Running metric unit tests...")
     test_occupancy_and_rates()
     test_proration_across_boundary()
     test_channel_mix()
     test_lead_time()
+    test_closed_month_cache()
+    test_pickup_matrix()
+    test_quantile_sketch()
+    test_distributions()
+    test_daily_cube()
+    test_room_grid()
+    test_streamed_summary_matches_list()
+    test_fingerprint_skip()
+    test_split_build()
+    test_columnar_encoding()
+    test_bookings_pagination()
+    test_dashboard_server()
     if failures:
         print(f"\n{len(failures)} FAILURE(S): {failures}")
         sys.exit(1)
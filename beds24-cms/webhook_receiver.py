@@ -0,0 +1,348 @@
+"""
+Webhook receiver — Beds24 pushes booking / message notifications here and each
+one refreshes just the booking it names, instead of waiting for the next poll.
+
+A notification is only a trigger: the booking id is taken from the payload and
+the booking and its messages are re-read from the API through the same code as
+the pollers (fetch.fetch_booking, sweep_scheduler.check_booking -> ingest_messages,
+the threads table and the FTS index), so a forged or truncated payload can't put
+anything in the DB that Beds24 doesn't return. Requests are answered at once; a
+single worker thread does the API calls, coalescing repeat notifications for a
+booking that is already queued. After a batch that changed messages the inbox is
+rebuilt (build_messages_dashboard.py; a no-op when nothing it shows moved).
+
+While the receiver runs it keeps a heartbeat in meta ('messages_webhook'), and
+messages_fetch.py drops to one reconciliation poll per RECONCILE_MINUTES for as
+long as deliveries keep arriving; daily fetch.py still reconciles bookings.
+
+Point the Beds24 booking webhook at the CMS, proxied to this server (it binds to
+localhost), with the shared secret from BEDS24_WEBHOOK_SECRET either in the URL
+(?token=...) or an X-Webhook-Token header. Without the variable set, any local
+POST is accepted — fine behind a proxy that adds its own auth, not otherwise.
+
+Every accepted payload is kept in raw/webhooks/ (the last WEBHOOK_KEEP), so a
+real delivery can be replayed against a local receiver:
+
+Run:  python webhook_receiver.py [--port 8766] [--host 127.0.0.1] [--no-build]
+      python webhook_receiver.py --replay raw/webhooks/*.json [--url http://127.0.0.1:8766/webhook]
+"""
+
+import argparse
+import datetime as dt
+import functools
+import hmac
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from beds24_client import Beds24Client, Beds24Error, Beds24RateLimit
+from common import DB_PATH, HERE
+from db import connect
+from fetch import fetch_booking, init_db
+from fieldmap import probe
+from messages_fetch import WEBHOOK_KEY, init_messages_table, read_webhook_state
+from messages_inbox import _now_epoch
+from sweep_scheduler import check_booking, init_state_table
+
+RECORD_DIR = os.path.join(HERE, "raw", "webhooks")
+HOST = "127.0.0.1"
+PORT = 8766
+PATH = "/webhook"
+SECRET_ENV = "BEDS24_WEBHOOK_SECRET"
+
+MAX_BODY = 1 << 20          # bytes; Beds24 payloads are a few KB
+WEBHOOK_KEEP = 200          # recorded payloads kept in RECORD_DIR
+HEARTBEAT_SECONDS = 60      # meta heartbeat while idle (messages_fetch reads it)
+RATE_LIMIT_SLEEP = 60       # fallback pause after a 429 without a reset header
+BOOKING_FIELDS = ("arrival", "departure", "propertyId", "roomId", "status")
+BOOKING_ID_KEYS = ("bookingId", "bookId", "booking_id")
+
+
+def booking_ids(payload):
+    """Booking ids a notification refers to. Tolerant of shape: a booking object
+    (under "booking"/"bookings", or a top-level object with booking fields and no
+    bookingId), anything carrying bookingId (messages, "data" lists), or a list of
+    any of those."""
+    out = set()
+
+    def add(v):
+        try:
+            if v is not None:
+                out.add(int(v))
+        except (TypeError, ValueError):
+            pass
+
+    def walk(node, is_booking, depth=0):
+        if depth > 4:
+            return
+        if isinstance(node, list):
+            for x in node:
+                walk(x, is_booking, depth + 1)
+            return
+        if not isinstance(node, dict):
+            return
+        ref = probe(node, BOOKING_ID_KEYS)
+        add(ref)
+        # a node naming its booking is something else (a message: its own id is
+        # never taken as a booking's, however booking-like its other fields)
+        if is_booking or (ref is None and any(k in node for k in BOOKING_FIELDS)):
+            add(node.get("id"))
+        for key in ("booking", "bookings"):
+            walk(node.get(key), True, depth + 1)
+        for key in ("data", "messages"):
+            walk(node.get(key), False, depth + 1)
+
+    walk(payload, False)
+    return sorted(out)
+
+
+def _save_state(conn, **updates):
+    state = read_webhook_state(conn)
+    state.update(updates)
+    conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)",
+                 (WEBHOOK_KEY, json.dumps(state)))
+    conn.commit()
+
+
+def record(payload, folder=RECORD_DIR, keep=WEBHOOK_KEEP):
+    """Keep the payload for --replay; only the newest `keep` are retained."""
+    os.makedirs(folder, exist_ok=True)
+    stamp = dt.datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    with open(os.path.join(folder, f"{stamp}.json"), "w") as f:
+        json.dump(payload, f, indent=2)
+    names = sorted(n for n in os.listdir(folder) if n.endswith(".json"))
+    for n in names[:max(len(names) - keep, 0)]:
+        os.remove(os.path.join(folder, n))
+
+
+class Refresher:
+    """Worker thread that re-reads queued bookings from the API. submit() never
+    blocks on the API; a booking already waiting is not queued twice."""
+
+    def __init__(self, client, db_path=DB_PATH, on_change=None):
+        self.client = client
+        self.db_path = db_path
+        self.on_change = on_change
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.received = self.processed = self.changed = self.errors = 0
+        self.dirty = False  # messages changed since the last on_change()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, ids):
+        """Queue a notification's bookings; returns those not already waiting."""
+        with self.lock:
+            self.received += 1
+        return [bid for bid in ids if self._enqueue(bid)]
+
+    def _enqueue(self, bid):
+        with self.lock:
+            if bid in self.pending:
+                return False
+            self.pending.add(bid)
+        self.queue.put(bid)
+        return True
+
+    def drain(self, timeout=10):
+        """Wait until everything submitted so far is processed (tests, --replay)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.queue.unfinished_tasks == 0:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def refresh(self, conn, booking_id):
+        """Re-read one booking and its messages; True if its messages changed."""
+        fetch_booking(self.client, conn, booking_id)
+        return check_booking(self.client, conn, booking_id, _now_epoch())
+
+    def _run(self):
+        conn = connect(self.db_path)
+        init_db(conn)
+        init_messages_table(conn)
+        init_state_table(conn)
+        _save_state(conn, alive_at=dt.datetime.now().isoformat(timespec="seconds"))
+        try:
+            while True:
+                try:
+                    bid = self.queue.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    _save_state(conn, alive_at=dt.datetime.now().isoformat(timespec="seconds"))
+                    continue
+                if bid is None:
+                    self.queue.task_done()
+                    return
+                self._process(conn, bid)
+        finally:
+            conn.close()
+
+    def _process(self, conn, bid):
+        with self.lock:
+            self.pending.discard(bid)
+        try:
+            changed = self.refresh(conn, bid)
+            self.changed += changed
+            self.dirty |= changed
+        except Beds24RateLimit as e:
+            # back in the queue, then wait out the window; repeat notifications
+            # for it coalesce onto the queued copy meanwhile
+            print(f"Rate limited refreshing booking {bid}: {e}")
+            self._enqueue(bid)
+            self.queue.task_done()
+            time.sleep(float(e.resets_in or RATE_LIMIT_SLEEP))
+            return
+        except (Beds24Error, sqlite3.Error) as e:
+            self.errors += 1
+            print(f"Refreshing booking {bid} failed: {e}")
+        self.processed += 1
+        now = dt.datetime.now().isoformat(timespec="seconds")
+        refreshed = int(read_webhook_state(conn).get("refreshed") or 0) + 1
+        _save_state(conn, alive_at=now, last_at=now, refreshed=refreshed)
+        if self.dirty and self.queue.empty():
+            # one rebuild per burst of notifications, not per booking
+            self.dirty = False
+            if self.on_change:
+                try:
+                    self.on_change()
+                except Exception as e:  # a failed build must not stop the receiver
+                    print(f"Inbox rebuild failed: {e}")
+        self.queue.task_done()
+
+
+def _authorized(handler, query, secret):
+    if not secret:
+        return True
+    token = handler.headers.get("X-Webhook-Token") or (parse_qs(query).get("token") or [""])[-1]
+    return hmac.compare_digest(token.encode("utf-8"), secret.encode("utf-8"))
+
+
+def make_handler(refresher, secret=None, record_dir=RECORD_DIR):
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != PATH:
+                self.send_error(404)
+                return
+            if not _authorized(self, url.query, secret):
+                self.send_error(403)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY:
+                self.send_error(413)
+                return
+            try:
+                payload = json.loads(self.rfile.read(length) or b"null")
+            except ValueError:
+                self.send_error(400, "body is not JSON")
+                return
+            ids = booking_ids(payload)
+            if record_dir:
+                record(payload, record_dir)
+            self._reply(200, {"bookings": ids, "queued": refresher.submit(ids)})
+
+        def do_GET(self):
+            if urlsplit(self.path).path != "/healthz":
+                self.send_error(404)
+                return
+            self._reply(200, {"ok": True, "received": refresher.received,
+                              "processed": refresher.processed,
+                              "changed": refresher.changed, "errors": refresher.errors,
+                              "queued": refresher.queue.qsize()})
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def make_server(client, db_path=DB_PATH, host=HOST, port=PORT, secret=None,
+                on_change=None, record_dir=RECORD_DIR):
+    refresher = Refresher(client, db_path, on_change).start()
+    server = ThreadingHTTPServer((host, port), make_handler(refresher, secret, record_dir))
+    server.refresher = refresher
+    return server
+
+
+def replay(paths, url):
+    """POST recorded payloads to a running receiver; returns its replies."""
+    out = []
+    for path in paths:
+        with open(path, "rb") as f:
+            req = urllib.request.Request(url, data=f.read(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req) as r:
+                out.append((path, r.status, json.loads(r.read())))
+        except urllib.error.HTTPError as e:
+            out.append((path, e.code, None))
+    return out
+
+
+def _rebuild_inbox(db_path=DB_PATH):
+    from build_messages_dashboard import build
+    path, inbox = build(db_path)
+    if inbox is not None:
+        print(f"Inbox rebuilt: {path}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--no-build", action="store_true",
+                    help="Don't rebuild messages-dashboard.html after changes")
+    ap.add_argument("--replay", nargs="+", metavar="JSON",
+                    help="POST recorded payloads to --url instead of serving")
+    ap.add_argument("--url", default=None, help="Receiver URL for --replay")
+    args = ap.parse_args()
+    secret = os.environ.get(SECRET_ENV) or None
+
+    if args.replay:
+        url = args.url or f"http://{args.host}:{args.port}{PATH}"
+        if secret:
+            url += ("&" if "?" in url else "?") + "token=" + secret
+        for path, status, reply in replay(args.replay, url):
+            print(f"{status} {path}: {reply}")
+        raise SystemExit(0)
+
+    if not os.path.exists(args.db):
+        raise SystemExit("data/beds24.db not found — run fetch.py first to load bookings.")
+    server = make_server(Beds24Client(), args.db, args.host, args.port, secret,
+                         on_change=None if args.no_build else
+                         functools.partial(_rebuild_inbox, args.db))
+    print(f"Receiving webhooks on http://{args.host}:{server.server_address[1]}{PATH}"
+          f"{'' if secret else f' (no {SECRET_ENV} set: unauthenticated)'} — Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.refresher.stop()